@@ -0,0 +1,17 @@
+#!/bin/bash
+
+# 1440x721, same data unsharded and sharded
+data="/projects/prjs0981/ewalt/zarr-snellius-benchmark/data/sharding_exp/era5_6h_aurora_2022-2022-wb13-6h-1440x721"
+for store in ds ds-shard28 ds-shard124; do
+    ./slurm/benchmark.sh 3 \
+        --dataset $data.$store.zarr-v3 \
+        --date_start 2022-01-01 \
+        --date_end 2022-12-31 \
+        --experiment_dir ./experiments/sharding_exp_1440x721
+    ./slurm/benchmark.sh 3 \
+        --dataset $data.$store.zarr-v3 \
+        --date_start 2022-01-01 \
+        --date_end 2022-12-31 \
+        --dataset_class zarr \
+        --experiment_dir ./experiments/sharding_exp_1440x721
+done
@@ -0,0 +1,70 @@
+import xarray as xr
+import argparse
+import pytest
+import torch
+import zarr
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from synthetic import synthetic_dataset
+from write import write_zarr, write_memmap
+from args import Arguments
+from utils import load_dataset
+
+# small enough to write in a few seconds, large enough for a sample to span several chunks
+NUM_TIMESTEPS = 24
+RESOLUTION = (64, 33)
+VARIABLES = Arguments.VARIABLES.kwargs["default"]
+LEVELS = Arguments.LEVELS.kwargs["default"]
+ZARR_FORMAT = int(zarr.__version__[0])
+
+def write_chunks(strategy: str) -> dict:
+    """
+    Chunks of a --chunks_write_strategy.
+    """
+    return Arguments.CHUNKS_WRITE_STRATEGY.kwargs["type"](strategy)
+
+def store_args(path: str) -> argparse.Namespace:
+    """
+    The arguments `load_dataset` reads, for a synthetic store.
+    """
+    return argparse.Namespace(
+        dataset=path,
+        chunks_open_strategy=None,
+        zarr_format=ZARR_FORMAT,
+        date_range=[None, None],
+        variables=VARIABLES,
+        levels=LEVELS,
+    )
+
+@pytest.fixture(scope="session", autouse=True)
+def torch_threads():
+    # timings of the main process do not depend on the number of cores of the machine
+    torch.set_num_threads(1)
+
+@pytest.fixture(scope="session")
+def synthetic_ds() -> xr.Dataset:
+    return synthetic_dataset(num_timesteps=NUM_TIMESTEPS, grid=RESOLUTION, variables=VARIABLES, levels=LEVELS)
+
+@pytest.fixture(scope="session", params=["optimal_dataset", "optimal_dataarray"])
+def store(request, synthetic_ds, tmp_path_factory) -> str:
+    """
+    Path of a synthetic store written with one timestep per chunk, as a dataset or as a dataarray.
+    """
+    path = str(tmp_path_factory.mktemp("stores") / f"{request.param}-v{ZARR_FORMAT}")
+    write_zarr(synthetic_ds, path, new_chunks=write_chunks(request.param))
+    return path
+
+@pytest.fixture(scope="session")
+def memmap_store(synthetic_ds, tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp("stores") / "memmap")
+    write_memmap(synthetic_ds, path, VARIABLES, LEVELS)
+    return path
+
+def open_store(path: str, as_dataarray: bool=False) -> xr.Dataset|xr.DataArray:
+    """
+    The store opened as the benchmark opens it (`as_dataarray` for BaseDataset and MemmapDataset on a dataarray layout).
+    """
+    return load_dataset(store_args(path), force_zarr_format=True, as_dataarray=as_dataarray)
@@ -0,0 +1,91 @@
+import itertools
+import pytest
+import torch
+
+from torch.utils.data import DataLoader
+
+pytest.importorskip("pytest_benchmark")
+
+from dataset import BaseDataset, ZarrDataset, AsyncZarrDataset, MemmapDataset, sample_to_tensor
+from streaming import StreamingDataset
+from conftest import open_store, VARIABLES, LEVELS
+
+DATASET_CLASSES = ["xarray", "zarr", "async_zarr", "memmap"]
+
+def create_dataset(dataset_class: str, path: str, memmap_path: str, **kwargs) -> BaseDataset:
+    kwargs = dict(num_input_timesteps=2, num_output_timesteps=1, variables=VARIABLES, levels=LEVELS, **kwargs)
+    if dataset_class == "zarr":
+        return ZarrDataset(open_store(path), path=path, **kwargs)
+    elif dataset_class == "async_zarr":
+        return AsyncZarrDataset(open_store(path), path=path, **kwargs)
+    elif dataset_class == "memmap":
+        return MemmapDataset(open_store(path, as_dataarray=True), path=memmap_path, **kwargs)
+    return BaseDataset(open_store(path, as_dataarray=True), **kwargs)
+
+def skip_layout(dataset_class: str, path: str):
+    if not "dataarray" in path: return
+    if dataset_class in ["zarr", "async_zarr"]: pytest.skip("dataarray layouts are not supported")
+
+def bench_info(benchmark, dataset: BaseDataset, num_samples: int=1):
+    benchmark.extra_info["sample_mb"] = dataset.sample_timesteps * dataset.num_channels * int(torch.Size(dataset.spatial_shape).numel()) * dataset.out_dtype.itemsize / 1024**2
+    benchmark.extra_info["samples_per_round"] = num_samples
+
+@pytest.mark.parametrize("dataset_class", DATASET_CLASSES)
+def test_getitem(benchmark, dataset_class, store, memmap_store):
+    skip_layout(dataset_class, store)
+    dataset = create_dataset(dataset_class, store, memmap_store)
+    indices = itertools.cycle(range(len(dataset)))
+    inputs, outputs = benchmark(lambda: dataset[next(indices)])
+    bench_info(benchmark, dataset)
+    assert inputs.shape == (2, dataset.num_channels, *dataset.spatial_shape)
+
+def test_sample_to_tensor(benchmark, synthetic_ds):
+    # conversion of decoded arrays only, reads are covered by test_getitem
+    sample = synthetic_ds[VARIABLES].sel(level=LEVELS).isel(time=slice(0, 3)).compute()
+    tensor = benchmark(sample_to_tensor, sample)
+    benchmark.extra_info["sample_mb"] = tensor.nbytes / 1024**2
+    assert tensor.shape[:2] == (3, 4 + 5 * len(LEVELS))
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+@pytest.mark.parametrize("dataset_class", DATASET_CLASSES)
+def test_dataloader(benchmark, dataset_class, num_workers, store, memmap_store):
+    skip_layout(dataset_class, store)
+    dataset = create_dataset(dataset_class, store, memmap_store)
+    loader = DataLoader(dataset, batch_size=4, shuffle=True, num_workers=num_workers)
+
+    def epoch():
+        return sum(1 for _ in loader)
+
+    # one epoch per round, worker startup included as in a training epoch
+    num_batches = benchmark.pedantic(epoch, rounds=3, iterations=1, warmup_rounds=1)
+    bench_info(benchmark, dataset, num_samples=len(dataset))
+    # no stats with --benchmark-disable
+    if benchmark.stats is not None: benchmark.extra_info["samples_per_s"] = len(dataset) / benchmark.stats.stats.mean
+    assert num_batches == -(-len(dataset) // 4)
+
+@pytest.mark.parametrize("shared_cache_mb", [0, 64])
+@pytest.mark.parametrize("dataset_class", ["xarray", "zarr"])
+def test_dataloader_shared_cache(benchmark, dataset_class, shared_cache_mb, store, memmap_store):
+    skip_layout(dataset_class, store)
+    dataset = create_dataset(dataset_class, store, memmap_store, shared_cache_bytes=int(shared_cache_mb * 1024**2))
+    loader = DataLoader(dataset, batch_size=4, shuffle=True, num_workers=2)
+
+    # the cache lives across rounds, as across the epochs of a training
+    num_batches = benchmark.pedantic(lambda: sum(1 for _ in loader), rounds=3, iterations=1, warmup_rounds=1)
+    bench_info(benchmark, dataset, num_samples=len(dataset))
+    if benchmark.stats is not None: benchmark.extra_info["samples_per_s"] = len(dataset) / benchmark.stats.stats.mean
+    if dataset.shared_cache is not None: dataset.shared_cache.close()
+    assert num_batches == -(-len(dataset) // 4)
+
+@pytest.mark.parametrize("shuffle_buffer", [0, 16])
+@pytest.mark.parametrize("dataset_class", ["xarray", "zarr", "memmap"])
+def test_dataloader_streaming(benchmark, dataset_class, shuffle_buffer, store, memmap_store):
+    skip_layout(dataset_class, store)
+    dataset = StreamingDataset(create_dataset(dataset_class, store, memmap_store), block_timesteps=8, shuffle_buffer=shuffle_buffer)
+    loader = DataLoader(dataset, batch_size=4, num_workers=2)
+
+    num_batches = benchmark.pedantic(lambda: sum(1 for _ in loader), rounds=3, iterations=1, warmup_rounds=1)
+    bench_info(benchmark, dataset.dataset, num_samples=len(dataset))
+    if benchmark.stats is not None: benchmark.extra_info["samples_per_s"] = len(dataset) / benchmark.stats.stats.mean
+    # batches are formed per worker, the last batch of each worker may be partial
+    assert num_batches >= -(-len(dataset) // 4)
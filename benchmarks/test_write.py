@@ -0,0 +1,46 @@
+import xarray as xr
+import pytest
+import shutil
+
+pytest.importorskip("pytest_benchmark")
+
+from synthetic import synthetic_dataset
+from write import write_zarr, write_zarr_regions, write_memmap
+from conftest import write_chunks, VARIABLES, LEVELS, NUM_TIMESTEPS, RESOLUTION, ZARR_FORMAT
+
+@pytest.fixture(scope="module")
+def loaded_ds(synthetic_ds):
+    # writes only, the synthetic fields are generated once
+    return synthetic_ds.compute().chunk({"time": 1})
+
+@pytest.mark.parametrize("codec", [None, "zstd-3"])
+@pytest.mark.parametrize("chunks_write_strategy", ["optimal_dataset", "optimal_dataarray"])
+def test_write_zarr(benchmark, loaded_ds, tmp_path, chunks_write_strategy, codec):
+    path = str(tmp_path / f"{chunks_write_strategy}-v{ZARR_FORMAT}")
+    benchmark.pedantic(
+        write_zarr, 
+        args=(loaded_ds, path), 
+        kwargs=dict(exist_ok=True, new_chunks=write_chunks(chunks_write_strategy), codec=codec),
+        setup=lambda: shutil.rmtree(path, ignore_errors=True),
+        rounds=3,
+    )
+    benchmark.extra_info["mb"] = loaded_ds.nbytes / 1024**2
+    # no stats with --benchmark-disable
+    if benchmark.stats is not None: benchmark.extra_info["mb_per_s"] = loaded_ds.nbytes / 1024**2 / benchmark.stats.stats.mean
+
+def test_write_memmap(benchmark, loaded_ds, tmp_path):
+    path = str(tmp_path / "memmap")
+    summary = benchmark.pedantic(write_memmap, args=(loaded_ds, path, VARIABLES, LEVELS), rounds=3)
+    benchmark.extra_info["mb"] = summary["nbytes"] / 1024**2
+
+def test_write_zarr_regions_resume(loaded_ds, tmp_path):
+    # not timed: a rerun resumes the same write, and restarts when the levels change (same number of levels)
+    path = str(tmp_path / f"regions-v{ZARR_FORMAT}")
+    kwargs = dict(region_timesteps=6, new_chunks=write_chunks("optimal_dataset"))
+    assert write_zarr_regions(loaded_ds, path, **kwargs)["written_regions"] == 4
+    assert write_zarr_regions(loaded_ds, path, **kwargs)["written_regions"] == 0
+
+    levels = [level + 5 for level in LEVELS]
+    other_ds = synthetic_dataset(num_timesteps=NUM_TIMESTEPS, grid=RESOLUTION, variables=VARIABLES, levels=levels).compute().chunk({"time": 1})
+    assert write_zarr_regions(other_ds, path, **kwargs)["written_regions"] == 4
+    assert xr.open_zarr(path, zarr_format=ZARR_FORMAT)["level"].values.tolist() == levels
@@ -0,0 +1,37 @@
+#!/bin/bash
+
+# 1440x721, zarr v3 only (sharding is a zarr v3 feature)
+dataset=gs://weatherbench2/datasets/era5/1959-2023_01_10-wb13-6h-1440x721.zarr/
+start_year=2022
+end_year=2022
+
+output="/projects/prjs0981/ewalt/zarr-snellius-benchmark/data/sharding_exp/era5_6h_aurora_$start_year-$end_year-wb13-6h-1440x721"
+
+# Unsharded (one file per timestep and variable)
+./slurm/download.sh \
+    3 \
+    --dataset $dataset \
+    --output $output.ds.zarr \
+    --date_start $start_year-01-01 \
+    --date_end $end_year-12-31 \
+    --chunks_write_strategy optimal_dataset
+
+# Sharded, 28 timesteps (1 week) per shard
+./slurm/download.sh \
+    3 \
+    --dataset $dataset \
+    --output $output.ds-shard28.zarr \
+    --date_start $start_year-01-01 \
+    --date_end $end_year-12-31 \
+    --chunks_write_strategy optimal_dataset \
+    --shard_shape 28
+
+# Sharded, 124 timesteps (1 month) per shard
+./slurm/download.sh \
+    3 \
+    --dataset $dataset \
+    --output $output.ds-shard124.zarr \
+    --date_start $start_year-01-01 \
+    --date_end $end_year-12-31 \
+    --chunks_write_strategy optimal_dataset \
+    --shard_shape 124
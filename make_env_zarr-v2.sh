@@ -3,5 +3,5 @@ python3.11 -m venv env/venv_zarr-v2
 source env/venv_zarr-v2/bin/activate
 which python
 
-pip install "xarray[complete]" torch torchaudio torchvision gcsfs PyYAML ipykernel zarr==2.18.7 codename
+pip install "xarray[complete]" torch torchaudio torchvision gcsfs PyYAML ipykernel zarr==2.18.7 codename pytest pytest-benchmark
 python -c "import torch, gcsfs, xarray, zarr ; print('zarr version:', zarr.__version__)"
@@ -6,9 +6,32 @@ def _parse_chunks_write_strategy(choice):
         return {"time": 1, "latitude": -1, "longitude": -1, "level": -1}
     elif choice == "optimal_dataarray":
         return {"time": 1, "latitude": -1, "longitude": -1, "level": -1, "variable": -1}
+    elif choice.split("-")[0] in ["tiled_dataset", "tiled_dataarray"]:
+        # tiled_<layout>[-<lat>x<lon>]: lat/lon tiles of this size, for patch reads (default: 64x64)
+        layout, _, tile = choice.partition("-")
+        lat_tile, lon_tile = (int(n) for n in (tile or "64x64").split("x"))
+        chunks = {"time": 1, "latitude": lat_tile, "longitude": lon_tile, "level": -1}
+        if layout == "tiled_dataarray": chunks["variable"] = -1
+        return chunks
     else:
         raise ValueError(f"Invalid chunks write strategy: {choice}")
 
+def _parse_shard_shape(value):
+    """Parse the shard shape argument: a number of timesteps per shard or a dict of shard sizes."""
+    try: return {"time": int(value)}
+    except ValueError: pass
+    shards = eval(value)
+    if not isinstance(shards, dict):
+        raise ValueError(f"Invalid shard shape: {value}")
+    return shards
+
+def _parse_var_codec(value):
+    """Parse a per-variable codec argument of the form <variable>=<codec>."""
+    var, sep, codec = value.partition("=")
+    if not sep or not var or not codec:
+        raise ValueError(f"Invalid variable codec: {value}")
+    return var, codec
+
 @dataclasses.dataclass
 class ArgumentItem(object):
     """Class to represent an argument item."""
@@ -54,9 +77,17 @@ class Arguments(object):
         "kwargs": {
             "type": _parse_chunks_write_strategy,         
             "default": "optimal_dataset",
-            "help": "Chunking strategy for writing the xarray dataset. Must be one of ['optimal_dataset', 'optimal_dataarray'] (default: optimal_dataset)"
+            "help": "Chunking strategy for writing the xarray dataset. Must be one of ['optimal_dataset', 'optimal_dataarray', 'tiled_dataset[-<lat>x<lon>]', 'tiled_dataarray[-<lat>x<lon>]'], the tiled strategies chunk latitude and longitude in tiles of <lat>x<lon> grid points, 64x64 if omitted (default: optimal_dataset)"
         },
     })
+    SHARD_SHAPE = ArgumentItem(**{
+        "flag": "--shard_shape",
+        "kwargs": {
+            "type": _parse_shard_shape,
+            "default": None,
+            "help": "Shard shape for zarr v3 output, either a number of timesteps per shard or a dict of shard sizes per dimension (default: no sharding)"
+        }
+    })
     COMPRESS_VARS = ArgumentItem(**{
         "flag": "--compress_vars",
         "kwargs": {
@@ -73,6 +104,72 @@ class Arguments(object):
             "help": "Compress coordinates in the dataset"
         }
     })
+    CODEC = ArgumentItem(**{
+        "flag": "--codec",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Codec spec of the variables, e.g. blosc-lz4-5-shuffle, zstd-3, none, blosc-zstd-3+bitround-12, overrides --compress_vars (default: None)"
+        }
+    })
+    VAR_CODECS = ArgumentItem(**{
+        "flag": "--var_codecs",
+        "kwargs": {
+            "type": _parse_var_codec,
+            "nargs": "+",
+            "default": [],
+            "help": "Codec spec per variable as <variable>=<codec>, overrides --codec (default: None)"
+        }
+    })
+    REGION_TIMESTEPS = ArgumentItem(**{
+        "flag": "--region_timesteps",
+        "kwargs": {
+            "type": int,
+            "default": 0,
+            "help": "Write the output as regions of this many timesteps in parallel and resumable, 0 writes it at once (default: 0)"
+        }
+    })
+    WRITE_WORKERS = ArgumentItem(**{
+        "flag": "--write_workers",
+        "kwargs": {
+            "type": int,
+            "default": 4,
+            "help": "Number of regions written concurrently (default: 4)"
+        }
+    })
+    WRITE_EXECUTOR = ArgumentItem(**{
+        "flag": "--write_executor",
+        "kwargs": {
+            "type": str,
+            "default": "thread",
+            "choices": ["thread", "process"],
+            "help": "Pool of the region writers (default: thread)"
+        }
+    })
+    MAX_MEM = ArgumentItem(**{
+        "flag": "--max_mem",
+        "kwargs": {
+            "type": float,
+            "default": 0,
+            "help": "Rechunk the source with blocks of at most this many MB per write worker, through a temporary store if needed, 0 rechunks with dask at once (default: 0)"
+        }
+    })
+    TEMP_STORE = ArgumentItem(**{
+        "flag": "--temp_store",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Intermediate store of a two-stage rechunk with --max_mem (default: <OUTPUT>.tmp)"
+        }
+    })
+    RESTART = ArgumentItem(**{
+        "flag": "--restart",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Ignore the region manifest of a previous run and rewrite the output from scratch"
+        }
+    })
     VARIABLES = ArgumentItem(**{
         "flag": "--variables",
         "kwargs": {
@@ -206,7 +303,573 @@ class Arguments(object):
             "default": 100,
             "help": "Number of samples to benchmark"
         }
-    }) 
-    
-    
-    
\ No newline at end of file
+    })
+    DATASET_CLASS = ArgumentItem(**{
+        "flag": "--dataset_class",
+        "kwargs": {
+            "type": str,
+            "default": "xarray",
+            "choices": ["xarray", "zarr", "async_zarr", "memmap"],
+            "help": "Read path of the dataset: 'xarray' (BaseDataset, xarray/dask), 'zarr' (ZarrDataset, zarr arrays directly), 'async_zarr' (AsyncZarrDataset, concurrent zarr requests) or 'memmap' (MemmapDataset, export of the dataset in --memmap_path) (default: xarray)"
+        }
+    })
+    PREALLOCATE = ArgumentItem(**{
+        "flag": "--preallocate",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Decode samples into reused, preallocated (T, C, H, W) buffers instead of concatenating per-variable tensors"
+        }
+    })
+    PIN_BUFFER = ArgumentItem(**{
+        "flag": "--pin_buffer",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Allocate the preallocated sample buffers in pinned memory (requires CUDA)"
+        }
+    })
+    MAX_CONCURRENCY = ArgumentItem(**{
+        "flag": "--max_concurrency",
+        "kwargs": {
+            "type": int,
+            "default": 16,
+            "help": "Maximum number of concurrent requests per worker for the 'async_zarr' dataset class (default: 16)"
+        }
+    })
+    PREFETCH_SAMPLES = ArgumentItem(**{
+        "flag": "--prefetch_samples",
+        "kwargs": {
+            "type": int,
+            "default": 0,
+            "help": "Number of following samples whose frames are requested ahead for the 'async_zarr' dataset class (default: 0)"
+        }
+    })
+    COALESCE_BATCHES = ArgumentItem(**{
+        "flag": "--coalesce_batches",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Fetch batches with a single read per run of overlapping windows (BaseDataset.__getitems__)"
+        }
+    })
+    BLOCK_SHUFFLE = ArgumentItem(**{
+        "flag": "--block_shuffle",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Batch contiguous blocks of windows and shuffle the blocks (BlockBatchSampler), overrides the dataloader 'shuffle' kwarg"
+        }
+    })
+    PREFETCH_DEPTH = ArgumentItem(**{
+        "flag": "--prefetch_depth",
+        "kwargs": {
+            "type": int,
+            "default": 0,
+            "help": "Number of batches decoded ahead by the single-process PrefetchLoader, 0 uses the DataLoader with --pt_workers (default: 0)"
+        }
+    })
+    IO_THREADS = ArgumentItem(**{
+        "flag": "--io_threads",
+        "kwargs": {
+            "type": int,
+            "default": 1,
+            "help": "Number of threads of the PrefetchLoader (default: 1)"
+        }
+    })
+    COMPARE_LOADERS = ArgumentItem(**{
+        "flag": "--compare_loaders",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "With --prefetch_depth > 0 or --streaming, also benchmark the (map-style) DataLoader with --pt_workers in the same run"
+        }
+    })
+    STREAMING = ArgumentItem(**{
+        "flag": "--streaming",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Stream the samples in storage order (StreamingDataset): contiguous time blocks dealt to the ranks and workers, through a shuffle buffer, instead of random access"
+        }
+    })
+    STREAM_BLOCK_TIMESTEPS = ArgumentItem(**{
+        "flag": "--stream_block_timesteps",
+        "kwargs": {
+            "type": int,
+            "default": 16,
+            "help": "Number of consecutive windows read with one contiguous read by --streaming (default: 16)"
+        }
+    })
+    SHUFFLE_BUFFER = ArgumentItem(**{
+        "flag": "--shuffle_buffer",
+        "kwargs": {
+            "type": int,
+            "nargs": "+",
+            "default": [0],
+            "help": "Size(s) of the shuffle buffer of --streaming in samples, 0 streams in time order. The first size is the benchmarked loader, the others are benchmarked for comparison (default: 0)"
+        }
+    })
+    PATCH_SIZE = ArgumentItem(**{
+        "flag": "--patch_size",
+        "kwargs": {
+            "type": int,
+            "nargs": 2,
+            "default": None,
+            "help": "Read a random (latitude, longitude) patch of this many grid points per sample instead of the full field (default: None)"
+        }
+    })
+    REGION = ArgumentItem(**{
+        "flag": "--region",
+        "kwargs": {
+            "type": float,
+            "nargs": 4,
+            "default": None,
+            "metavar": ("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"),
+            "help": "Only read the grid points of this bounding box in degrees, patches are drawn inside it (default: None)"
+        }
+    })
+    ALIGN_PATCHES = ArgumentItem(**{
+        "flag": "--align_patches",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Draw patches at offsets aligned to the latitude/longitude chunks of the store, so a patch of the chunk size reads a single chunk"
+        }
+    })
+    COMPARE_PATCHES = ArgumentItem(**{
+        "flag": "--compare_patches",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "With --patch_size or --region, also benchmark full-field samples with the DataLoader in the same run"
+        }
+    })
+    NORM_STATS = ArgumentItem(**{
+        "flag": "--norm_stats",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Normalize the samples per channel with the mean and std in this json file, computed over the selected dates and saved there if missing (default: None)"
+        }
+    })
+    OUT_DTYPE = ArgumentItem(**{
+        "flag": "--out_dtype",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "choices": ["float32", "float16", "bfloat16"],
+            "help": "dtype of the samples, cast while filling them (default: dtype of the dataset)"
+        }
+    })
+    CACHE_MB = ArgumentItem(**{
+        "flag": "--cache_mb",
+        "kwargs": {
+            "type": float,
+            "default": 0,
+            "help": "Size of the per-worker LRU cache of decoded frames in MB, 0 disables the cache (default: 0)"
+        }
+    })
+    SHARED_CACHE_MB = ArgumentItem(**{
+        "flag": "--shared_cache_mb",
+        "kwargs": {
+            "type": float,
+            "default": 0,
+            "help": "Size of the LRU cache of decoded frames shared by all dataloader workers in MB (in /dev/shm), 0 disables the cache (default: 0)"
+        }
+    })
+    AUTOTUNE_TIMESTEPS = ArgumentItem(**{
+        "flag": "--autotune_timesteps",
+        "kwargs": {
+            "type": int,
+            "default": 32,
+            "help": "Number of timesteps of the source written for each candidate layout (default: 32)"
+        }
+    })
+    TIME_CHUNKS = ArgumentItem(**{
+        "flag": "--time_chunks",
+        "kwargs": {
+            "type": int,
+            "nargs": "+",
+            "default": [1, 2, 4],
+            "help": "Candidate time chunk sizes (default: 1 2 4)"
+        }
+    })
+    SPATIAL_TILES = ArgumentItem(**{
+        "flag": "--spatial_tiles",
+        "kwargs": {
+            "type": str,
+            "nargs": "+",
+            "default": ["1x1", "2x2"],
+            "help": "Candidate latitude x longitude tilings, as number of tiles per dimension (default: 1x1 2x2)"
+        }
+    })
+    LEVEL_CHUNKS = ArgumentItem(**{
+        "flag": "--level_chunks",
+        "kwargs": {
+            "type": int,
+            "nargs": "+",
+            "default": [-1, 1],
+            "help": "Candidate level chunk sizes, -1 for all levels in one chunk (default: -1 1)"
+        }
+    })
+    LAYOUTS = ArgumentItem(**{
+        "flag": "--layouts",
+        "kwargs": {
+            "type": str,
+            "nargs": "+",
+            "default": ["dataset", "dataarray"],
+            "choices": ["dataset", "dataarray"],
+            "help": "Candidate layouts: one array per variable (dataset) or a single array with a 'variable' dimension (dataarray) (default: dataset dataarray)"
+        }
+    })
+    SHARD_TIMESTEPS = ArgumentItem(**{
+        "flag": "--shard_timesteps",
+        "kwargs": {
+            "type": int,
+            "nargs": "+",
+            "default": [0],
+            "help": "Candidate number of timesteps per shard (zarr v3 only), 0 for no sharding (default: 0)"
+        }
+    })
+    KEEP_CANDIDATES = ArgumentItem(**{
+        "flag": "--keep_candidates",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Keep the candidate stores after measuring them"
+        }
+    })
+    CODECS = ArgumentItem(**{
+        "flag": "--codecs",
+        "kwargs": {
+            "type": str,
+            "nargs": "+",
+            "default": [
+                "none",
+                "blosc-lz4-5-shuffle",
+                "blosc-lz4hc-5-shuffle",
+                "blosc-zstd-1-bitshuffle",
+                "blosc-zstd-3-bitshuffle",
+                "blosc-zstd-9-bitshuffle",
+                "zstd-3",
+                "blosc-zstd-3-bitshuffle+bitround-12",
+            ],
+            "help": "Codec specs to benchmark (default: a sweep of blosc, zstd and bitround codecs)"
+        }
+    })
+    CODEC_TIMESTEPS = ArgumentItem(**{
+        "flag": "--codec_timesteps",
+        "kwargs": {
+            "type": int,
+            "default": 8,
+            "help": "Number of timesteps of the source encoded with each codec (default: 8)"
+        }
+    })
+    DECODE_THREADS = ArgumentItem(**{
+        "flag": "--decode_threads",
+        "kwargs": {
+            "type": int,
+            "nargs": "+",
+            "default": [1, 4, 8],
+            "help": "Numbers of threads decoding chunks concurrently (default: 1 4 8)"
+        }
+    })
+    READ_STORE = ArgumentItem(**{
+        "flag": "--read_store",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Local zarr store whose chunk files are read to measure raw I/O throughput (default: None)"
+        }
+    })
+    PROFILE = ArgumentItem(**{
+        "flag": "--profile",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Time the stages of the sample path (index, read, fs_read, concat, collate, wait) and report per-stage percentiles"
+        }
+    })
+    TRACE = ArgumentItem(**{
+        "flag": "--trace",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Also export the stage spans of all processes as a Chrome trace (trace.json, implies --profile)"
+        }
+    })
+    CONSUMER_STEP_MS = ArgumentItem(**{
+        "flag": "--consumer_step_ms",
+        "kwargs": {
+            "type": float,
+            "default": 0.,
+            "help": "Duration of a simulated training step run after each batch, 0 drains the loader without consumer (default: 0)"
+        }
+    })
+    CONSUMER = ArgumentItem(**{
+        "flag": "--consumer",
+        "kwargs": {
+            "type": str,
+            "default": "sleep",
+            "choices": ["sleep", "matmul"],
+            "help": "Simulated training step: sleep (idle host, like a GPU step) or matmul (CPU-bound, at least one matmul per step) (default: sleep)"
+        }
+    })
+    MATMUL_SIZE = ArgumentItem(**{
+        "flag": "--matmul_size",
+        "kwargs": {
+            "type": int,
+            "default": 1024,
+            "help": "Size of the square matrices multiplied by the matmul consumer (default: 1024)"
+        }
+    })
+    WARMUP_BATCHES = ArgumentItem(**{
+        "flag": "--warmup_batches",
+        "kwargs": {
+            "type": int,
+            "default": 5,
+            "help": "Number of first batches reported as warmup, separately from the steady state (default: 5)"
+        }
+    })
+    DISTRIBUTED = ArgumentItem(**{
+        "flag": "--distributed",
+        "kwargs": {
+            "action": "store_true",
+            "default": False,
+            "help": "Distributed benchmark launched by torchrun: each rank reads a disjoint shard of the samples (gloo backend)"
+        }
+    })
+    LOCAL_RANKS = ArgumentItem(**{
+        "flag": "--local_ranks",
+        "kwargs": {
+            "type": int,
+            "default": 0,
+            "help": "Run the distributed benchmark on this many local processes instead of torchrun, 0 disables it (default: 0)"
+        }
+    })
+    SHARD_MODE = ArgumentItem(**{
+        "flag": "--shard_mode",
+        "kwargs": {
+            "type": str,
+            "default": "contiguous",
+            "choices": ["contiguous", "interleaved"],
+            "help": "Shard of the samples of each rank: a contiguous range or every world_size-th sample (default: contiguous)"
+        }
+    })
+    RUN_NAME = ArgumentItem(**{
+        "flag": "--run_name",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Name of the run directory in the experiment directory (default: a random codename and the date)"
+        }
+    })
+    GRID = ArgumentItem(**{
+        "flag": "--grid",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "YAML file of the sweep: fixed benchmark options and a grid of options whose combinations are the configs"
+        }
+    })
+    SWEEP_WORKERS = ArgumentItem(**{
+        "flag": "--sweep_workers",
+        "kwargs": {
+            "type": int,
+            "default": 1,
+            "help": "Number of configs benchmarked concurrently by a local sweep (default: 1)"
+        }
+    })
+    RESULTS_DB = ArgumentItem(**{
+        "flag": "--results_db",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "SQLite database of the sweep results (default: <experiment_dir>/results.sqlite)"
+        }
+    })
+    PYTHON = ArgumentItem(**{
+        "flag": "--python",
+        "kwargs": {
+            "type": str,
+            "default": "env/venv_zarr-v{zarr_format}/bin/python",
+            "help": "Python interpreter of the benchmark runs, formatted with the zarr_format of the config (default: env/venv_zarr-v{zarr_format}/bin/python)"
+        }
+    })
+    SLURM_OPTIONS = ArgumentItem(**{
+        "flag": "--slurm_options",
+        "kwargs": {
+            "type": str,
+            "default": "--time=01:00:00 --partition=rome",
+            "help": "sbatch options of the array job (default: --time=01:00:00 --partition=rome)"
+        }
+    })
+    GROUP_BY = ArgumentItem(**{
+        "flag": "--group_by",
+        "kwargs": {
+            "type": str,
+            "nargs": "+",
+            "default": None,
+            "help": "Options compared by the report, as rows (default: all options varying in the results)"
+        }
+    })
+    COMPARE = ArgumentItem(**{
+        "flag": "--compare",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Option whose values are the columns of the report (default: None)"
+        }
+    })
+    METRIC = ArgumentItem(**{
+        "flag": "--metric",
+        "kwargs": {
+            "type": str,
+            "default": "samples_per_s",
+            "help": "Metric of the report (default: samples_per_s)"
+        }
+    })
+    CHUNK_CACHE_DIR = ArgumentItem(**{
+        "flag": "--chunk_cache_dir",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Local directory (e.g. '$TMPDIR') caching the objects read from the dataset, shared by all processes of a node (default: None, no cache)"
+        }
+    })
+    CHUNK_CACHE_MB = ArgumentItem(**{
+        "flag": "--chunk_cache_mb",
+        "kwargs": {
+            "type": float,
+            "default": 0,
+            "help": "Size cap of the chunk cache in MB, least recently used objects are evicted above it (default: 0, no cap)"
+        }
+    })
+    STAGE_CHUNKS = ArgumentItem(**{
+        "flag": "--stage_chunks",
+        "kwargs": {
+            "action": "store_true",
+            "help": "Copy the objects of the selected variables, levels and dates to the chunk cache before benchmarking"
+        }
+    })
+    STAGE_THREADS = ArgumentItem(**{
+        "flag": "--stage_threads",
+        "kwargs": {
+            "type": int,
+            "default": 16,
+            "help": "Number of concurrent fetches when staging the chunk cache (default: 16)"
+        }
+    })
+    EPOCHS = ArgumentItem(**{
+        "flag": "--epochs",
+        "kwargs": {
+            "type": int,
+            "default": 1,
+            "help": "Number of passes over the loader, the first (cold) epoch is reported separately from the warm ones (default: 1)"
+        }
+    })
+    SAMPLE_INDEX = ArgumentItem(**{
+        "flag": "--sample_index",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "JSON file of the sample index (offsets, chunk grids and a metadata snapshot of the selection), built if missing or built for another selection (default: None)"
+        }
+    })
+    MEMMAP_PATH = ArgumentItem(**{
+        "flag": "--memmap_path",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Export of the dataset written by src/export.py, read by --dataset_class memmap (default: None)"
+        }
+    })
+    EXPORT_TIMESTEPS = ArgumentItem(**{
+        "flag": "--export_timesteps",
+        "kwargs": {
+            "type": int,
+            "default": 16,
+            "help": "Number of timesteps decoded and written at once by the export (default: 16)"
+        }
+    })
+    RESOLUTION = ArgumentItem(**{
+        "flag": "--resolution",
+        "kwargs": {
+            "type": str,
+            "default": "240x121",
+            "help": "Grid of the synthetic dataset as <LON>x<LAT>, latitudes from pole to pole (default: 240x121, 1.5 degrees)"
+        }
+    })
+    NUM_TIMESTEPS = ArgumentItem(**{
+        "flag": "--num_timesteps",
+        "kwargs": {
+            "type": int,
+            "default": 32,
+            "help": "Number of timesteps of the synthetic dataset (default: 32)"
+        }
+    })
+    TIME_STEP = ArgumentItem(**{
+        "flag": "--time_step",
+        "kwargs": {
+            "type": str,
+            "default": "6h",
+            "help": "Time between two timesteps of the synthetic dataset, as a pandas frequency (default: 6h)"
+        }
+    })
+    SEED = ArgumentItem(**{
+        "flag": "--seed",
+        "kwargs": {
+            "type": int,
+            "default": 0,
+            "help": "Seed of the noise of the synthetic dataset (default: 0)"
+        }
+    })
+    BASELINE = ArgumentItem(**{
+        "flag": "--baseline",
+        "kwargs": {
+            "type": str,
+            "default": None,
+            "help": "Run the others are compared to: its directory, directory name or codename (default: None, no comparison)"
+        }
+    })
+    REPORT_OUTPUT = ArgumentItem(**{
+        "flag": "--report_output",
+        "kwargs": {
+            "type": str,
+            "default": "report.md",
+            "help": "File of the report, markdown or HTML depending on its extension (.md or .html) (default: report.md)"
+        }
+    })
+    BOOTSTRAP_SAMPLES = ArgumentItem(**{
+        "flag": "--bootstrap_samples",
+        "kwargs": {
+            "type": int,
+            "default": 1000,
+            "help": "Number of bootstrap resamples of the batch times of each run (default: 1000)"
+        }
+    })
+    CONFIDENCE = ArgumentItem(**{
+        "flag": "--confidence",
+        "kwargs": {
+            "type": float,
+            "default": 0.95,
+            "help": "Level of the bootstrap confidence intervals (default: 0.95)"
+        }
+    })
+    REGRESSION_THRESHOLD = ArgumentItem(**{
+        "flag": "--regression_threshold",
+        "kwargs": {
+            "type": float,
+            "default": 0.05,
+            "help": "Relative change of the mean time per sample below which a significant difference to the baseline is not flagged (default: 0.05)"
+        }
+    })
+    REPORT_WORKERS = ArgumentItem(**{
+        "flag": "--report_workers",
+        "kwargs": {
+            "type": int,
+            "default": None,
+            "help": "Number of processes loading and analyzing the runs (default: None, one per CPU)"
+        }
+    })
@@ -0,0 +1,111 @@
+import numpy as np
+import asyncio
+import threading
+import logging
+import time
+import zarr
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+zarr_format = int(zarr.__version__[0])
+
+class AsyncFrameReader(object):
+    """
+    Fetches zarr selections concurrently from an asyncio event loop running in a background thread.
+    
+    With zarr v3 the requests go through the async array API, with zarr v2 (and its fsspec 
+    stores) they are run in a thread pool. In both cases at most `max_concurrency` requests 
+    are in flight. Request counts, latencies and in-flight levels are reported through an 
+    optional `WorkerCounters`. `path` is a zarr path or store.
+    """
+    LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+    COUNTERS = ["async_requests", "async_request_ns", "async_in_flight_sum"] + \
+        [f"async_latency_le_{b}ms" for b in LATENCY_BUCKETS_MS] + ["async_latency_le_infms"]
+    
+    def __init__(self, path, variables: list[str], max_concurrency: int=16, counters=None):
+        assert isinstance(max_concurrency, int) and max_concurrency > 0, "max_concurrency must be a positive integer"
+        self.path = path
+        self.max_concurrency = max_concurrency
+        self.counters = counters
+        self.in_flight = 0
+        
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        
+        self.executor = None
+        if zarr_format == 3:
+            self.arrays = self._run(self._open(variables))
+        else:
+            group = zarr.open_group(path, mode="r")
+            self.arrays = {var: group[var] for var in variables}
+            self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.semaphore = self._run(self._semaphore())
+        
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+    
+    async def _semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+        
+    async def _open(self, variables):
+        group = await zarr.api.asynchronous.open_group(self.path, mode="r")
+        return {var: await group.getitem(var) for var in variables}
+    
+    def _count(self, name, value=1):
+        if self.counters is not None:
+            self.counters.add(name, value)
+    
+    async def _fetch(self, var, selection) -> np.ndarray:
+        async with self.semaphore:
+            self.in_flight += 1
+            self._count("async_in_flight_sum", self.in_flight)
+            t0 = time.perf_counter_ns()
+            try:
+                if zarr_format == 3:
+                    values = await self.arrays[var].getitem(selection)
+                else:
+                    values = await self.loop.run_in_executor(self.executor, self.arrays[var].__getitem__, selection)
+            finally:
+                self.in_flight -= 1
+            latency = time.perf_counter_ns() - t0
+        
+        self._count("async_requests")
+        self._count("async_request_ns", latency)
+        bucket = next((b for b in self.LATENCY_BUCKETS_MS if latency <= b * 1e6), "inf")
+        self._count(f"async_latency_le_{bucket}ms")
+        return values
+    
+    def submit(self, var: str, selection: tuple) -> Future:
+        """
+        Schedule a basic selection of `var`, returns a `concurrent.futures.Future`.
+        """
+        return asyncio.run_coroutine_threadsafe(self._fetch(var, selection), self.loop)
+    
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        if self.executor is not None:
+            self.executor.shutdown()
+            
+    @classmethod
+    def summarize(cls, totals: dict) -> dict:
+        """
+        Summary of the counters: number of requests, mean latency and in-flight level, 
+        and latency percentiles (upper bounds of the histogram buckets).
+        """
+        requests = totals["async_requests"]
+        if requests == 0:
+            return {"async_requests": 0}
+        summary = {
+            "async_requests": requests,
+            "async_latency_mean_ms": totals["async_request_ns"] / requests / 1e6,
+            "async_in_flight_mean": totals["async_in_flight_sum"] / requests,
+        }
+        buckets = cls.LATENCY_BUCKETS_MS + [float("inf")]
+        cumulative = np.cumsum([totals[f"async_latency_le_{b}ms"] for b in cls.LATENCY_BUCKETS_MS + ["inf"]])
+        for q in [50, 90, 99]:
+            summary[f"async_latency_p{q}_ms"] = float(buckets[int(np.searchsorted(cumulative, requests * q / 100))])
+        return summary
@@ -0,0 +1,205 @@
+import xarray as xr
+import argparse
+import itertools
+import logging
+import shutil
+import time
+import yaml
+import os
+import numpy as np
+import zarr
+from datetime import datetime
+from codename import codename
+
+from dataset import BaseDataset, ZarrDataset
+from write import write_zarr
+from args import Arguments
+from utils import load_dataset, chunk_footprint
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# Suppress logs from Google libraries
+logging.getLogger('google').setLevel(logging.ERROR)
+logging.getLogger('google.auth').setLevel(logging.ERROR)
+logging.getLogger('google.cloud').setLevel(logging.ERROR)
+
+def get_args():
+    logger.info("Parsing arguments")
+    parser = argparse.ArgumentParser()
+    
+    parser.add_argument(Arguments.DATASET.flag, **Arguments.DATASET.kwargs)
+    parser.add_argument(Arguments.OUTPUT.flag, **Arguments.OUTPUT.kwargs)
+    parser.add_argument(Arguments.EXPERIMENT_DIR.flag, **Arguments.EXPERIMENT_DIR.kwargs)
+    parser.add_argument(Arguments.CHUNKS_OPEN_STRATEGY.flag, **Arguments.CHUNKS_OPEN_STRATEGY.kwargs)
+    parser.add_argument(Arguments.COMPRESS_VARS.flag, **Arguments.COMPRESS_VARS.kwargs)
+    parser.add_argument(Arguments.COMPRESS_COORDS.flag, **Arguments.COMPRESS_COORDS.kwargs)
+    parser.add_argument(Arguments.VARIABLES.flag, **Arguments.VARIABLES.kwargs)
+    parser.add_argument(Arguments.LEVELS.flag, **Arguments.LEVELS.kwargs)
+    parser.add_argument(Arguments.DATE_START_BENCHMARK.flag, **Arguments.DATE_START_BENCHMARK.kwargs)
+    parser.add_argument(Arguments.DATE_END_BENCHMARK.flag, **Arguments.DATE_END_BENCHMARK.kwargs)
+    parser.add_argument(Arguments.NUM_INPUT_TIMESTEPS.flag, **Arguments.NUM_INPUT_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.NUM_OUTPUT_TIMESTEPS.flag, **Arguments.NUM_OUTPUT_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.NUM_SAMPLES.flag, **Arguments.NUM_SAMPLES.kwargs)
+    parser.add_argument(Arguments.DATASET_CLASS.flag, **Arguments.DATASET_CLASS.kwargs)
+    parser.add_argument(Arguments.AUTOTUNE_TIMESTEPS.flag, **Arguments.AUTOTUNE_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.TIME_CHUNKS.flag, **Arguments.TIME_CHUNKS.kwargs)
+    parser.add_argument(Arguments.SPATIAL_TILES.flag, **Arguments.SPATIAL_TILES.kwargs)
+    parser.add_argument(Arguments.LEVEL_CHUNKS.flag, **Arguments.LEVEL_CHUNKS.kwargs)
+    parser.add_argument(Arguments.LAYOUTS.flag, **Arguments.LAYOUTS.kwargs)
+    parser.add_argument(Arguments.SHARD_TIMESTEPS.flag, **Arguments.SHARD_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.KEEP_CANDIDATES.flag, **Arguments.KEEP_CANDIDATES.kwargs)
+    
+    # parse arguments
+    args = parser.parse_args()
+    
+    args.experiment_dir = os.path.join(
+        args.experiment_dir, 
+        "autotune-" + codename(separator="_") + "-" + datetime.now().strftime("%Y%m%dT%H%M%S")
+    )
+    os.makedirs(args.experiment_dir, exist_ok=True)
+    
+    try: args.chunks_open_strategy = eval(args.chunks_open_strategy)
+    except Exception as e: pass
+    
+    args.date_range = [args.date_start, args.date_end]
+    
+    args.zarr_version = zarr.__version__
+    if args.zarr_version.startswith("2."):
+        logger.info("Zarr version 2.x detected")
+        args.zarr_format = 2
+    elif args.zarr_version.startswith("3."):
+        logger.info("Zarr version 3.x detected")
+        args.zarr_format = 3
+    else:
+        raise ValueError(f"Unknown Zarr version: {args.zarr_version}")
+    
+    if any(shard > 0 for shard in args.shard_timesteps) and args.zarr_format != 3:
+        raise ValueError("--shard_timesteps requires zarr v3")
+    
+    return args
+
+def candidate_layouts(args, ds: xr.Dataset) -> dict:
+    """
+    Grid of candidate write layouts: {name: (new_chunks, shards)} for `write_zarr`.
+    """
+    candidates = {}
+    for layout, time_chunk, tiles, level_chunk, shard in itertools.product(args.layouts, args.time_chunks, args.spatial_tiles, args.level_chunks, args.shard_timesteps):
+        if shard > 0 and shard % time_chunk != 0:
+            continue
+        lat_tiles, lon_tiles = (int(n) for n in tiles.split("x"))
+        chunks = {
+            "time": time_chunk,
+            "latitude": -1 if lat_tiles == 1 else -(-ds.sizes["latitude"] // lat_tiles),
+            "longitude": -1 if lon_tiles == 1 else -(-ds.sizes["longitude"] // lon_tiles),
+            "level": level_chunk,
+        }
+        if layout == "dataarray":
+            chunks["variable"] = -1
+        name = f"{layout}-t{time_chunk}-s{tiles}-l{level_chunk}" + (f"-shard{shard}" if shard > 0 else "")
+        candidates[name] = (chunks, {"time": shard} if shard > 0 else None)
+    return candidates
+
+def measure_candidate(args, path: str) -> dict:
+    """
+    Read `num_samples` random samples from a candidate store.
+    """
+    candidate_args = argparse.Namespace(**{**vars(args), "dataset": path})
+    # the direct zarr read path only supports one array per variable
+    is_dataarray = "__xarray_dataarray_variable__" in zarr.open_group(path, mode="r")
+    use_zarr = args.dataset_class == "zarr" and not is_dataarray
+    # BaseDataset reads dataarray layouts as the stacked array, as the benchmark does
+    ds = load_dataset(candidate_args, force_zarr_format=True, as_dataarray=not use_zarr)
+    dataset_kwargs = dict(
+        ds=ds,
+        num_input_timesteps=args.num_input_timesteps,
+        num_output_timesteps=args.num_output_timesteps,
+        variables=args.variables,
+        levels=args.levels,
+    )
+    if use_zarr:
+        dataset = ZarrDataset(path=path, **dataset_kwargs)
+    else:
+        dataset = BaseDataset(**dataset_kwargs)
+    
+    rng = np.random.default_rng(0)
+    indices = rng.integers(len(dataset), size=args.num_samples)
+    times = []
+    for i in indices:
+        t0 = time.time()
+        dataset[int(i)]
+        times.append(time.time() - t0)
+    
+    return {
+        "dataset_class": type(dataset).__name__,
+        "mean": float(np.mean(times)),
+        "std": float(np.std(times)),
+        "samples_per_s": float(len(times) / np.sum(times)),
+    }
+
+def main():
+    args = get_args()
+    logger.info(f"Experiment directory: {args.experiment_dir}")
+    with open(os.path.join(args.experiment_dir, "args.yaml"), "w") as f:
+        yaml.dump(vars(args), f)
+    
+    # load the time slice once, every candidate is written from memory
+    logger.info(f"Loading dataset from {args.dataset} for dates {args.date_range[0]} to {args.date_range[1]}")
+    ds = load_dataset(args, force_zarr_format=not args.dataset.startswith("gs://"))
+    ds = ds.isel(time=slice(0, args.autotune_timesteps)).load()
+    logger.info(f"Loaded {args.autotune_timesteps} timesteps with sizes: {ds.sizes}")
+    
+    # write and read each candidate
+    candidates = candidate_layouts(args, ds)
+    logger.info(f"Benchmarking {len(candidates)} candidate layouts")
+    results = []
+    for name, (chunks, shards) in candidates.items():
+        path = os.path.join(args.output, f"{name}.zarr-v{args.zarr_format}")
+        logger.info(f"Candidate {name}: {chunks}")
+        t0 = time.time()
+        write_zarr(
+            ds, 
+            path=path, 
+            exist_ok=True, 
+            new_chunks=dict(chunks), 
+            compress_vars=args.compress_vars, 
+            compress_coords=args.compress_coords,
+            shards=shards,
+        )
+        write_time = time.time() - t0
+        
+        result = {"name": name, "chunks": chunks, "shards": shards, "write_time": write_time}
+        result.update(measure_candidate(args, path))
+        result.update(chunk_footprint(path, args.variables, args.levels, args.num_input_timesteps + args.num_output_timesteps))
+        results.append(result)
+        logger.info(f"Candidate {name}: {result['samples_per_s']:.2f} samples/s, {result['bytes_per_sample']/1024**2:.2f}MB and {result['chunks_per_sample']:.1f} chunks per sample")
+        
+        if not args.keep_candidates:
+            shutil.rmtree(path)
+    
+    # ranked table per read path: with --dataset_class zarr, dataarray layouts are read by BaseDataset,
+    # whose throughput says more about the reader than about the layout
+    results = sorted(results, key=lambda result: result["samples_per_s"], reverse=True)
+    recommended = {}
+    for dataset_class in dict.fromkeys(result["dataset_class"] for result in results):
+        ranked = [result for result in results if result["dataset_class"] == dataset_class]
+        header = f"{'rank':>4} {'candidate':<40} {'samples/s':>10} {'mean (s)':>9} {'MB/sample':>10} {'chunks/sample':>14} {'objects/sample':>15}"
+        lines = [header, "-" * len(header)]
+        for rank, result in enumerate(ranked):
+            lines.append(f"{rank+1:>4} {result['name']:<40} {result['samples_per_s']:>10.2f} {result['mean']:>9.4f} {result['bytes_per_sample']/1024**2:>10.2f} {result['chunks_per_sample']:>14.1f} {result['objects_per_sample']:>15.1f}")
+        logger.info(f"Ranked candidate layouts read with {dataset_class}:\n" + "\n".join(lines))
+        logger.info(f"Recommended layout for {dataset_class}: {ranked[0]['name']} -> chunks: {ranked[0]['chunks']}, shards: {ranked[0]['shards']}")
+        recommended[dataset_class] = ranked[0]["name"]
+    
+    with open(os.path.join(args.experiment_dir, "autotune.yaml"), "w") as f:
+        yaml.dump({"recommended": recommended, "results": results}, f, sort_keys=False)
+    
+if __name__ == "__main__":
+    main()
+    logger.info("Finished autotuning")
@@ -7,15 +7,31 @@ import matplotlib.pyplot as plt
 import dask
 import yaml
 import os
+import resource
+import socket
+import torch
+import torch.distributed as dist
 import numpy as np
 from datetime import datetime
 import zarr
 from codename import codename
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler, SequentialSampler, default_collate
 
-from dataset import BaseDataset
+from dataset import BaseDataset, ZarrDataset, AsyncZarrDataset, MemmapDataset
+from async_reader import AsyncFrameReader
 from args import Arguments
-from utils import load_dataset
+from utils import load_dataset, WorkerCounters, process_tree_rss
+from cache import FrameCache
+from shared_cache import SharedFrameCache
+from streaming import StreamingDataset
+from sampler import BlockBatchSampler, ShardedSampler
+from prefetch import PrefetchLoader
+from profiler import StageProfiler, ProfiledCollate
+from consumer import SyntheticConsumer
+from chunk_cache import ChunkCache
+from store import open_store, CachingStore, SnapshotStore, selection_keys
+from sample_index import SampleIndex
+from normalization import NormalizationStats
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -52,13 +68,51 @@ def get_args():
     parser.add_argument(Arguments.DASK_THREADS_PER_WORKER.flag, **Arguments.DASK_THREADS_PER_WORKER.kwargs)
     parser.add_argument(Arguments.LOG_FREQUENCY.flag, **Arguments.LOG_FREQUENCY.kwargs)
     parser.add_argument(Arguments.NUM_SAMPLES.flag, **Arguments.NUM_SAMPLES.kwargs)
+    parser.add_argument(Arguments.DATASET_CLASS.flag, **Arguments.DATASET_CLASS.kwargs)
+    parser.add_argument(Arguments.MAX_CONCURRENCY.flag, **Arguments.MAX_CONCURRENCY.kwargs)
+    parser.add_argument(Arguments.PREFETCH_SAMPLES.flag, **Arguments.PREFETCH_SAMPLES.kwargs)
+    parser.add_argument(Arguments.PREALLOCATE.flag, **Arguments.PREALLOCATE.kwargs)
+    parser.add_argument(Arguments.PIN_BUFFER.flag, **Arguments.PIN_BUFFER.kwargs)
+    parser.add_argument(Arguments.COALESCE_BATCHES.flag, **Arguments.COALESCE_BATCHES.kwargs)
+    parser.add_argument(Arguments.BLOCK_SHUFFLE.flag, **Arguments.BLOCK_SHUFFLE.kwargs)
+    parser.add_argument(Arguments.PREFETCH_DEPTH.flag, **Arguments.PREFETCH_DEPTH.kwargs)
+    parser.add_argument(Arguments.IO_THREADS.flag, **Arguments.IO_THREADS.kwargs)
+    parser.add_argument(Arguments.COMPARE_LOADERS.flag, **Arguments.COMPARE_LOADERS.kwargs)
+    parser.add_argument(Arguments.STREAMING.flag, **Arguments.STREAMING.kwargs)
+    parser.add_argument(Arguments.STREAM_BLOCK_TIMESTEPS.flag, **Arguments.STREAM_BLOCK_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.SHUFFLE_BUFFER.flag, **Arguments.SHUFFLE_BUFFER.kwargs)
+    parser.add_argument(Arguments.CACHE_MB.flag, **Arguments.CACHE_MB.kwargs)
+    parser.add_argument(Arguments.SHARED_CACHE_MB.flag, **Arguments.SHARED_CACHE_MB.kwargs)
+    parser.add_argument(Arguments.PROFILE.flag, **Arguments.PROFILE.kwargs)
+    parser.add_argument(Arguments.TRACE.flag, **Arguments.TRACE.kwargs)
+    parser.add_argument(Arguments.CONSUMER_STEP_MS.flag, **Arguments.CONSUMER_STEP_MS.kwargs)
+    parser.add_argument(Arguments.CONSUMER.flag, **Arguments.CONSUMER.kwargs)
+    parser.add_argument(Arguments.MATMUL_SIZE.flag, **Arguments.MATMUL_SIZE.kwargs)
+    parser.add_argument(Arguments.WARMUP_BATCHES.flag, **Arguments.WARMUP_BATCHES.kwargs)
+    parser.add_argument(Arguments.DISTRIBUTED.flag, **Arguments.DISTRIBUTED.kwargs)
+    parser.add_argument(Arguments.LOCAL_RANKS.flag, **Arguments.LOCAL_RANKS.kwargs)
+    parser.add_argument(Arguments.SHARD_MODE.flag, **Arguments.SHARD_MODE.kwargs)
+    parser.add_argument(Arguments.RUN_NAME.flag, **Arguments.RUN_NAME.kwargs)
+    parser.add_argument(Arguments.CHUNK_CACHE_DIR.flag, **Arguments.CHUNK_CACHE_DIR.kwargs)
+    parser.add_argument(Arguments.CHUNK_CACHE_MB.flag, **Arguments.CHUNK_CACHE_MB.kwargs)
+    parser.add_argument(Arguments.STAGE_CHUNKS.flag, **Arguments.STAGE_CHUNKS.kwargs)
+    parser.add_argument(Arguments.STAGE_THREADS.flag, **Arguments.STAGE_THREADS.kwargs)
+    parser.add_argument(Arguments.EPOCHS.flag, **Arguments.EPOCHS.kwargs)
+    parser.add_argument(Arguments.SAMPLE_INDEX.flag, **Arguments.SAMPLE_INDEX.kwargs)
+    parser.add_argument(Arguments.MEMMAP_PATH.flag, **Arguments.MEMMAP_PATH.kwargs)
+    parser.add_argument(Arguments.PATCH_SIZE.flag, **Arguments.PATCH_SIZE.kwargs)
+    parser.add_argument(Arguments.REGION.flag, **Arguments.REGION.kwargs)
+    parser.add_argument(Arguments.ALIGN_PATCHES.flag, **Arguments.ALIGN_PATCHES.kwargs)
+    parser.add_argument(Arguments.COMPARE_PATCHES.flag, **Arguments.COMPARE_PATCHES.kwargs)
+    parser.add_argument(Arguments.NORM_STATS.flag, **Arguments.NORM_STATS.kwargs)
+    parser.add_argument(Arguments.OUT_DTYPE.flag, **Arguments.OUT_DTYPE.kwargs)
     
     # parse arguments
     args = parser.parse_args()
     
     args.experiment_dir = os.path.join(
         args.experiment_dir, 
-        codename(separator="_") + "-" + datetime.now().strftime("%Y%m%dT%H%M%S")
+        args.run_name or codename(separator="_") + "-" + datetime.now().strftime("%Y%m%dT%H%M%S")
     )
     os.makedirs(args.experiment_dir, exist_ok=True)
     
@@ -67,6 +121,28 @@ def get_args():
     
     args.date_range = [args.date_start, args.date_end]
     
+    args.profile = args.profile or args.trace
+    
+    assert args.epochs >= 1, "--epochs must be at least 1"
+    if args.stage_chunks and args.chunk_cache_dir is None:
+        raise ValueError("--stage_chunks requires --chunk_cache_dir")
+    if args.dataset_class == "memmap" and args.memmap_path is None:
+        raise ValueError("--dataset_class memmap requires --memmap_path")
+    if args.align_patches and args.patch_size is None:
+        raise ValueError("--align_patches requires --patch_size")
+    if args.compare_patches and args.patch_size is None and args.region is None:
+        raise ValueError("--compare_patches requires --patch_size or --region")
+    if args.streaming and (args.block_shuffle or args.prefetch_depth > 0 or args.patch_size is not None):
+        raise ValueError("--streaming reads full-field samples with the dataloader (no --block_shuffle, --prefetch_depth, --patch_size)")
+    
+    if args.local_ranks > 0 or args.distributed:
+        if args.block_shuffle or args.prefetch_depth > 0 or args.profile:
+            raise ValueError("The distributed benchmark only supports the dataloader (no --block_shuffle, --prefetch_depth, --profile)")
+        if args.local_ranks > 0:
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                args.master_port = sock.getsockname()[1]
+    
     args.dataloader_kwargs = eval(args.dataloader_kwargs)
     if args.dataset.startswith("gs://") and args.pt_workers > 0:
         args.dataloader_kwargs["multiprocess_context"] = "forkserver"
@@ -83,14 +159,148 @@ def get_args():
     
     return args
 
-def main():
+def latency_summary(times: list[float]) -> dict:
+    if len(times) == 0: return {"num_batches": 0}
+    return {
+        "num_batches": len(times),
+        "mean": float(np.mean(times)),
+        "p50": float(np.percentile(times, 50)),
+        "p99": float(np.percentile(times, 99)),
+    }
+
+def benchmark_loader(loader, args, profiler=None, consumer=None, memory: bool=False) -> dict:
+    """
+    Time the batches of a loader, return the times and a summary.
     
-    args = get_args()
-    logger.info(f"Experiment directory: {args.experiment_dir}")
-    with open(os.path.join(args.experiment_dir, "args.yaml"), "w") as f:
-        yaml.dump(vars(args), f)
+    `times` are the waits for each batch. With a consumer, each batch is followed by a 
+    simulated training step, and the waits are the stalls of the training loop.
+    `batch_bytes_per_sample` is the size of the collated batches per sample, which the 
+    dataloader workers pass to the main process through shared memory.
+    With `memory`, the resident memory of this process and its workers is sampled after 
+    each batch (outside of the timed waits), its maximum is `peak_tree_rss_mb`.
+    """
+    times = []
+    step_times = []
+    num_samples = 0
+    batch_bytes = 0
+    peak_rss = 0
+    t0 = time.time()
+    w0 = time.perf_counter_ns()
+    for i, (x, y) in enumerate(loader):
+        times.append(time.time() - t0)
+        if profiler is not None: profiler.record("wait", w0, time.perf_counter_ns())
+        if consumer is not None: step_times.append(consumer(x, y))
+        t0 = time.time()
+        w0 = time.perf_counter_ns()
+        num_samples += x.shape[0]
+        batch_bytes += x.nbytes + y.nbytes
+        if memory: 
+            peak_rss = max(peak_rss, process_tree_rss())
+            t0 = time.time()
+            w0 = time.perf_counter_ns()
+        
+        if i==0 or i % args.log_frequency == 0:
+            logger.info(f"Sample {i+1}/{args.num_samples} - x:{x.shape}, y:{y.shape} - Time: {times[-1]:.4f}s")
+            
+        if i == args.num_samples:
+            break
+        
+    mean, std = np.mean(times), np.std(times)
+    samples_per_s = num_samples / np.sum(times)
+    logger.info(f"Mean time: {mean:.4f}s, Std: {std:.4f}s, Throughput: {samples_per_s:.2f} samples/s")
+    summary = {
+        "times": times,
+        "mean": float(mean),
+        "std": float(std),
+        "num_samples": num_samples,
+        "samples_per_s": float(samples_per_s),
+        "batch_bytes_per_sample": batch_bytes / max(num_samples, 1),
+        "warmup": latency_summary(times[:args.warmup_batches]),
+        "steady": latency_summary(times[args.warmup_batches:]),
+    }
+    if memory: summary["peak_tree_rss_mb"] = peak_rss / 1024**2
+    logger.info(f"Warmup ({summary['warmup']['num_batches']} batches): {summary['warmup']}, steady state: {summary['steady']}")
+    
+    if consumer is not None:
+        stall, busy = float(np.sum(times)), float(np.sum(step_times))
+        steady_stall, steady_busy = float(np.sum(times[args.warmup_batches:])), float(np.sum(step_times[args.warmup_batches:]))
+        summary["consumer"] = {
+            "kind": consumer.kind,
+            "step_ms": consumer.step_ms,
+            "matmul_size": consumer.matmul_size if consumer.kind == "matmul" else None,
+            "step_times": step_times,
+            "step_mean": float(np.mean(step_times)),
+            "stall_s": stall,
+            "busy_s": busy,
+            "stall_fraction": stall / (stall + busy),
+            "steady_stall_fraction": steady_stall / (steady_stall + steady_busy) if steady_stall + steady_busy > 0 else 0.,
+            "effective_samples_per_s": num_samples / (stall + busy),
+        }
+        logger.info(
+            f"Consumer ({consumer.kind}, {consumer.step_ms}ms/step): stalled {100*summary['consumer']['stall_fraction']:.1f}% of the time "
+            f"({100*summary['consumer']['steady_stall_fraction']:.1f}% in steady state), "
+            f"effective throughput: {summary['consumer']['effective_samples_per_s']:.2f} samples/s"
+        )
+    return summary
+
+def benchmark_epochs(loader, args, first: dict, counters, profiler=None, consumer=None) -> dict:
+    """
+    Run the epochs after the `first` one, and compare the first (cold) epoch to the warm ones.
+    """
+    def epoch_summary(summary, totals, previous):
+        result = {
+            "samples_per_s": summary["samples_per_s"],
+            "mean": summary["mean"],
+            "p99": float(np.percentile(summary["times"], 99)),
+        }
+        for name in ChunkCache.COUNTERS:
+            result[name] = totals[name] - previous[name]
+        return result
     
-    # dask setup
+    totals = counters.totals()
+    epochs = [epoch_summary(first, totals, {name: 0 for name in totals})]
+    for epoch in range(1, args.epochs):
+        logger.info(f"Epoch {epoch+1}/{args.epochs}")
+        if isinstance(getattr(loader, "dataset", None), StreamingDataset): loader.dataset.set_epoch(epoch)
+        previous = totals
+        summary = benchmark_loader(loader, args, profiler=profiler, consumer=consumer)
+        totals = counters.totals()
+        epochs.append(epoch_summary(summary, totals, previous))
+    
+    first_samples_per_s = epochs[0]["samples_per_s"]
+    warm_samples_per_s = float(np.mean([epoch["samples_per_s"] for epoch in epochs[1:]]))
+    logger.info(f"First epoch: {first_samples_per_s:.2f} samples/s, warm epochs: {warm_samples_per_s:.2f} samples/s ({warm_samples_per_s/first_samples_per_s:.2f}x)")
+    return {
+        "epochs": epochs,
+        "first_epoch_samples_per_s": first_samples_per_s,
+        "warm_epoch_samples_per_s": warm_samples_per_s,
+    }
+
+def create_chunk_cache(args, counters=None) -> ChunkCache:
+    if args.chunk_cache_dir is None: return None
+    cache_dir = ChunkCache.dataset_dir(args.chunk_cache_dir, args.dataset)
+    chunk_cache = ChunkCache(cache_dir, max_bytes=int(args.chunk_cache_mb * 1024**2), counters=counters)
+    logger.info(f"Caching the objects of {args.dataset} in {cache_dir} (cap: {args.chunk_cache_mb if args.chunk_cache_mb > 0 else 'none'}MB)")
+    return chunk_cache
+
+def stage_chunks(args, store: CachingStore):
+    """
+    Copy the objects of the selected variables, levels and dates to the chunk cache.
+    """
+    keys = selection_keys(store, args.variables, args.levels, args.date_range)
+    t0 = time.time()
+    nbytes = store.stage(keys, num_threads=args.stage_threads)
+    elapsed = time.time() - t0
+    logger.info(f"Staged {len(keys)} objects: fetched {nbytes/1024**2:.2f}MB in {elapsed:.2f}s ({nbytes/1024**2/elapsed:.2f}MB/s)")
+
+def load_sample_index(args) -> SampleIndex:
+    if args.sample_index is None: return None
+    return SampleIndex.load_or_build(args.sample_index, args.dataset, args.variables, args.levels, args.date_range)
+
+def setup_dataset(args, chunk_cache: ChunkCache=None, sample_index: SampleIndex=None) -> xr.Dataset:
+    """
+    Configure dask and load the benchmark dataset, through the chunk cache and with the metadata of the sample index if any.
+    """
     if args.dask_scheduler is not None:
         dask.config.set(
             scheduler=args.dask_scheduler, 
@@ -99,50 +309,386 @@ def main():
         )
         logger.info(f"Configured dask (scheduler: {args.dask_scheduler}, workers: {args.dask_workers}, threads per worker: {args.dask_threads_per_worker})")
     
-    # load dataset
     logger.info(f"Loading dataset from {args.dataset} for dates {args.date_range[0]} to {args.date_range[1]}")
-    ds = load_dataset(args, force_zarr_format=not args.dataset.startswith("gs://"))
+    store = None
+    if chunk_cache is not None:
+        store = CachingStore(open_store(args.dataset), chunk_cache)
+        if args.stage_chunks: stage_chunks(args, store)
+    dataarray = None
+    if sample_index is not None:
+        store = SnapshotStore(store if store is not None else open_store(args.dataset), sample_index.metadata)
+        dataarray = sample_index.layout == "dataarray"
+    # BaseDataset reads the stacked array of dataarray layouts directly, and MemmapDataset
+    # takes its channels from it, as the export does
+    ds = load_dataset(args, force_zarr_format=not args.dataset.startswith("gs://"), store=store, dataarray=dataarray, as_dataarray=args.dataset_class in ["xarray", "memmap"])
     logger.info(f"Loaded dataset with shape: {ds.dims}")
-    
-    # create dataset
-    dataset = BaseDataset(
+    return ds
+
+def object_shape(args, ds: xr.Dataset|xr.DataArray) -> tuple:
+    """
+    (latitude, longitude) shape of the stored objects (chunks, or shards) of the first variable.
+    """
+    arr = ds if isinstance(ds, xr.DataArray) else ds[args.variables[0]]
+    objects = arr.encoding.get("shards") or arr.encoding.get("chunks")
+    if objects is None:
+        raise ValueError(f"The chunks of {args.dataset} are unknown, --align_patches requires a zarr dataset")
+    return tuple(int(objects[arr.dims.index(dim)]) for dim in ["latitude", "longitude"])
+
+def load_norm_stats(args, ds: xr.Dataset) -> NormalizationStats:
+    if args.norm_stats is None: return None
+    return NormalizationStats.load_or_compute(args.norm_stats, ds, args.dataset, args.variables, args.levels, args.date_range)
+
+def create_dataset(args, ds: xr.Dataset, counters=None, profiler=None, chunk_cache: ChunkCache=None, sample_index: SampleIndex=None, norm_stats: NormalizationStats=None) -> BaseDataset:
+    dataset_kwargs = dict(
         ds=ds,
         num_input_timesteps=args.num_input_timesteps,
         num_output_timesteps=args.num_output_timesteps,
         variables=args.variables,
         levels=args.levels,
+        cache_bytes=int(args.cache_mb * 1024**2),
+        shared_cache_bytes=int(args.shared_cache_mb * 1024**2),
+        counters=counters,
+        preallocate=args.preallocate,
+        pin_memory=args.pin_buffer,
+        num_buffers=args.batch_size,
+        coalesce_batches=args.coalesce_batches,
+        profiler=profiler,
+        region=args.region,
+        patch_size=args.patch_size,
+        patch_align=object_shape(args, ds) if args.align_patches else None,
+        normalization=norm_stats.channel_stats() if norm_stats is not None else None,
+        out_dtype=getattr(torch, args.out_dtype) if args.out_dtype is not None else None,
     )
-    logger.info(f"Created dataset with {len(dataset)} samples")
+    if args.dataset_class == "zarr":
+        dataset = ZarrDataset(path=args.dataset, chunk_cache=chunk_cache, sample_index=sample_index, **dataset_kwargs)
+    elif args.dataset_class == "async_zarr":
+        dataset = AsyncZarrDataset(path=args.dataset, chunk_cache=chunk_cache, sample_index=sample_index, max_concurrency=args.max_concurrency, prefetch_samples=args.prefetch_samples, **dataset_kwargs)
+    elif args.dataset_class == "memmap":
+        dataset = MemmapDataset(path=args.memmap_path, **dataset_kwargs)
+    else:
+        dataset = BaseDataset(**dataset_kwargs)
+    logger.info(f"Created {type(dataset).__name__} with {len(dataset)} samples of {dataset.spatial_shape} grid points" + (f" (patches aligned to {dataset.patch_align})" if args.align_patches else ""))
+    return dataset
+
+def create_streaming_loader(args, dataset: BaseDataset, shuffle_buffer: int, collate_fn=default_collate, rank: int=0, world_size: int=1) -> DataLoader:
+    streaming = StreamingDataset(dataset, block_timesteps=args.stream_block_timesteps, shuffle_buffer=shuffle_buffer, rank=rank, world_size=world_size)
+    dataloader_kwargs = {k: v for k, v in args.dataloader_kwargs.items() if k != "shuffle"}
+    logger.info(f"Streaming {len(streaming)} samples in blocks of {args.stream_block_timesteps} windows, shuffle buffer: {shuffle_buffer}")
+    return DataLoader(streaming, batch_size=args.batch_size, num_workers=args.pt_workers, collate_fn=collate_fn, **dataloader_kwargs)
+
+def sample_nbytes(dataset: BaseDataset) -> int:
+    """
+    Decoded size of a sample (inputs and outputs).
+    """
+    return dataset.sample_timesteps * dataset.num_channels * int(np.prod(dataset.spatial_shape)) * dataset.out_dtype.itemsize
+
+def create_consumer(args) -> SyntheticConsumer:
+    if args.consumer_step_ms > 0 or args.consumer == "matmul":
+        logger.info(f"Simulating a {args.consumer} training step of {args.consumer_step_ms}ms after each batch")
+        return SyntheticConsumer(step_ms=args.consumer_step_ms, kind=args.consumer, matmul_size=args.matmul_size)
+    return None
+
+def benchmark_rank(rank: int, args):
+    """
+    One rank of the distributed benchmark: read a disjoint shard of the samples, then 
+    gather the per-rank results on rank 0. Ranks are either local processes (`rank` is 
+    given, rendezvous on `args.master_port`) or launched by torchrun (`rank` is None).
+    """
+    if rank is None:
+        dist.init_process_group(backend="gloo")
+    else:
+        dist.init_process_group(backend="gloo", init_method=f"tcp://127.0.0.1:{args.master_port}", world_size=args.local_ranks, rank=rank)
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    
+    # all ranks write to the experiment directory of rank 0
+    experiment_dir = [args.experiment_dir]
+    dist.broadcast_object_list(experiment_dir, src=0)
+    if experiment_dir[0] != args.experiment_dir:
+        if os.path.isdir(args.experiment_dir) and len(os.listdir(args.experiment_dir)) == 0: os.rmdir(args.experiment_dir)
+        args.experiment_dir = experiment_dir[0]
+    if rank == 0:
+        with open(os.path.join(args.experiment_dir, "args.yaml"), "w") as f:
+            yaml.dump(vars(args), f)
+    
+    counters = WorkerCounters(BaseDataset.COUNTERS + FrameCache.COUNTERS + SharedFrameCache.COUNTERS + StreamingDataset.COUNTERS + AsyncFrameReader.COUNTERS + ChunkCache.COUNTERS, num_workers=args.pt_workers)
+    chunk_cache = create_chunk_cache(args, counters)
+    sample_index = load_sample_index(args)
+    ds = setup_dataset(args, chunk_cache, sample_index)
+    # rank 0 computes the normalization statistics if they are missing, the other ranks load them
+    if rank == 0: load_norm_stats(args, ds)
+    dist.barrier()
+    norm_stats = load_norm_stats(args, ds)
+    dataset = create_dataset(args, ds, counters=counters, chunk_cache=chunk_cache, sample_index=sample_index, norm_stats=norm_stats)
+    consumer = create_consumer(args)
+    
+    if args.streaming:
+        # blocks are dealt to the ranks instead of sharding the sample indices
+        dataloader = create_streaming_loader(args, dataset, args.shuffle_buffer[0], rank=rank, world_size=world_size)
+        shard_size = len(dataloader.dataset)
+        assert shard_size > 0, f"rank {rank} streams no block, use a smaller --stream_block_timesteps"
+        logger.info(f"Rank {rank}/{world_size}: {shard_size} samples (streamed blocks)")
+    else:
+        shuffle = args.dataloader_kwargs.get("shuffle", False)
+        sampler = ShardedSampler(len(dataset), world_size, rank, mode=args.shard_mode, shuffle=shuffle, drop_last=args.dataloader_kwargs.get("drop_last", False))
+        dataloader_kwargs = {k: v for k, v in args.dataloader_kwargs.items() if k != "shuffle"}
+        dataloader = DataLoader(dataset, batch_size=args.batch_size, sampler=sampler, num_workers=args.pt_workers, **dataloader_kwargs)
+        shard_size = len(sampler)
+        logger.info(f"Rank {rank}/{world_size}: {shard_size} samples ({args.shard_mode} shard), {len(dataloader)} batches")
+    
+    # start all ranks together, so that they read concurrently
+    dist.barrier()
+    t0 = time.time()
+    summary = benchmark_loader(dataloader, args, consumer=consumer)
+    summary["wall_s"] = time.time() - t0
+    summary["rank"] = rank
+    summary["hostname"] = socket.gethostname()
+    summary["shard_size"] = shard_size
+    
+    results = [None] * world_size
+    dist.all_gather_object(results, summary)
+    if rank == 0:
+        total_samples = sum(result["num_samples"] for result in results)
+        wall = max(result["wall_s"] for result in results)
+        distributed_summary = {
+            "world_size": world_size,
+            "shard_mode": args.shard_mode,
+            "num_samples": total_samples,
+            "wall_s": wall,
+            "aggregate_samples_per_s": total_samples / wall,
+            "aggregate_sample_mb_per_s": float(total_samples * sample_nbytes(dataset) / 1024**2 / wall),
+            "rank_samples_per_s": [result["num_samples"] / result["wall_s"] for result in results],
+            "ranks": results,
+        }
+        header = f"{'rank':>4} {'host':<20} {'samples':>8} {'wall (s)':>9} {'samples/s':>10} {'mean (s)':>9} {'p99 (s)':>8}"
+        lines = [header, "-" * len(header)]
+        for result in results:
+            lines.append(f"{result['rank']:>4} {result['hostname'][:20]:<20} {result['num_samples']:>8} {result['wall_s']:>9.2f} {result['num_samples']/result['wall_s']:>10.2f} {result['mean']:>9.4f} {float(np.percentile(result['times'], 99)):>8.4f}")
+        logger.info("Per-rank throughput:\n" + "\n".join(lines))
+        logger.info(f"Aggregate over {world_size} ranks: {distributed_summary['aggregate_samples_per_s']:.2f} samples/s, {distributed_summary['aggregate_sample_mb_per_s']:.2f}MB/s")
+        with open(os.path.join(args.experiment_dir, "distributed_summary.yaml"), "w") as f:
+            yaml.dump(distributed_summary, f)
+    
+    dist.barrier()
+    dist.destroy_process_group()
+
+def main():
+    
+    t_start = time.time()
+    args = get_args()
+    logger.info(f"Experiment directory: {args.experiment_dir}")
+    
+    # distributed benchmark, on local processes or launched by torchrun
+    if args.local_ranks > 0:
+        logger.info(f"Starting {args.local_ranks} local ranks")
+        torch.multiprocessing.spawn(benchmark_rank, args=(args,), nprocs=args.local_ranks)
+        return
+    if args.distributed:
+        benchmark_rank(None, args)
+        return
+    
+    with open(os.path.join(args.experiment_dir, "args.yaml"), "w") as f:
+        yaml.dump(vars(args), f)
+    
+    # counters shared with the dataloader workers
+    counters = WorkerCounters(BaseDataset.COUNTERS + FrameCache.COUNTERS + SharedFrameCache.COUNTERS + StreamingDataset.COUNTERS + AsyncFrameReader.COUNTERS + ChunkCache.COUNTERS, num_workers=args.pt_workers)
+    
+    # dask setup and dataset, staged to the chunk cache if any
+    chunk_cache = create_chunk_cache(args, counters)
+    sample_index = load_sample_index(args)
+    ds = setup_dataset(args, chunk_cache, sample_index)
+    norm_stats = load_norm_stats(args, ds)
+    counters.reset()
+    profiler = None
+    if args.profile:
+        trace_dir = os.path.join(args.experiment_dir, "trace") if args.trace else None
+        profiler = StageProfiler(num_workers=args.pt_workers, trace_dir=trace_dir)
+    collate_fn = ProfiledCollate(profiler) if profiler is not None else default_collate
+    consumer = create_consumer(args)
+    
+    # create dataset
+    dataset = create_dataset(args, ds, counters=counters, profiler=profiler, chunk_cache=chunk_cache, sample_index=sample_index, norm_stats=norm_stats)
     
     # create dataloader
-    dataloader = DataLoader(
-        dataset,
-        batch_size=args.batch_size,
-        num_workers=args.pt_workers,
-        **args.dataloader_kwargs,
-    )
+    shuffle = args.dataloader_kwargs.get("shuffle", False)
+    if args.block_shuffle:
+        # the batch sampler shuffles and drops the last batch, the loader must not get these options
+        dataloader_kwargs = {k: v for k, v in args.dataloader_kwargs.items() if not k in ["shuffle", "drop_last"]}
+        batch_sampler = BlockBatchSampler(len(dataset), args.batch_size, shuffle=shuffle, drop_last=args.dataloader_kwargs.get("drop_last", False))
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=args.pt_workers,
+            collate_fn=collate_fn,
+            **dataloader_kwargs,
+        )
+    else:
+        dataloader = DataLoader(
+            dataset,
+            batch_size=args.batch_size,
+            num_workers=args.pt_workers,
+            collate_fn=collate_fn,
+            **args.dataloader_kwargs,
+        )
     logger.info(f"Created dataloader with {len(dataloader)} batches")
     
-    # benchmark dataloader
-    times = []
-    t0 = time.time()
-    for i, (x, y) in enumerate(dataloader):
-        times.append(time.time() - t0)
-        t0 = time.time()
-        
-        if i==0 or i % args.log_frequency == 0:
-            logger.info(f"Sample {i+1}/{args.num_samples} - x:{x.shape}, y:{y.shape} - Time: {times[-1]:.4f}s")
-            
-        if i == args.num_samples:
-            break
-        
-    mean, std = np.mean(times), np.std(times)
-    logger.info(f"Mean time: {mean:.4f}s, Std: {std:.4f}s")
-    times_summary = {
-        "times": times,
-        "mean": float(mean),
-        "std": float(std),
+    setup_s = time.time() - t_start
+    
+    # full-field samples, for comparison with the patches or region
+    comparison = {}
+    if args.compare_patches:
+        full_args = argparse.Namespace(**{**vars(args), "patch_size": None, "region": None, "align_patches": False})
+        full_dataset = create_dataset(full_args, ds, counters=counters, profiler=profiler, chunk_cache=chunk_cache, sample_index=sample_index, norm_stats=norm_stats)
+        full_loader = DataLoader(full_dataset, batch_size=args.batch_size, num_workers=args.pt_workers, collate_fn=collate_fn, **args.dataloader_kwargs)
+        logger.info(f"Benchmarking full-field samples ({args.pt_workers} workers) for comparison")
+        comparison["full_field"] = benchmark_loader(full_loader, args, profiler=profiler, consumer=consumer)
+        comparison["full_field"]["sample_mb"] = sample_nbytes(full_dataset) / 1024**2
+        if profiler is not None:
+            comparison["full_field"]["profile"] = profiler.summary(num_samples=counters.totals()["samples"])
+            profiler.reset()
+        counters.reset()
+    
+    # benchmark dataloader, or the prefetch loader or streaming loader (optionally after the dataloader for comparison)
+    if args.streaming:
+        if args.compare_loaders:
+            logger.info(f"Benchmarking map-style dataloader ({args.pt_workers} workers) for comparison")
+            comparison["map_style"] = benchmark_loader(dataloader, args, profiler=profiler, consumer=consumer, memory=True)
+            if profiler is not None:
+                comparison["map_style"]["profile"] = profiler.summary(num_samples=counters.totals()["samples"])
+                profiler.reset()
+            counters.reset()
+        for shuffle_buffer in args.shuffle_buffer[1:]:
+            logger.info(f"Benchmarking streaming with a shuffle buffer of {shuffle_buffer} samples for comparison")
+            name = f"shuffle_buffer_{shuffle_buffer}"
+            comparison[name] = benchmark_loader(create_streaming_loader(args, dataset, shuffle_buffer, collate_fn), args, profiler=profiler, consumer=consumer, memory=True)
+            comparison[name]["stream_buffer_peak_mb"] = counters.totals()["stream_buffer_peak_bytes"] / 1024**2
+            if profiler is not None:
+                comparison[name]["profile"] = profiler.summary(num_samples=counters.totals()["samples"])
+                profiler.reset()
+            counters.reset()
+        loader = create_streaming_loader(args, dataset, args.shuffle_buffer[0], collate_fn)
+    elif args.prefetch_depth > 0:
+        if args.compare_loaders:
+            logger.info(f"Benchmarking dataloader ({args.pt_workers} workers) for comparison")
+            comparison["dataloader"] = benchmark_loader(dataloader, args, profiler=profiler, consumer=consumer)
+            if profiler is not None:
+                comparison["dataloader"]["profile"] = profiler.summary(num_samples=counters.totals()["samples"])
+                profiler.reset()
+            counters.reset()
+        if not args.block_shuffle:
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+            batch_sampler = BatchSampler(sampler, args.batch_size, drop_last=args.dataloader_kwargs.get("drop_last", False))
+        loader = PrefetchLoader(
+            dataset,
+            batch_sampler,
+            prefetch_depth=args.prefetch_depth,
+            io_threads=args.io_threads,
+            collate_fn=collate_fn,
+            pin_memory=args.dataloader_kwargs.get("pin_memory", False),
+        )
+        logger.info(f"Benchmarking prefetch loader (depth: {args.prefetch_depth}, threads: {args.io_threads})")
+    else:
+        loader = dataloader
+    times_summary = benchmark_loader(loader, args, profiler=profiler, consumer=consumer, memory=args.streaming)
+    times_summary["startup"] = {
+        "setup_s": setup_s,
+        "first_batch_s": times_summary["times"][0],
+        "time_to_first_batch_s": setup_s + times_summary["times"][0],
     }
+    logger.info(f"Time to first batch: {times_summary['startup']['time_to_first_batch_s']:.3f}s (setup: {setup_s:.3f}s, first batch: {times_summary['startup']['first_batch_s']:.3f}s)")
+    if args.epochs > 1:
+        times_summary.update(benchmark_epochs(loader, args, times_summary, counters, profiler=profiler, consumer=consumer))
+    times, mean, std = times_summary["times"], times_summary["mean"], times_summary["std"]
+    times_summary["loader"] = "streaming" if args.streaming else "prefetch" if args.prefetch_depth > 0 else "dataloader"
+    if len(comparison) > 0:
+        times_summary["comparison"] = comparison
+    if "full_field" in comparison:
+        full = comparison["full_field"]
+        read = ""
+        if "profile" in full and full["profile"]["chunks_read"] > 0:
+            read = f", {full['profile']['bytes_read_per_sample']/1024**2:.2f}MB read per sample"
+        logger.info(f"Full-field samples: {full['samples_per_s']:.2f} samples/s, {full['sample_mb']:.2f}MB per sample{read}")
+    
+    # memory: peak RSS of this process and of the (terminated) dataloader workers
+    totals = counters.totals()
+    times_summary["bytes_copied_per_sample"] = totals["bytes_copied"] / max(totals["samples"], 1)
+    times_summary["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    times_summary["peak_rss_children_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    logger.info(f"Batch bytes per sample: {times_summary['batch_bytes_per_sample']/1024**2:.2f}MB ({dataset.out_dtype}), bytes copied per sample: {times_summary['bytes_copied_per_sample']/1024**2:.2f}MB, peak RSS: {times_summary['peak_rss_mb']:.1f}MB (workers: {times_summary['peak_rss_children_mb']:.1f}MB)")
+    if dataset.cache is not None:
+        cache_summary = {name: totals[name] for name in FrameCache.COUNTERS}
+        lookups = cache_summary["cache_hits"] + cache_summary["cache_misses"]
+        cache_summary["cache_hit_rate"] = cache_summary["cache_hits"] / lookups if lookups > 0 else 0.
+        cache_summary["cache_mb"] = args.cache_mb
+        logger.info(f"Cache: {cache_summary}")
+        times_summary["cache"] = cache_summary
+    if dataset.shared_cache is not None:
+        shared_cache_summary = {name: totals[name] for name in SharedFrameCache.COUNTERS}
+        lookups = shared_cache_summary["shared_cache_hits"] + shared_cache_summary["shared_cache_misses"]
+        shared_cache_summary["shared_cache_hit_rate"] = shared_cache_summary["shared_cache_hits"] / lookups if lookups > 0 else 0.
+        shared_cache_summary["shared_cache_cross_hit_rate"] = shared_cache_summary["shared_cache_cross_hits"] / lookups if lookups > 0 else 0.
+        # frames served from the cache are not read and decoded again
+        requested_bytes = shared_cache_summary["shared_cache_hit_bytes"] + shared_cache_summary["shared_cache_miss_bytes"]
+        shared_cache_summary["read_bytes_reduction"] = shared_cache_summary["shared_cache_hit_bytes"] / requested_bytes if requested_bytes > 0 else 0.
+        shared_cache_summary["shared_cache_mb"] = args.shared_cache_mb
+        shared_cache_summary.update(dataset.shared_cache.summary())
+        logger.info(f"Shared cache: {shared_cache_summary['shared_cache_hit_rate']:.1%} hits ({shared_cache_summary['shared_cache_cross_hit_rate']:.1%} from other workers), {shared_cache_summary['read_bytes_reduction']:.1%} fewer bytes read")
+        times_summary["shared_cache"] = shared_cache_summary
+        dataset.shared_cache.close()
+    if chunk_cache is not None:
+        chunk_cache_summary = {name: totals[name] for name in ChunkCache.COUNTERS}
+        lookups = chunk_cache_summary["chunk_cache_hits"] + chunk_cache_summary["chunk_cache_misses"]
+        chunk_cache_summary["chunk_cache_hit_rate"] = chunk_cache_summary["chunk_cache_hits"] / lookups if lookups > 0 else 0.
+        chunk_cache_summary["chunk_cache_mb"] = chunk_cache.nbytes() / 1024**2
+        logger.info(f"Chunk cache: {chunk_cache_summary}")
+        times_summary["chunk_cache"] = chunk_cache_summary
+    if args.patch_size is not None or args.region is not None:
+        times_summary["spatial"] = {
+            "region": args.region,
+            "patch_size": args.patch_size,
+            "patch_align": list(dataset.patch_align),
+            "spatial_shape": list(dataset.spatial_shape),
+            "sample_mb": sample_nbytes(dataset) / 1024**2,
+        }
+        logger.info(f"Samples of {dataset.spatial_shape} grid points: {times_summary['samples_per_s']:.2f} samples/s, {times_summary['spatial']['sample_mb']:.2f}MB per sample")
+    if args.streaming:
+        # throughput and memory of the streaming loaders (and of the map-style dataloader)
+        # the workers of each epoch add their peak, comparisons run a single epoch
+        times_summary["stream_buffer_peak_mb"] = totals["stream_buffer_peak_bytes"] / 1024**2 / args.epochs
+        runs = [("map_style", comparison.get("map_style"))] + [(f"shuffle_buffer_{size}", times_summary if k == 0 else comparison[f"shuffle_buffer_{size}"]) for k, size in enumerate(args.shuffle_buffer)]
+        streaming_summary = {}
+        header = f"{'loader':<22} {'samples/s':>10} {'p99 (s)':>8} {'peak RSS (MB)':>14} {'buffer (MB)':>12}"
+        lines = [header, "-" * len(header)]
+        for name, run in runs:
+            if run is None: continue
+            streaming_summary[name] = {
+                "samples_per_s": run["samples_per_s"],
+                "p99": float(np.percentile(run["times"], 99)),
+                "peak_tree_rss_mb": run["peak_tree_rss_mb"],
+                "stream_buffer_peak_mb": run.get("stream_buffer_peak_mb"),
+            }
+            buffer = f"{run['stream_buffer_peak_mb']:.1f}" if "stream_buffer_peak_mb" in run else "-"
+            lines.append(f"{name:<22} {run['samples_per_s']:>10.2f} {streaming_summary[name]['p99']:>8.4f} {run['peak_tree_rss_mb']:>14.1f} {buffer:>12}")
+        logger.info(f"Streaming (blocks of {args.stream_block_timesteps} windows, {args.pt_workers} workers):\n" + "\n".join(lines))
+        times_summary["streaming"] = streaming_summary
+    if isinstance(dataset, AsyncZarrDataset):
+        async_summary = AsyncFrameReader.summarize(totals)
+        logger.info(f"Async reads: {async_summary}")
+        times_summary["async"] = async_summary
+    if profiler is not None:
+        profile_summary = profiler.summary(num_samples=totals["samples"])
+        header = f"{'stage':<8} {'count':>8} {'total (s)':>10} {'mean (ms)':>10} {'p50 (ms)':>10} {'p90 (ms)':>10} {'p99 (ms)':>10}"
+        lines = [header, "-" * len(header)]
+        for stage, stage_summary in profile_summary["stages"].items():
+            lines.append(f"{stage:<8} {stage_summary['count']:>8} {stage_summary['total_s']:>10.3f} {stage_summary['mean_ms']:>10.3f} {stage_summary['p50_ms']:>10.3f} {stage_summary['p90_ms']:>10.3f} {stage_summary['p99_ms']:>10.3f}")
+        logger.info("Stage timings (all processes):\n" + "\n".join(lines))
+        if profile_summary["chunks_read"] > 0:
+            logger.info(f"Read {profile_summary['bytes_read_per_sample']/1024**2:.2f}MB in {profile_summary['chunks_read_per_sample']:.1f} chunks per sample")
+            if "spatial" in times_summary:
+                times_summary["spatial"]["bytes_read_per_sample"] = profile_summary["bytes_read_per_sample"]
+        times_summary["profile"] = profile_summary
+        if args.trace:
+            num_events = profiler.write_trace(os.path.join(args.experiment_dir, "trace.json"))
+            logger.info(f"Wrote {num_events} trace events to {os.path.join(args.experiment_dir, 'trace.json')}")
     with open(os.path.join(args.experiment_dir, "times_summary.yaml"), "w") as f:
         yaml.dump(times_summary, f)
     
@@ -0,0 +1,65 @@
+import numpy as np
+import logging
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class FrameCache(object):
+    """
+    Bounded LRU cache of decoded frames, evicted by size in bytes.
+    
+    A frame is a single timestep of a single variable, keyed by (timestep, variable).
+    Each process (i.e. each dataloader worker) holds its own cache, hits and misses 
+    are reported through an optional `WorkerCounters` so they can be read from the 
+    main process.
+    """
+    COUNTERS = ["cache_hits", "cache_misses", "cache_evictions"]
+    
+    def __init__(self, max_bytes: int, counters=None):
+        assert isinstance(max_bytes, int), "max_bytes must be an integer"
+        assert max_bytes > 0, "max_bytes must be greater than 0"
+        
+        self.max_bytes = max_bytes
+        self.counters = counters
+        self.nbytes = 0
+        self._frames = OrderedDict()
+        
+    def __len__(self):
+        return len(self._frames)
+    
+    def __contains__(self, key):
+        return key in self._frames
+    
+    def _count(self, name, value=1):
+        if self.counters is not None:
+            self.counters.add(name, value)
+    
+    def get(self, key) -> np.ndarray|None:
+        """
+        Return the cached frame for `key` (marking it as most recently used), or None.
+        """
+        frame = self._frames.get(key)
+        if frame is None:
+            self._count("cache_misses")
+            return None
+        self._frames.move_to_end(key)
+        self._count("cache_hits")
+        return frame
+    
+    def put(self, key, frame: np.ndarray):
+        """
+        Insert a frame, evicting least recently used frames until it fits.
+        """
+        if frame.nbytes > self.max_bytes:
+            logger.debug(f"Frame {key} ({frame.nbytes} bytes) does not fit in cache")
+            return
+        if key in self._frames:
+            self.nbytes -= self._frames.pop(key).nbytes
+        
+        self._frames[key] = frame
+        self.nbytes += frame.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self._count("cache_evictions")
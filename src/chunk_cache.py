@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import fcntl
+import os
+
+logger = logging.getLogger(__name__)
+
+class ChunkCache(object):
+    """
+    Size-capped LRU cache of stored objects (chunks, shards, metadata) in a local directory,
+    e.g. `$TMPDIR` on a compute node.
+
+    Objects are files named after their store key, written atomically (temporary file + rename),
+    so the dataloader workers of all ranks on a node can share the same directory. A hit
+    touches the file, and eviction removes the least recently touched files (by mtime) until
+    the cache is back under 90% of `max_bytes` (0: no cap). Each process tracks the bytes
+    it wrote since it last scanned the directory, eviction scans and runs under a lock file,
+    so the cap may be exceeded by the writes of the other processes in between.
+    """
+    COUNTERS = ["chunk_cache_hits", "chunk_cache_misses", "chunk_cache_fetched_bytes", "chunk_cache_evictions"]
+
+    def __init__(self, cache_dir: str, max_bytes: int=0, counters=None):
+        assert isinstance(max_bytes, int) and max_bytes >= 0, "max_bytes must be a non-negative integer"
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.counters = counters
+        os.makedirs(cache_dir, exist_ok=True)
+        self._nbytes = None
+
+    @staticmethod
+    def dataset_dir(root: str, path: str) -> str:
+        """
+        Cache directory of the dataset at `path` under `root` (environment variables are expanded).
+        """
+        name = os.path.basename(path.rstrip("/"))
+        return os.path.join(os.path.expandvars(root), f"{name}-{hashlib.sha1(path.encode()).hexdigest()[:8]}")
+
+    def _count(self, name, value=1):
+        if self.counters is not None:
+            self.counters.add(name, value)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, *key.split("/"))
+
+    def __contains__(self, key: str):
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> bytes|None:
+        """
+        Cached value of `key` (marking it as most recently used), or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # also when evicted by another process between the read and the touch
+            self._count("chunk_cache_misses")
+            return None
+        self._count("chunk_cache_hits")
+        return value
+
+    def put(self, key: str, value: bytes):
+        """
+        Store a value fetched from the source, evicting least recently used objects above the cap.
+        """
+        value = bytes(value)
+        self._count("chunk_cache_fetched_bytes", len(value))
+        if self.max_bytes > 0 and len(value) > self.max_bytes:
+            logger.debug(f"{key} ({len(value)} bytes) does not fit in the chunk cache")
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+
+        if self.max_bytes == 0: return
+        if self._nbytes is None: self._nbytes = self.nbytes()
+        self._nbytes += len(value)
+        if self._nbytes > self.max_bytes:
+            self.evict()
+
+    def _files(self) -> list[os.DirEntry]:
+        files, dirs = [], [self.cache_dir]
+        while len(dirs) > 0:
+            with os.scandir(dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False): dirs.append(entry.path)
+                    elif entry.name != ".lock" and not ".tmp-" in entry.name: files.append(entry)
+        return files
+
+    def nbytes(self) -> int:
+        return sum(entry.stat().st_size for entry in self._files())
+
+    def evict(self) -> int:
+        """
+        Remove least recently used objects until the cache is under 90% of its cap, returns the number removed.
+        """
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            files = []
+            for entry in self._files():
+                try: files.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+                except FileNotFoundError: pass
+            files.sort()
+            nbytes, num_evicted = sum(size for _, size, _ in files), 0
+            for _, size, path in files:
+                if nbytes <= 0.9 * self.max_bytes: break
+                try: os.remove(path)
+                except FileNotFoundError: pass
+                nbytes -= size
+                num_evicted += 1
+            self._nbytes = nbytes
+        self._count("chunk_cache_evictions", num_evicted)
+        return num_evicted
@@ -0,0 +1,216 @@
+import xarray as xr
+import argparse
+import logging
+import time
+import yaml
+import os
+import numpy as np
+import zarr
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from codename import codename
+
+from write import get_numcodecs
+from args import Arguments
+from utils import load_dataset, chunk_files
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# Suppress logs from Google libraries
+logging.getLogger('google').setLevel(logging.ERROR)
+logging.getLogger('google.auth').setLevel(logging.ERROR)
+logging.getLogger('google.cloud').setLevel(logging.ERROR)
+
+def get_args():
+    logger.info("Parsing arguments")
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(Arguments.DATASET.flag, **Arguments.DATASET.kwargs)
+    parser.add_argument(Arguments.EXPERIMENT_DIR.flag, **Arguments.EXPERIMENT_DIR.kwargs)
+    parser.add_argument(Arguments.CHUNKS_OPEN_STRATEGY.flag, **Arguments.CHUNKS_OPEN_STRATEGY.kwargs)
+    parser.add_argument(Arguments.VARIABLES.flag, **Arguments.VARIABLES.kwargs)
+    parser.add_argument(Arguments.LEVELS.flag, **Arguments.LEVELS.kwargs)
+    parser.add_argument(Arguments.DATE_START_BENCHMARK.flag, **Arguments.DATE_START_BENCHMARK.kwargs)
+    parser.add_argument(Arguments.DATE_END_BENCHMARK.flag, **Arguments.DATE_END_BENCHMARK.kwargs)
+    parser.add_argument(Arguments.CODECS.flag, **Arguments.CODECS.kwargs)
+    parser.add_argument(Arguments.CODEC_TIMESTEPS.flag, **Arguments.CODEC_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.DECODE_THREADS.flag, **Arguments.DECODE_THREADS.kwargs)
+    parser.add_argument(Arguments.READ_STORE.flag, **Arguments.READ_STORE.kwargs)
+
+    # parse arguments
+    args = parser.parse_args()
+
+    args.experiment_dir = os.path.join(
+        args.experiment_dir,
+        "codecs-" + codename(separator="_") + "-" + datetime.now().strftime("%Y%m%dT%H%M%S")
+    )
+    os.makedirs(args.experiment_dir, exist_ok=True)
+
+    try: args.chunks_open_strategy = eval(args.chunks_open_strategy)
+    except Exception as e: pass
+
+    args.date_range = [args.date_start, args.date_end]
+
+    args.zarr_version = zarr.__version__
+    if args.zarr_version.startswith("2."):
+        logger.info("Zarr version 2.x detected")
+        args.zarr_format = 2
+    elif args.zarr_version.startswith("3."):
+        logger.info("Zarr version 3.x detected")
+        args.zarr_format = 3
+    else:
+        raise ValueError(f"Unknown Zarr version: {args.zarr_version}")
+
+    for codec in args.codecs:
+        get_numcodecs(codec)
+
+    return args
+
+def load_frames(args, ds: xr.Dataset) -> list[np.ndarray]:
+    """
+    One frame per (timestep, variable), i.e. the chunks of the `optimal_dataset` write strategy.
+    """
+    frames = []
+    for t in range(ds.sizes["time"]):
+        for var in args.variables:
+            frames.append(np.ascontiguousarray(ds[var].isel(time=t).values))
+    return frames
+
+def encode(frame: np.ndarray, compressor, filters) -> bytes:
+    buf = frame
+    for f in filters:
+        buf = f.encode(buf)
+    return compressor.encode(buf) if compressor is not None else np.ascontiguousarray(buf).tobytes()
+
+def decode(buf: bytes, compressor, filters, dtype, shape) -> np.ndarray:
+    if compressor is not None:
+        buf = compressor.decode(buf)
+    for f in reversed(filters):
+        buf = f.decode(buf)
+    return np.frombuffer(buf, dtype=dtype).reshape(shape)
+
+def measure_codec(args, codec: str, frames: list[np.ndarray]) -> dict:
+    """
+    Compression ratio, single-thread encode MB/s, decode MB/s per number of threads and error of a codec.
+    """
+    compressor, filters = get_numcodecs(codec, frames[0].dtype)
+    nbytes = sum(frame.nbytes for frame in frames)
+
+    t0 = time.perf_counter()
+    encoded = [encode(frame, compressor, filters) for frame in frames]
+    encode_time = time.perf_counter() - t0
+
+    decode_mbps = {}
+    for num_threads in args.decode_threads:
+        with ThreadPoolExecutor(num_threads) as executor:
+            t0 = time.perf_counter()
+            decoded = list(executor.map(lambda i: decode(encoded[i], compressor, filters, frames[i].dtype, frames[i].shape), range(len(frames))))
+            decode_time = time.perf_counter() - t0
+        decode_mbps[num_threads] = nbytes / decode_time / 1024**2
+
+    max_abs_error = max(float(np.max(np.abs(frame.astype(np.float64) - out))) for frame, out in zip(frames, decoded))
+    return {
+        "codec": codec,
+        "ratio": nbytes / sum(len(buf) for buf in encoded),
+        "encode_mbps": nbytes / encode_time / 1024**2,
+        "decode_mbps": decode_mbps,
+        "max_abs_error": max_abs_error,
+    }
+
+def drop_cached(file: str) -> bool:
+    """
+    Evict a file from the page cache, returns False if the platform cannot (no posix_fadvise).
+    Dirty pages are not evicted, so the file is flushed first.
+    """
+    if not hasattr(os, "posix_fadvise"): return False
+    fd = os.open(file, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally: os.close(fd)
+    return True
+
+def measure_read(args) -> dict:
+    """
+    Raw read MB/s of the chunk files of a local store per number of threads.
+
+    The files are evicted from the page cache before each timed pass, so the reads come from the
+    storage rather than from memory. Where they cannot be evicted, the cache is warmed before the
+    first pass instead, and `cache` is "warm": the MB/s are then memory bandwidth.
+    """
+    files = chunk_files(args.read_store)
+    assert len(files) > 0, f"No chunk files found in {args.read_store}"
+    def read(file):
+        with open(file, "rb") as f:
+            return len(f.read())
+    nbytes = sum(os.path.getsize(file) for file in files)
+    cold = all(drop_cached(file) for file in files)
+    if not cold:
+        logger.warning("Cannot evict the chunk files from the page cache, read MB/s and bound verdicts assume a warm cache")
+        list(map(read, files))
+
+    read_mbps = {}
+    for num_threads in args.decode_threads:
+        if cold:
+            for file in files: drop_cached(file)
+        with ThreadPoolExecutor(num_threads) as executor:
+            t0 = time.perf_counter()
+            list(executor.map(read, files))
+            read_mbps[num_threads] = nbytes / (time.perf_counter() - t0) / 1024**2
+    return {"store": args.read_store, "num_files": len(files), "nbytes": nbytes, "cache": "cold" if cold else "warm", "read_mbps": read_mbps}
+
+def main():
+    args = get_args()
+    logger.info(f"Experiment directory: {args.experiment_dir}")
+    with open(os.path.join(args.experiment_dir, "args.yaml"), "w") as f:
+        yaml.dump(vars(args), f)
+
+    # load the time slice once, every codec encodes the same frames
+    logger.info(f"Loading dataset from {args.dataset} for dates {args.date_range[0]} to {args.date_range[1]}")
+    ds = load_dataset(args, force_zarr_format=not args.dataset.startswith("gs://"))
+    ds = ds.isel(time=slice(0, args.codec_timesteps)).load()
+    frames = load_frames(args, ds)
+    logger.info(f"Loaded {len(frames)} frames ({sum(frame.nbytes for frame in frames)/1024**2:.2f}MB)")
+
+    results = []
+    for codec in args.codecs:
+        result = measure_codec(args, codec, frames)
+        results.append(result)
+        logger.info(f"Codec {codec}: ratio {result['ratio']:.2f}, encode {result['encode_mbps']:.1f}MB/s, decode {result['decode_mbps']}MB/s")
+
+    # a codec is CPU-bound when it decodes slower than the store delivers (uncompressed) bytes
+    read = measure_read(args) if args.read_store is not None else None
+    if read is not None:
+        logger.info(f"Raw read of {read['store']} ({read['cache']} page cache): {read['read_mbps']}MB/s")
+        for result in results:
+            result["bound"] = {
+                num_threads: "cpu" if result["decode_mbps"][num_threads] < read["read_mbps"][num_threads] * result["ratio"] else "io"
+                for num_threads in args.decode_threads
+            }
+
+    # ranked table
+    results = sorted(results, key=lambda result: result["decode_mbps"][max(args.decode_threads)], reverse=True)
+    header = f"{'rank':>4} {'codec':<40} {'ratio':>6} {'encode MB/s':>12} " + " ".join(f"{f'decode@{n} MB/s':>15}" for n in args.decode_threads) + f" {'max abs err':>12}"
+    if read is not None:
+        header += f" {'bound':>{4*len(args.decode_threads)}}"
+    lines = [header, "-" * len(header)]
+    for rank, result in enumerate(results):
+        line = f"{rank+1:>4} {result['codec']:<40} {result['ratio']:>6.2f} {result['encode_mbps']:>12.1f} " + " ".join(f"{result['decode_mbps'][n]:>15.1f}" for n in args.decode_threads) + f" {result['max_abs_error']:>12.3g}"
+        if read is not None:
+            line += f" {'/'.join(result['bound'][n] for n in args.decode_threads):>{4*len(args.decode_threads)}}"
+        lines.append(line)
+    logger.info("Ranked codecs" + (f" (bound: cpu/io against {read['cache']}-cache reads)" if read is not None else "") + ":\n" + "\n".join(lines))
+
+    with open(os.path.join(args.experiment_dir, "codecs.yaml"), "w") as f:
+        yaml.dump({"read": read, "results": results}, f, sort_keys=False)
+
+if __name__ == "__main__":
+    main()
+    logger.info("Finished codec benchmark")
@@ -0,0 +1,42 @@
+import torch
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SyntheticConsumer(object):
+    """
+    Stand-in for the training step run between two batches.
+
+    `sleep` idles for `step_ms`, like a host waiting on a GPU step, so the loader can use
+    all CPUs meanwhile. `matmul` multiplies (matmul_size x matmul_size) float32 matrices
+    until `step_ms` has elapsed (at least once), so the step competes with the loader for CPU.
+    """
+    KINDS = ["sleep", "matmul"]
+
+    def __init__(self, step_ms: float=0., kind: str="sleep", matmul_size: int=1024):
+        assert step_ms >= 0, "step_ms must be non-negative"
+        assert kind in self.KINDS, f"kind must be one of {self.KINDS}"
+        assert isinstance(matmul_size, int) and matmul_size > 0, "matmul_size must be a positive integer"
+        self.step_ms = step_ms
+        self.kind = kind
+        self.matmul_size = matmul_size
+        self._a, self._b = None, None
+
+    def __call__(self, x: torch.Tensor, y: torch.Tensor) -> float:
+        """
+        Run one step on a batch, returns its duration in seconds.
+        """
+        t0 = time.perf_counter()
+        if self.kind == "sleep":
+            time.sleep(self.step_ms / 1e3)
+        else:
+            if self._a is None:
+                self._a = torch.randn(self.matmul_size, self.matmul_size)
+                self._b = torch.randn(self.matmul_size, self.matmul_size)
+            # touch the batch, as a forward pass would
+            x.sum(); y.sum()
+            while True:
+                torch.mm(self._a, self._b)
+                if time.perf_counter() - t0 >= self.step_ms / 1e3: break
+        return time.perf_counter() - t0
@@ -1,38 +1,85 @@
 import xarray as xr
+import pandas as pd
+import numpy as np
+import dask.array
 import torch
+import zarr
 import logging
+import copy
+import json
+import os
 
 from torch.utils.data import Dataset
 
+from cache import FrameCache
+from shared_cache import SharedFrameCache
+from async_reader import AsyncFrameReader
+from utils import zarr_dims
+from profiler import maybe_span
+from store import open_store, ProfiledStore, CachingStore, SnapshotStore
+
 logger = logging.getLogger(__name__)
 
-def dataarray_to_tensor(arr: xr.DataArray) -> torch.Tensor:
+zarr_format = int(zarr.__version__[0])
+if zarr_format == 3:
+    from zarr.core.buffer import default_buffer_prototype
+
+def dataarray_to_tensor(arr: xr.DataArray, profiler=None) -> torch.Tensor:
     """
     Convert an xarray dataset to a PyTorch tensor.
     """
-    tensor = torch.from_numpy(arr.values) # T, (C), H, W     
+    with maybe_span(profiler, "read"):
+        values = arr.values
+    tensor = torch.from_numpy(values) # T, (C), H, W     
     if not "level" in arr.dims: tensor = tensor.unsqueeze(1) # T, 1, H, W
     
     logger.debug(f"{arr.name} -> {tensor.shape}")
     
     return tensor
 
-def sample_to_tensor(sample: xr.Dataset) -> torch.Tensor:
+def sample_to_tensor(sample: xr.Dataset, counters=None, profiler=None) -> torch.Tensor:
     """
     Convert an xarray dataset to a PyTorch tensor.
     """
     tensors = []
     for var in sample.data_vars:
-        tensor = dataarray_to_tensor(sample[var])
+        tensor = dataarray_to_tensor(sample[var], profiler=profiler)
         tensors.append(tensor)
+        # dask concatenates the chunks of multi-chunk selections into a new array
+        if counters is not None and sample[var].chunks is not None and any(len(c) > 1 for c in sample[var].chunks):
+            counters.add("bytes_copied", tensor.nbytes)
     
     # Concatenate along the channel dimension
-    tensor = torch.cat(tensors, dim=1) # T, C, H, W
+    with maybe_span(profiler, "concat"):
+        tensor = torch.cat(tensors, dim=1) # T, C, H, W
     logger.debug(f"sample_to_tensor: {tensor.shape}")    
+    if counters is not None: counters.add("bytes_copied", tensor.nbytes)
 
     return tensor
 
 class BaseDataset(Dataset):
+    """
+    Samples of `num_input_timesteps` + `num_output_timesteps` consecutive timesteps of the selected 
+    variables and levels, as (T, C, H, W) tensors split into inputs and outputs.
+    
+    `ds` is a dataset with one array per variable, or the stacked array of the dataarray layout 
+    (a DataArray with a 'variable' dimension, surface variables broadcast over the levels). 
+    Stacked arrays are read with a single read per timestep, and the channels are gathered 
+    from the (variable, level) planes with one indexing copy (surface variables map to one plane).
+    
+    Samples cover the grid points of `region` (lat_min, lat_max, lon_min, lon_max in degrees, 
+    the full field by default). With `patch_size`, each sample is a random (lat, lon) patch of 
+    the region instead, drawn with the torch RNG (seeded per dataloader worker) at offsets that 
+    are multiples of `patch_align` in the grid of the store, and only the patch is read.
+    
+    With `normalization` ((mean, std) of each (variable, level) channel) and/or `out_dtype`, 
+    samples are normalized and cast in a single pass while they are written to the output (buffer).
+    
+    Decoded frames are cached per worker with `cache_bytes`, or across all dataloader workers 
+    with `shared_cache_bytes` (a `SharedFrameCache` created here, before the workers start).
+    """
+    COUNTERS = ["samples", "bytes_copied"]
+    
     def __init__(
         self, 
         ds: xr.Dataset, 
@@ -40,17 +87,43 @@ class BaseDataset(Dataset):
         num_output_timesteps=1,
         variables: list[str]=[],
         levels: list[int]=[],
+        cache_bytes: int=0,
+        counters=None,
+        preallocate: bool=False,
+        pin_memory: bool=False,
+        num_buffers: int=1,
+        coalesce_batches: bool=False,
+        profiler=None,
+        region: tuple=None,
+        patch_size: tuple=None,
+        patch_align: tuple=None,
+        normalization: dict=None,
+        out_dtype: torch.dtype=None,
+        shared_cache_bytes: int=0,
     ):
-        assert isinstance(ds, xr.Dataset), "ds must be an xarray Dataset"
+        assert isinstance(ds, (xr.Dataset, xr.DataArray)), "ds must be an xarray Dataset, or a DataArray with a 'variable' dimension"
         assert isinstance(num_input_timesteps, int), "num_input_timesteps must be an integer"
         assert isinstance(num_output_timesteps, int), "num_output_timesteps must be an integer"
         assert num_input_timesteps > 0, "num_input_timesteps must be greater than 0"
         assert num_output_timesteps > 0, "num_output_timesteps must be greater than 0"
         assert isinstance(variables, list), "variables must be a list"
         assert isinstance(levels, list), "levels must be a list"
+        dataset_levels = set(ds["level"].values.tolist())
+        assert all(level in dataset_levels for level in levels), "all levels must be in the dataset"
+        assert isinstance(cache_bytes, int) and cache_bytes >= 0, "cache_bytes must be a non-negative integer"
+        assert isinstance(num_buffers, int) and num_buffers > 0, "num_buffers must be a positive integer"
+        assert isinstance(shared_cache_bytes, int) and shared_cache_bytes >= 0, "shared_cache_bytes must be a non-negative integer"
+        assert cache_bytes == 0 or shared_cache_bytes == 0, "cache_bytes and shared_cache_bytes are exclusive"
+        assert patch_size is None or (cache_bytes == 0 and shared_cache_bytes == 0 and not coalesce_batches), "patches are drawn per sample, cache_bytes, shared_cache_bytes and coalesce_batches require full-field samples"
+        
+        # stacked layout: samples are read from the stacked array, ds is its per-variable view for metadata
+        self.stacked = None
+        if isinstance(ds, xr.DataArray):
+            assert "variable" in ds.dims, "a DataArray ds must have a 'variable' dimension"
+            ds, self.stacked = self._unstack(ds), ds
+        
         assert all(var in ds.data_vars for var in variables), "all variables must be in the dataset"
-        assert all(level in ds.level for level in levels), "all levels must be in the dataset"
-
+        
         self.ds = ds[variables].sel(level=levels)
         self.num_input_timesteps = num_input_timesteps
         self.num_output_timesteps = num_output_timesteps
@@ -59,15 +132,769 @@ class BaseDataset(Dataset):
         
         self.sample_timesteps = num_input_timesteps + num_output_timesteps
         self.total_timesteps = len(self.ds['time'])
+        self.surface_variables = [var for var in variables if not "level" in self.ds[var].dims]
+        self.counters = counters
+        self.profiler = profiler
+        
+        # per-worker cache of decoded (timestep, variable) frames, shared by overlapping windows
+        self.cache = FrameCache(cache_bytes, counters=counters) if cache_bytes > 0 else None
+        
+        # channel layout: (variable, level) of each channel, level is None for surface variables.
+        # each variable is written to a fixed slice of the channel dimension
+        self.layout = []
+        self.channel_slices = {}
+        for var in variables:
+            start = len(self.layout)
+            if var in self.surface_variables: self.layout.append((var, None))
+            else: self.layout.extend((var, level) for level in levels)
+            self.channel_slices[var] = slice(start, len(self.layout))
+        self.num_channels = len(self.layout)
+        
+        # spatial window of the samples: slices of the region, or of the patch of the current sample
+        self.region = self._region_slices(region)
+        self.patch_size = tuple(patch_size) if patch_size is not None else None
+        self.patch_align = tuple(patch_align) if patch_align is not None else (1, 1)
+        if self.patch_size is not None:
+            for dim, window, size, align in zip(["latitude", "longitude"], self.region, self.patch_size, self.patch_align):
+                first = -(-window.start // align) * align
+                assert 0 < size and first + size <= window.stop, f"no {dim} patch of {size} points aligned to {align} fits in the region"
+        self.spatial = self.region
+        self.spatial_shape = self.patch_size or tuple(window.stop - window.start for window in self.region)
+        self.dtype = np.result_type(*[self.ds[var].dtype for var in variables]) if len(variables) > 0 else np.float32
+        
+        # cache of decoded (timestep, variable) frames shared by all workers, in the layout of _read_variable
+        self.shared_cache = None
+        if shared_cache_bytes > 0:
+            frame_shapes = {var: ((len(levels),) if not var in self.surface_variables else ()) + self.spatial_shape for var in variables}
+            self.shared_cache = SharedFrameCache(shared_cache_bytes, frame_shapes, self.dtype, counters=counters)
+        self.cached = self.cache is not None or self.shared_cache is not None
+        
+        # (variable, level) plane of each channel in the stacked array, and its axes in (time, variable, level, lat, lon) order
+        if self.stacked is not None:
+            stacked_variables = [str(var) for var in self.stacked["variable"].values]
+            stacked_levels = self.stacked["level"].values.tolist()
+            self.stacked_index = (
+                np.array([stacked_variables.index(var) for var, _ in self.layout]),
+                np.array([0 if level is None else stacked_levels.index(level) for _, level in self.layout]),
+            )
+            dims = ["time", "variable", "level"]
+            self.stacked_axes = [self.stacked.dims.index(dim) for dim in dims + [dim for dim in self.stacked.dims if not dim in dims]]
+        
+        # output conversion: x * (1/std) + (-mean/std) and a cast, from samples read in self.dtype
+        self.read_dtype = torch.from_numpy(np.empty(0, dtype=self.dtype)).dtype
+        self.out_dtype = out_dtype if out_dtype is not None else self.read_dtype
+        self.norm_scale, self.norm_shift = None, None
+        if normalization is not None:
+            missing = [channel for channel in self.layout if not channel in normalization]
+            assert len(missing) == 0, f"no normalization statistics for channels {missing}"
+            mean, std = np.array([normalization[channel] for channel in self.layout], dtype=np.float32).T
+            self.norm_scale = torch.from_numpy(1 / std).view(-1, 1, 1)
+            self.norm_shift = torch.from_numpy(-mean / std).view(-1, 1, 1)
+        self.convert = normalization is not None or self.out_dtype != self.read_dtype
+        
+        # ring of reused (T, C, H, W) output buffers, allocated lazily in each worker. 
+        # the dataloader fetches a whole batch before collating it, so num_buffers 
+        # must be at least the batch size. With a conversion, samples are read into 
+        # a staging buffer first
+        self.preallocate = preallocate
+        self.pin_memory = pin_memory
+        self.num_buffers = num_buffers
+        self._buffers = None
+        self._buffer_index = 0
+        self._stage_buffer = None
+        
+        # batched fetching: read the time span of overlapping windows of a batch once
+        self.coalesce_batches = coalesce_batches
+        self._span_buffer = None
+        self._converted_span_buffer = None
 
     def __len__(self):
         return self.total_timesteps - self.sample_timesteps + 1
+    
+    def _region_slices(self, region) -> tuple:
+        """
+        (latitude, longitude) index slices of the grid points in a (lat_min, lat_max, lon_min, lon_max) bounding box.
+        """
+        if region is None:
+            return slice(0, self.ds.sizes["latitude"]), slice(0, self.ds.sizes["longitude"])
+        assert len(region) == 4, "region must be (lat_min, lat_max, lon_min, lon_max)"
+        lat_min, lat_max, lon_min, lon_max = region
+        assert lat_min <= lat_max and lon_min <= lon_max, "region bounds must be increasing (regions across the longitude wrap are not supported)"
+        slices = []
+        for dim, low, high in [("latitude", lat_min, lat_max), ("longitude", lon_min, lon_max)]:
+            # coordinates are monotonic, so the points inside the bounds are contiguous
+            index = np.flatnonzero((self.ds[dim].values >= low) & (self.ds[dim].values <= high))
+            assert len(index) > 0, f"no {dim} in [{low}, {high}]"
+            slices.append(slice(int(index[0]), int(index[-1])+1))
+        return tuple(slices)
+    
+    def _draw_patch(self):
+        """
+        Set the spatial window of the next sample to a random aligned patch of the region.
+        """
+        if self.patch_size is None: return
+        windows = []
+        for window, size, align in zip(self.region, self.patch_size, self.patch_align):
+            first = -(-window.start // align) * align
+            start = first + align * int(torch.randint((window.stop - size - first) // align + 1, ()))
+            windows.append(slice(start, start+size))
+        self.spatial = tuple(windows)
+    
+    def _spatial_isel(self) -> dict:
+        return {"latitude": self.spatial[0], "longitude": self.spatial[1]}
+    
+    @staticmethod
+    def _unstack(da: xr.DataArray) -> xr.Dataset:
+        """
+        Per-variable view of a stacked array in (time, (level), lat, lon) order, without the level dimension for surface variables.
+        """
+        surface_variables = da.attrs.get("surface_variables")
+        if surface_variables is None:
+            # stores written without the attribute: surface variables are constant over the levels
+            # synchronous: a dask thread pool started before the dataloader forks deadlocks the workers
+            frame = da.isel(time=0).transpose("variable", "level", ...).compute(scheduler="synchronous").values
+            surface_variables = [
+                str(var) for var, values in zip(da["variable"].values, frame) 
+                if np.all((values == values[:1]) | np.isnan(values))
+            ]
+            logger.info(f"Detected surface variables of the stacked array: {surface_variables}")
+        ds = da.transpose("time", "variable", "level", ...).to_dataset(dim="variable")
+        for var in surface_variables:
+            if var in ds.data_vars: ds[var] = ds[var].isel(level=0, drop=True)
+        return ds
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_buffers"], state["_span_buffer"] = None, None
+        state["_stage_buffer"], state["_converted_span_buffer"] = None, None
+        return state
+    
+    def clone(self):
+        """
+        Copy of the dataset with its own per-process state (buffers, cache, open arrays, readers), 
+        to be used from another thread. Counters are shared.
+        """
+        clone = copy.copy(self)
+        clone.__dict__.update(self.__getstate__())
+        if self.cache is not None:
+            clone.cache = FrameCache(self.cache.max_bytes, counters=self.counters)
+        return clone
+    
+    def _count(self, name, value=1):
+        if self.counters is not None:
+            self.counters.add(name, value)
+    
+    def _span(self, stage):
+        return maybe_span(self.profiler, stage)
+    
+    def _next_buffer(self) -> torch.Tensor:
+        if self._buffers is None:
+            pin_memory = self.pin_memory and torch.cuda.is_available()
+            if self.pin_memory and not pin_memory:
+                logger.warning("pin_memory requires CUDA, allocating pageable buffers")
+            shape = (self.sample_timesteps, self.num_channels, *self.spatial_shape)
+            self._buffers = [torch.empty(shape, dtype=self.out_dtype, pin_memory=pin_memory) for _ in range(self.num_buffers)]
+        buffer = self._buffers[self._buffer_index]
+        self._buffer_index = (self._buffer_index + 1) % self.num_buffers
+        return buffer
+    
+    def _next_stage_buffer(self) -> torch.Tensor:
+        if self._stage_buffer is None:
+            self._stage_buffer = torch.empty((self.sample_timesteps, self.num_channels, *self.spatial_shape), dtype=self.read_dtype)
+        return self._stage_buffer
+    
+    def _next_span_buffer(self, num_timesteps, converted: bool=False) -> torch.Tensor:
+        """
+        Reused (num_timesteps, C, H, W) buffer for batched fetching, grown when needed.
+        Converted spans (in the output dtype) have their own buffer.
+        """
+        name = "_converted_span_buffer" if converted else "_span_buffer"
+        if getattr(self, name) is None or getattr(self, name).shape[0] < num_timesteps:
+            setattr(self, name, None)
+            pin_memory = self.pin_memory and torch.cuda.is_available()
+            dtype = self.out_dtype if converted else self.read_dtype
+            setattr(self, name, torch.empty((num_timesteps, self.num_channels, *self.spatial_shape), dtype=dtype, pin_memory=pin_memory))
+        return getattr(self, name)[:num_timesteps]
+    
+    def _channel_view(self, out: np.ndarray, var) -> np.ndarray:
+        """
+        View of `out` (T, C, H, W) holding `var`, shaped like the variable: (T, (C), H, W).
+        """
+        channels = self.channel_slices[var]
+        if var in self.surface_variables: return out[:, channels.start]
+        return out[:, channels]
 
-    def __getitem__(self, i):
-        sample = self.ds.isel(time=slice(i, i+self.sample_timesteps))
-        sample = sample_to_tensor(sample)
+    def _read_frames(self, var, timesteps):
+        """
+        Read the frames of a variable for the given timesteps, going through the cache.
+        Missing frames are read with a single slice spanning all of them.
+        """
+        frames = {t: self.cache.get((t, var)) for t in timesteps}
+        missing = [t for t, frame in frames.items() if frame is None]
+        if len(missing) > 0:
+            with self._span("read"):
+                values = self._read_variable(var, missing[0], missing[-1]+1)
+            for t in missing:
+                frame = values[t-missing[0]]
+                # copy so that evicting a frame actually releases its memory
+                if len(values) > 1: frame = frame.copy()
+                self.cache.put((t, var), frame)
+                frames[t] = frame
+        return [frames[t] for t in timesteps]
+    
+    def _read_shared_frames(self, var, timesteps) -> tuple[list, list]:
+        """
+        Read the frames of a variable for the given timesteps through the shared cache, returns 
+        the frames and the slots to release once they are copied. Frames claimed by this 
+        process are read with a single slice spanning them and written to their slots, frames 
+        claimed by other workers are waited for afterwards (filling never waits, so workers do not deadlock).
+        """
+        cache = self.shared_cache
+        acquired = cache.acquire([(t, var) for t in timesteps])
+        frames, slots = {}, []
+        for t, (status, slot) in zip(timesteps, acquired):
+            if status == "hit":
+                frames[t] = cache.frame(slot, (t, var))
+                slots.append(slot)
+        
+        claimed = [slot for status, slot in acquired if status == "claimed"]
+        missing = [t for t, (status, _) in zip(timesteps, acquired) if status in ["claimed", "bypass"]]
+        if len(missing) > 0:
+            try:
+                with self._span("read"):
+                    values = self._read_variable(var, missing[0], missing[-1]+1)
+            except BaseException:
+                cache.abandon(claimed)
+                cache.release(slots)
+                raise
+            for t, (status, slot) in zip(timesteps, acquired):
+                if status == "claimed":
+                    frames[t] = cache.frame(slot, (t, var))
+                    frames[t][...] = values[t-missing[0]]
+                    slots.append(slot)
+                    self._count("bytes_copied", frames[t].nbytes)
+                elif status == "bypass":
+                    frames[t] = values[t-missing[0]]
+            cache.publish(claimed)
         
+        for t, (status, slot) in zip(timesteps, acquired):
+            if status == "wait":
+                frame = cache.wait((t, var), slot)
+                if frame is None:
+                    with self._span("read"):
+                        frame = self._read_variable(var, t, t+1)[0]
+                else:
+                    slots.append(slot)
+                frames[t] = frame
+        return [frames[t] for t in timesteps], slots
+    
+    def _read_span_frames(self, start, stop) -> tuple[dict, list]:
+        """
+        Frames of timesteps [start, stop) of each variable through the cache, and the slots 
+        of the shared cache to release once they are copied.
+        """
+        timesteps = list(range(start, stop))
+        if self.shared_cache is None:
+            return {var: self._read_frames(var, timesteps) for var in self.variables}, []
+        frames, slots = {}, []
+        try:
+            for var in self.variables:
+                frames[var], var_slots = self._read_shared_frames(var, timesteps)
+                slots += var_slots
+        except BaseException:
+            self.shared_cache.release(slots)
+            raise
+        return frames, slots
+    
+    def _read_cached(self, start, stop):
+        frames, slots = self._read_span_frames(start, stop)
+        try:
+            with self._span("concat"):
+                tensors = []
+                for var in self.variables:
+                    tensor = torch.from_numpy(np.stack(frames[var])) # T, (C), H, W
+                    if var in self.surface_variables: tensor = tensor.unsqueeze(1) # T, 1, H, W
+                    tensors.append(tensor)
+                    self._count("bytes_copied", tensor.nbytes)
+                sample = torch.cat(tensors, dim=1) # T, C, H, W
+        finally:
+            if len(slots) > 0: self.shared_cache.release(slots)
+        self._count("bytes_copied", sample.nbytes)
+        return sample
+    
+    def _read_stacked(self, start, stop, out: np.ndarray=None) -> np.ndarray:
+        """
+        Read timesteps [start, stop) of the stacked array and gather the channels into `out` 
+        (or a new array) of shape (T, C, H, W).
+        """
+        with self._span("index"):
+            arr = self.stacked.isel(time=slice(start, stop), **self._spatial_isel())
+        with self._span("read"):
+            values = arr.values.transpose(self.stacked_axes) # T, V, L, H, W
+        with self._span("concat"):
+            if out is None:
+                out = values[:, self.stacked_index[0], self.stacked_index[1]] # T, C, H, W
+            else:
+                for c, (v, l) in enumerate(zip(*self.stacked_index)):
+                    out[:, c] = values[:, v, l]
+        self._count("bytes_copied", out.nbytes)
+        return out
+    
+    def _fill_variables(self, out: np.ndarray, start):
+        """
+        Read timesteps [start, start+T) of all variables into `out` (T, C, H, W).
+        Dask copies every decoded chunk straight to its place in `out`.
+        """
+        if self.stacked is not None:
+            self._read_stacked(start, start+out.shape[0], out=out)
+            return
+        sources, targets = [], []
+        with self._span("index"):
+            arrs = [self.ds[var].isel(time=slice(start, start+out.shape[0]), **self._spatial_isel()) for var in self.variables]
+        with self._span("read"):
+            for var, arr in zip(self.variables, arrs):
+                target = self._channel_view(out, var)
+                if isinstance(arr.data, dask.array.Array):
+                    sources.append(arr.data)
+                    targets.append(target)
+                else:
+                    target[...] = arr.values
+            if len(sources) > 0:
+                dask.array.store(sources, targets, lock=False)
+        self._count("bytes_copied", out.nbytes)
+    
+    def _fill_span(self, out: np.ndarray, start):
+        """
+        Read timesteps [start, start+len(out)) into `out` (T, C, H, W).
+        """
+        if self.cached:
+            frames, slots = self._read_span_frames(start, start+out.shape[0])
+            try:
+                with self._span("concat"):
+                    for var in self.variables:
+                        target = self._channel_view(out, var)
+                        for t, frame in enumerate(frames[var]):
+                            target[t] = frame
+            finally:
+                if len(slots) > 0: self.shared_cache.release(slots)
+            self._count("bytes_copied", out.nbytes)
+        else:
+            self._fill_variables(out, start)
+    
+    def _read_variable(self, var, start, stop) -> np.ndarray:
+        """
+        Read timesteps [start, stop) of a variable as a (T, (C), H, W) array.
+        """
+        return self.ds[var].isel(time=slice(start, stop), **self._spatial_isel()).values
+    
+    def _read_span(self, start, stop) -> torch.Tensor:
+        """
+        Read timesteps [start, stop) as a (T, C, H, W) tensor.
+        """
+        if self.cached:
+            return self._read_cached(start, stop)
+        if self.stacked is not None:
+            return torch.from_numpy(self._read_stacked(start, stop))
+        with self._span("index"):
+            sample = self.ds.isel(time=slice(start, stop), **self._spatial_isel())
+        return sample_to_tensor(sample, counters=self.counters, profiler=self.profiler)
+
+    def _convert(self, sample: torch.Tensor, out: torch.Tensor=None) -> torch.Tensor:
+        """
+        Normalize a (T, C, H, W) sample and cast it to the output dtype in one pass, into `out` 
+        (or a new tensor). The sample is not modified, it may be a view of a memory map.
+        """
+        if not self.convert: return sample
+        with self._span("normalize"):
+            if out is None: out = torch.empty(sample.shape, dtype=self.out_dtype)
+            if self.norm_scale is not None: torch.addcmul(self.norm_shift, sample, self.norm_scale, out=out)
+            else: out.copy_(sample)
+        self._count("bytes_copied", out.nbytes)
+        return out
+    
+    def _split(self, sample):
         x = sample[:self.num_input_timesteps]
         y = sample[self.num_input_timesteps:]
+        return x, y
+
+    def __getitem__(self, i):
+        with self._span("sample"):
+            self._draw_patch()
+            if self.preallocate and self.convert:
+                stage = self._next_stage_buffer()
+                self._fill_span(stage.numpy(), i)
+                sample = self._convert(stage, out=self._next_buffer())
+            elif self.preallocate:
+                sample = self._next_buffer()
+                self._fill_span(sample.numpy(), i)
+            else:
+                sample = self._convert(self._read_span(i, i+self.sample_timesteps))
+        self._count("samples")
+        
+        return self._split(sample)
+    
+    def __getitems__(self, indices: list[int]) -> list:
+        """
+        Fetch a batch of samples (called by the dataloader instead of __getitem__).
+        
+        With `coalesce_batches`, indices are grouped into runs of overlapping or adjacent 
+        windows, the time span of each run is read once and its samples are views of it.
+        The dataloader collates (copies) the batch before fetching the next one.
+        """
+        if not self.coalesce_batches:
+            return [self[i] for i in indices]
+        
+        # runs of [start, stop, positions in the batch]
+        runs = []
+        for k in sorted(range(len(indices)), key=lambda k: indices[k]):
+            i = indices[k]
+            if len(runs) > 0 and i <= runs[-1][1]:
+                runs[-1][1] = max(runs[-1][1], i+self.sample_timesteps)
+                runs[-1][2].append(k)
+            else:
+                runs.append([i, i+self.sample_timesteps, [k]])
         
-        return x, y
\ No newline at end of file
+        samples = [None] * len(indices)
+        with self._span("sample"):
+            num_timesteps = sum(stop-start for start, stop, _ in runs)
+            span_buffer = self._next_span_buffer(num_timesteps) if self.preallocate else None
+            converted_buffer = self._next_span_buffer(num_timesteps, converted=True) if self.preallocate and self.convert else None
+            offset = 0
+            for start, stop, positions in runs:
+                if self.preallocate:
+                    span = span_buffer[offset:offset+stop-start]
+                    self._fill_span(span.numpy(), start)
+                    if self.convert: span = self._convert(span, out=converted_buffer[offset:offset+stop-start])
+                    offset += stop-start
+                else:
+                    span = self._convert(self._read_span(start, stop))
+                for k in positions:
+                    samples[k] = self._split(span[indices[k]-start:indices[k]-start+self.sample_timesteps])
+        self._count("samples", len(indices))
+        logger.debug(f"__getitems__: {len(indices)} samples from {len(runs)} reads")
+        
+        return samples
+
+class ZarrDataset(BaseDataset):
+    """
+    Same samples as `BaseDataset`, but read with zarr directly instead of xarray/dask.
+    
+    Variables, levels and the time offset are resolved against the zarr arrays once at 
+    startup, the sample path then only does `get_orthogonal_selection` on the arrays.
+    No CF decoding is applied, so variables must not be packed (scale_factor/add_offset).
+    `ds` (the lazily opened, date/variable/level selected dataset) is only used for metadata.
+    With a `chunk_cache` (ChunkCache), objects are read through a local copy of the store.
+    With a `sample_index` (SampleIndex of the same selection), the offsets are taken from the 
+    index and the metadata is read from its snapshot, so the store is not opened at startup.
+    """
+    def __init__(self, ds: xr.Dataset, path: str, chunk_cache=None, sample_index=None, **kwargs):
+        super().__init__(ds, **kwargs)
+        self.path = path
+        self.chunk_cache = chunk_cache
+        self.sample_index = sample_index
+        
+        # arrays are opened lazily in each process (dataloader workers must not inherit them)
+        self._arrays = None
+        self._pid = None
+        
+        if sample_index is not None:
+            self._resolve_index(sample_index)
+            return
+        
+        group = zarr.open_group(path, mode="r")
+        assert all(var in group for var in self.variables), f"all variables must be arrays of {path} (dataarray layouts are not supported)"
+        
+        # time offset of the selected dates in the store
+        time = xr.decode_cf(xr.Dataset(coords={"time": ("time", group["time"][:], dict(group["time"].attrs))}))["time"]
+        time_index = pd.Index(time.values).get_indexer(self.ds["time"].values)
+        assert np.all(time_index >= 0), "all timesteps must be in the store"
+        assert np.all(np.diff(time_index) == 1), "selected timesteps must be contiguous in the store"
+        self.time_offset = int(time_index[0])
+        
+        # level indices, a plain slice if all levels are read in order
+        level_index = pd.Index(group["level"][:]).get_indexer(self.levels)
+        assert np.all(level_index >= 0), "all levels must be in the store"
+        if np.array_equal(level_index, np.arange(group["level"].shape[0])):
+            self.level_index = slice(None)
+        else:
+            self.level_index = level_index
+        
+        self.dims = {}
+        for var in self.variables:
+            attrs = group[var].attrs
+            assert not "scale_factor" in attrs and not "add_offset" in attrs, f"{var} is packed, use BaseDataset instead"
+            self.dims[var] = zarr_dims(group[var])
+    
+    def _resolve_index(self, index):
+        assert index.layout == "dataset", "dataarray layouts are not supported"
+        assert index.variables == self.variables and index.levels == [int(level) for level in self.levels], "the sample index was built for other variables or levels"
+        assert index.num_timesteps == self.total_timesteps, "the sample index was built for other dates"
+        self.time_offset = index.time_offset
+        
+        if index.level_index == list(range(index.num_levels)):
+            self.level_index = slice(None)
+        else:
+            self.level_index = np.array(index.level_index)
+        
+        self.dims = {}
+        for var in self.variables:
+            assert not index.arrays[var]["packed"], f"{var} is packed, use BaseDataset instead"
+            self.dims[var] = tuple(index.arrays[var]["dims"])
+        
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_arrays"], state["_pid"] = None, None
+        return state
+        
+    def _open_store(self):
+        """
+        Store of `path`, recording chunk reads when profiling (only reads of the source with a chunk cache),
+        with the metadata of the sample index if any.
+        """
+        if self.profiler is None and self.chunk_cache is None and self.sample_index is None: return self.path
+        store = open_store(self.path)
+        if self.profiler is not None: store = ProfiledStore(store, self.profiler)
+        if self.chunk_cache is not None: store = CachingStore(store, self.chunk_cache)
+        if self.sample_index is not None: store = SnapshotStore(store, self.sample_index.metadata)
+        return store
+    
+    @property
+    def arrays(self) -> dict:
+        if self._arrays is None or self._pid != os.getpid():
+            group = zarr.open_group(store=self._open_store(), mode="r")
+            self._arrays = {var: group[var] for var in self.variables}
+            self._pid = os.getpid()
+        return self._arrays
+    
+    def _selection(self, var, start, stop) -> tuple:
+        selection = []
+        for dim in self.dims[var]:
+            if dim == "time": selection.append(slice(self.time_offset+start, self.time_offset+stop))
+            elif dim == "level": selection.append(self.level_index)
+            elif dim == "latitude": selection.append(self.spatial[0])
+            elif dim == "longitude": selection.append(self.spatial[1])
+            else: selection.append(slice(None))
+        return tuple(selection)
+    
+    def _read_variable(self, var, start, stop) -> np.ndarray:
+        return self.arrays[var].get_orthogonal_selection(self._selection(var, start, stop))
+    
+    def _fill_variables(self, out: np.ndarray, start):
+        """
+        Decode timesteps [start, start+T) of all variables into `out` (T, C, H, W).
+        Zarr v2 decompresses whole chunks straight into contiguous parts of `out`,
+        zarr v3 decodes each chunk and then copies it to `out`.
+        """
+        with self._span("read"):
+            for var in self.variables:
+                target = self._channel_view(out, var)
+                if zarr_format == 3: target = default_buffer_prototype().nd_buffer.from_ndarray_like(target)
+                self.arrays[var].get_orthogonal_selection(self._selection(var, start, start+out.shape[0]), out=target)
+        if zarr_format == 3: self._count("bytes_copied", out.nbytes)
+    
+    def _read_span(self, start, stop) -> torch.Tensor:
+        if self.cached:
+            return self._read_cached(start, stop)
+        with self._span("read"):
+            values = [self._read_variable(var, start, stop) for var in self.variables]
+        with self._span("concat"):
+            tensors = []
+            for var, value in zip(self.variables, values):
+                tensor = torch.from_numpy(value) # T, (C), H, W
+                if var in self.surface_variables: tensor = tensor.unsqueeze(1) # T, 1, H, W
+                tensors.append(tensor)
+            sample = torch.cat(tensors, dim=1) # T, C, H, W
+        self._count("bytes_copied", sample.nbytes)
+        return sample
+
+class AsyncZarrDataset(ZarrDataset):
+    """
+    `ZarrDataset` that fetches all frames of a sample concurrently with an `AsyncFrameReader`.
+    
+    Every (timestep, variable) frame is a separate request. With `prefetch_samples` > 0 the 
+    frames of the next samples (i+1, ..., i+prefetch_samples) are requested as well, so that 
+    sequential access finds them already in flight or fetched.
+    """
+    def __init__(self, ds: xr.Dataset, path: str, max_concurrency: int=16, prefetch_samples: int=0, **kwargs):
+        super().__init__(ds, path, **kwargs)
+        assert isinstance(prefetch_samples, int) and prefetch_samples >= 0, "prefetch_samples must be a non-negative integer"
+        assert self.patch_size is None or prefetch_samples == 0, "the patches of the next samples are not known, prefetch_samples requires full-field samples"
+        assert self.shared_cache is None, "frames are fetched concurrently, use cache_bytes instead of shared_cache_bytes"
+        self.max_concurrency = max_concurrency
+        self.prefetch_samples = prefetch_samples
+        
+        # async reads only support basic selections: read a slice covering the levels, pick them afterwards
+        if isinstance(self.level_index, slice):
+            self.level_range, self.level_take = self.level_index, None
+        else:
+            self.level_range = slice(int(self.level_index.min()), int(self.level_index.max())+1)
+            self.level_take = self.level_index - self.level_range.start
+        
+        self._reader = None
+        self._reader_pid = None
+        self._pending = {}
+        
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_reader"], state["_reader_pid"], state["_pending"] = None, None, {}
+        return state
+    
+    @property
+    def reader(self) -> AsyncFrameReader:
+        if self._reader is None or self._reader_pid != os.getpid():
+            self._reader = AsyncFrameReader(self._open_store(), self.variables, max_concurrency=self.max_concurrency, counters=self.counters)
+            self._reader_pid = os.getpid()
+            self._pending = {}
+        return self._reader
+    
+    def _frame_selection(self, var, t) -> tuple:
+        selection = []
+        for dim in self.dims[var]:
+            if dim == "time": selection.append(self.time_offset+t)
+            elif dim == "level": selection.append(self.level_range)
+            elif dim == "latitude": selection.append(self.spatial[0])
+            elif dim == "longitude": selection.append(self.spatial[1])
+            else: selection.append(slice(None))
+        return tuple(selection)
+    
+    def _submit(self, t, var):
+        key = (t, var)
+        if key in self._pending: return
+        if self.cache is not None and key in self.cache: return
+        self._pending[key] = self.reader.submit(var, self._frame_selection(var, t))
+        
+    def _fetch_frames(self, start, stop) -> dict:
+        """
+        Request the frames of timesteps [start, stop) (and of the prefetched samples), return the frames of [start, stop).
+        """
+        self.reader # (re)start the reader in this process before submitting requests
+        if self.patch_size is not None:
+            # frames in flight were requested for the patch of the previous sample
+            for key in list(self._pending): self._pending.pop(key).cancel()
+        prefetch_stop = min(stop + self.prefetch_samples, self.total_timesteps)
+        for t in range(start, prefetch_stop):
+            for var in self.variables:
+                self._submit(t, var)
+        
+        frames = {}
+        for t in range(start, stop):
+            for var in self.variables:
+                key = (t, var)
+                frame = self.cache.get(key) if self.cache is not None else None
+                if frame is None:
+                    self._submit(t, var) # in case the frame was evicted from the cache since it was requested
+                    frame = self._pending[key].result()
+                    if self.level_take is not None and not var in self.surface_variables: 
+                        frame = frame[self.level_take]
+                    if self.cache is not None: self.cache.put(key, frame)
+                frames[key] = frame
+        
+        # forget requests outside of the current and prefetched samples
+        for key in list(self._pending):
+            if key[0] < start or key[0] >= prefetch_stop:
+                self._pending.pop(key).cancel()
+        return frames
+    
+    def _read_span(self, start, stop) -> torch.Tensor:
+        with self._span("read"):
+            frames = self._fetch_frames(start, stop)
+        with self._span("concat"):
+            tensors = []
+            for var in self.variables:
+                tensor = torch.from_numpy(np.stack([frames[(t, var)] for t in range(start, stop)])) # T, (C), H, W
+                if var in self.surface_variables: tensor = tensor.unsqueeze(1) # T, 1, H, W
+                tensors.append(tensor)
+                self._count("bytes_copied", tensor.nbytes)
+            sample = torch.cat(tensors, dim=1) # T, C, H, W
+        self._count("bytes_copied", sample.nbytes)
+        return sample
+    
+    def _fill_span(self, out: np.ndarray, start):
+        with self._span("read"):
+            frames = self._fetch_frames(start, start+out.shape[0])
+        with self._span("concat"):
+            for var in self.variables:
+                target = self._channel_view(out, var)
+                for t in range(out.shape[0]):
+                    target[t] = frames[(start+t, var)]
+        self._count("bytes_copied", out.nbytes)
+
+class MemmapDataset(BaseDataset):
+    """
+    Same samples as `BaseDataset`, read from a flat (time, channel, lat, lon) file written by 
+    `write_memmap` (src/export.py) instead of zarr.
+    
+    The selected channels and dates are resolved against the json sidecar once at startup. 
+    When the selected channels are contiguous in the file, samples are `torch.from_numpy` 
+    views of the memory map (copy-on-write, so the tensors are writable without touching the 
+    file): nothing is decoded or copied until the dataloader collates the batch. Otherwise the 
+    channels are gathered with one fancy-indexing copy per sample.
+    `ds` (the lazily opened, date/variable/level selected dataset) is only used for metadata.
+    """
+    DATA_FILE = "data.bin"
+    METADATA_FILE = "metadata.json"
+    
+    def __init__(self, ds: xr.Dataset, path: str, **kwargs):
+        super().__init__(ds, **kwargs)
+        self.path = path
+        
+        with open(os.path.join(path, self.METADATA_FILE), "r") as f:
+            self.metadata = json.load(f)
+        assert tuple(self.metadata["shape"][2:]) == (self.ds.sizes["latitude"], self.ds.sizes["longitude"]), f"spatial shape of {path} does not match the dataset"
+        assert np.dtype(self.metadata["dtype"]) == self.dtype, f"dtype of {path} does not match the dataset"
+        
+        # time offset of the selected dates in the file
+        time_index = pd.Index(pd.to_datetime(self.metadata["times"])).get_indexer(self.ds["time"].values)
+        assert np.all(time_index >= 0), f"all timesteps must be in {path}"
+        assert np.all(np.diff(time_index) == 1), f"selected timesteps must be contiguous in {path}"
+        self.time_offset = int(time_index[0])
+        
+        # channel indices, a plain slice (zero-copy views) if they are contiguous in the file
+        channels = [(var, level) for var, level in self.metadata["channels"]]
+        missing = [channel for channel in self.layout if not channel in channels]
+        assert len(missing) == 0, f"channels {missing} are not in {path}"
+        channel_index = np.array([channels.index((var, None if level is None else int(level))) for var, level in self.layout])
+        if np.array_equal(channel_index, np.arange(channel_index[0], channel_index[0] + len(channel_index))):
+            self.channel_index = slice(int(channel_index[0]), int(channel_index[0]) + len(channel_index))
+        else:
+            self.channel_index = channel_index
+        
+        # the file is mapped lazily in each process
+        self._data = None
+        self._pid = None
+    
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_data"], state["_pid"] = None, None
+        return state
+    
+    @property
+    def data(self) -> np.memmap:
+        if self._data is None or self._pid != os.getpid():
+            self._data = np.memmap(os.path.join(self.path, self.DATA_FILE), dtype=self.metadata["dtype"], mode="c", shape=tuple(self.metadata["shape"]))
+            self._pid = os.getpid()
+        return self._data
+    
+    def _window(self, start, stop) -> np.ndarray:
+        window = self.data[self.time_offset+start:self.time_offset+stop, self.channel_index, self.spatial[0], self.spatial[1]]
+        if not isinstance(self.channel_index, slice): self._count("bytes_copied", window.nbytes)
+        return window
+    
+    def _read_variable(self, var, start, stop) -> np.ndarray:
+        channels = self.channel_slices[var]
+        if isinstance(self.channel_index, slice): channels = slice(self.channel_index.start + channels.start, self.channel_index.start + channels.stop)
+        else: channels = self.channel_index[channels]
+        values = self.data[self.time_offset+start:self.time_offset+stop, channels, self.spatial[0], self.spatial[1]]
+        if var in self.surface_variables: values = values[:, 0]
+        return values
+    
+    def _read_span(self, start, stop) -> torch.Tensor:
+        if self.cached:
+            return self._read_cached(start, stop)
+        with self._span("read"):
+            return torch.from_numpy(self._window(start, stop))
+    
+    def _fill_span(self, out: np.ndarray, start):
+        with self._span("read"):
+            out[...] = self.data[self.time_offset+start:self.time_offset+start+out.shape[0], self.channel_index, self.spatial[0], self.spatial[1]]
+        self._count("bytes_copied", out.nbytes)
@@ -8,7 +8,7 @@ import dask
 import zarr
 
 from dataset import BaseDataset
-from write import write_zarr
+from write import write_zarr, write_zarr_regions, rechunk_zarr, parse_codec
 from args import Arguments
 from utils import load_dataset
 
@@ -34,8 +34,17 @@ def get_args():
     parser.add_argument(Arguments.OUTPUT.flag, **Arguments.OUTPUT.kwargs)
     parser.add_argument(Arguments.CHUNKS_OPEN_STRATEGY.flag, **Arguments.CHUNKS_OPEN_STRATEGY.kwargs)
     parser.add_argument(Arguments.CHUNKS_WRITE_STRATEGY.flag, **Arguments.CHUNKS_WRITE_STRATEGY.kwargs)
+    parser.add_argument(Arguments.SHARD_SHAPE.flag, **Arguments.SHARD_SHAPE.kwargs)
     parser.add_argument(Arguments.COMPRESS_VARS.flag, **Arguments.COMPRESS_VARS.kwargs)
     parser.add_argument(Arguments.COMPRESS_COORDS.flag, **Arguments.COMPRESS_COORDS.kwargs)
+    parser.add_argument(Arguments.CODEC.flag, **Arguments.CODEC.kwargs)
+    parser.add_argument(Arguments.VAR_CODECS.flag, **Arguments.VAR_CODECS.kwargs)
+    parser.add_argument(Arguments.REGION_TIMESTEPS.flag, **Arguments.REGION_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.WRITE_WORKERS.flag, **Arguments.WRITE_WORKERS.kwargs)
+    parser.add_argument(Arguments.WRITE_EXECUTOR.flag, **Arguments.WRITE_EXECUTOR.kwargs)
+    parser.add_argument(Arguments.RESTART.flag, **Arguments.RESTART.kwargs)
+    parser.add_argument(Arguments.MAX_MEM.flag, **Arguments.MAX_MEM.kwargs)
+    parser.add_argument(Arguments.TEMP_STORE.flag, **Arguments.TEMP_STORE.kwargs)
     parser.add_argument(Arguments.VARIABLES.flag, **Arguments.VARIABLES.kwargs)
     parser.add_argument(Arguments.LEVELS.flag, **Arguments.LEVELS.kwargs)
     parser.add_argument(Arguments.DATE_START_DOWNLOAD.flag, **Arguments.DATE_START_DOWNLOAD.kwargs)
@@ -50,11 +59,22 @@ def get_args():
     try: args.chunks_open_strategy = eval(args.chunks_open_strategy)
     except Exception as e: pass
     
+    # the rechunk plan starts from the stored chunks of the source
+    if args.max_mem > 0:
+        if args.chunks_open_strategy != {}:
+            logger.info(f"--max_mem opens the source with its stored chunks, ignoring --chunks_open_strategy {args.chunks_open_strategy}")
+        args.chunks_open_strategy = {}
+        if args.region_timesteps > 0:
+            logger.warning("--max_mem writes regions of one rechunk block, ignoring --region_timesteps")
+    
     try: args.chunks_write_strategy = eval(args.chunks_write_strategy)
     except Exception as e: pass
     logger.info(f"Parsed chunks write strategy: {args.chunks_write_strategy}")
     
     args.date_range = [args.date_start, args.date_end]
+    args.var_codecs = dict(args.var_codecs)
+    for codec in [args.codec, *args.var_codecs.values()]:
+        if codec is not None: parse_codec(codec)
     if args.date_range[0] is None or args.date_range[1] is None:
         logger.warning("Date range not specified, this will download the entire dataset")
     
@@ -67,6 +87,9 @@ def get_args():
         args.zarr_format = 3
     else:
         raise ValueError(f"Unknown Zarr version: {args.varr_version}")
+    
+    if args.shard_shape is not None and args.zarr_format != 3:
+        raise ValueError("--shard_shape requires zarr v3")
         
     if args.output.endswith("/"):
         args.output = args.output[:-1]
@@ -92,14 +115,51 @@ def main():
     logger.info(f"Loaded dataset with shape: {ds.dims}")
     
     # write to zarr
-    write_zarr(
-        ds, 
-        path=args.output,
-        exist_ok=True,
-        new_chunks=args.chunks_write_strategy,
-        compress_vars=args.compress_vars,
-        compress_coords=args.compress_coords,
-    )
+    if args.max_mem > 0:
+        summary = rechunk_zarr(
+            ds, 
+            path=args.output,
+            new_chunks=args.chunks_write_strategy,
+            max_mem=int(args.max_mem * 1024**2),
+            temp_path=args.temp_store,
+            compress_vars=args.compress_vars,
+            compress_coords=args.compress_coords,
+            shards=args.shard_shape,
+            codec=args.codec,
+            var_codecs=args.var_codecs,
+            num_workers=args.write_workers,
+            executor=args.write_executor,
+            restart=args.restart,
+        )
+        logger.info(f"Rechunked in {len(summary['stages'])} stage(s) in {summary['time']:.1f}s ({summary['mb_per_s']:.2f}MB/s), peak RSS: {summary['peak_rss_mb']:.1f}MB (workers: {summary['peak_rss_children_mb']:.1f}MB)")
+    elif args.region_timesteps > 0:
+        summary = write_zarr_regions(
+            ds, 
+            path=args.output,
+            region_timesteps=args.region_timesteps,
+            new_chunks=args.chunks_write_strategy,
+            compress_vars=args.compress_vars,
+            compress_coords=args.compress_coords,
+            shards=args.shard_shape,
+            codec=args.codec,
+            var_codecs=args.var_codecs,
+            num_workers=args.write_workers,
+            executor=args.write_executor,
+            restart=args.restart,
+        )
+        logger.info(f"Wrote {summary['written_regions']}/{summary['num_regions']} regions in {summary['time']:.1f}s ({summary['mb_per_s']:.2f}MB/s, {summary['regions_per_s']:.3f} regions/s)")
+    else:
+        write_zarr(
+            ds, 
+            path=args.output,
+            exist_ok=True,
+            new_chunks=args.chunks_write_strategy,
+            compress_vars=args.compress_vars,
+            compress_coords=args.compress_coords,
+            shards=args.shard_shape,
+            codec=args.codec,
+            var_codecs=args.var_codecs,
+        )
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,88 @@
+import argparse
+import logging
+import dask
+import zarr
+
+from write import write_memmap
+from args import Arguments
+from utils import load_dataset
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# Suppress logs from Google libraries
+logging.getLogger('google').setLevel(logging.ERROR)
+logging.getLogger('google.auth').setLevel(logging.ERROR)
+logging.getLogger('google.cloud').setLevel(logging.ERROR)
+
+def get_args():
+    logger.info("Parsing arguments")
+    parser = argparse.ArgumentParser(description="Export a zarr dataset to a flat memory-mappable (time, channel, lat, lon) file")
+    
+    parser.add_argument(Arguments.DATASET.flag, **Arguments.DATASET.kwargs)
+    parser.add_argument(Arguments.OUTPUT.flag, **Arguments.OUTPUT.kwargs)
+    parser.add_argument(Arguments.CHUNKS_OPEN_STRATEGY.flag, **Arguments.CHUNKS_OPEN_STRATEGY.kwargs)
+    parser.add_argument(Arguments.VARIABLES.flag, **Arguments.VARIABLES.kwargs)
+    parser.add_argument(Arguments.LEVELS.flag, **Arguments.LEVELS.kwargs)
+    parser.add_argument(Arguments.DATE_START_DOWNLOAD.flag, **Arguments.DATE_START_DOWNLOAD.kwargs)
+    parser.add_argument(Arguments.DATE_END_DOWNLOAD.flag, **Arguments.DATE_END_DOWNLOAD.kwargs)
+    parser.add_argument(Arguments.EXPORT_TIMESTEPS.flag, **Arguments.EXPORT_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.DASK_SCHEDULER.flag, **Arguments.DASK_SCHEDULER.kwargs)
+    parser.add_argument(Arguments.DASK_WORKERS.flag, **Arguments.DASK_WORKERS.kwargs)
+    parser.add_argument(Arguments.DASK_THREADS_PER_WORKER.flag, **Arguments.DASK_THREADS_PER_WORKER.kwargs)
+    
+    # parse arguments
+    args = parser.parse_args()
+    
+    try: args.chunks_open_strategy = eval(args.chunks_open_strategy)
+    except Exception as e: pass
+    
+    args.date_range = [args.date_start, args.date_end]
+    if args.date_range[0] is None or args.date_range[1] is None:
+        logger.warning("Date range not specified, this will export the entire dataset")
+    
+    args.zarr_version = zarr.__version__
+    if args.zarr_version.startswith("2."):
+        logger.info("Zarr version 2.x detected")
+        args.zarr_format = 2
+    elif args.zarr_version.startswith("3."):
+        logger.info("Zarr version 3.x detected")
+        args.zarr_format = 3
+    else:
+        raise ValueError(f"Unknown Zarr version: {args.varr_version}")
+    
+    if args.output.endswith("/"):
+        args.output = args.output[:-1]
+    
+    return args
+
+def main():
+    args = get_args()
+    
+    # dask setup
+    if args.dask_scheduler is not None:
+        dask.config.set(
+            scheduler=args.dask_scheduler, 
+            num_workers=args.dask_workers, 
+            threads_per_worker=args.dask_threads_per_worker
+        )
+        logger.info(f"Configured dask (scheduler: {args.dask_scheduler}, workers: {args.dask_workers}, threads per worker: {args.dask_threads_per_worker})")
+    
+    # load dataset
+    logger.info(f"Loading dataset from {args.dataset} for dates {args.date_range[0]} to {args.date_range[1]}")
+    ds = load_dataset(args, force_zarr_format=False, as_dataarray=True)
+    logger.info(f"Loaded dataset with shape: {ds.dims}")
+    
+    # write the flat file and its sidecar
+    summary = write_memmap(ds, args.output, args.variables, args.levels, block_timesteps=args.export_timesteps)
+    logger.info(f"Exported {summary['shape']} ({summary['nbytes']/1024**2:.1f}MB) to {args.output} in {summary['time']:.1f}s ({summary['mb_per_s']:.2f}MB/s)")
+    
+if __name__ == "__main__":
+    main()
+    logger.info("Finished exporting dataset")
@@ -0,0 +1,101 @@
+import xarray as xr
+import numpy as np
+import logging
+import dask
+import json
+import time
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from dataset import BaseDataset
+
+logger = logging.getLogger(__name__)
+
+class NormalizationStats(object):
+    """
+    Per-channel mean and standard deviation of a dataset, persisted to a json file.
+
+    Channels are (variable, level) pairs, level is None for surface variables, as in the
+    channel layout of `BaseDataset`. Statistics are computed over time, latitude and longitude
+    of the selected dates in a single parallel dask pass over the store (accumulated in float64).
+    The file is not invalidated when the store is rewritten, delete it to recompute the statistics.
+    """
+    VERSION = 1
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    @classmethod
+    def compute(cls, ds: xr.Dataset|xr.DataArray, path: str, variables: list[str], levels: list[int], date_range: list[str]) -> "NormalizationStats":
+        """
+        Compute the statistics of the selected variables and levels of `ds` (a dataset, or the stacked array of a dataarray layout).
+        """
+        if isinstance(ds, xr.DataArray): ds = BaseDataset._unstack(ds)
+        channels, means, stds = [], [], []
+        for var in variables:
+            arr = ds[var].astype("float64")
+            if "level" in arr.dims: arr = arr.sel(level=levels)
+            dims = [dim for dim in arr.dims if dim != "level"]
+            means.append(arr.mean(dim=dims))
+            stds.append(arr.std(dim=dims))
+            channels += [(var, int(level)) for level in levels] if "level" in arr.dims else [(var, None)]
+        # one graph, so each chunk is read once for all statistics. The pool is shut down afterwards:
+        # dask's default pool would be inherited without its threads by the dataloader workers, and deadlock them
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            means, stds = dask.compute(means, stds, pool=pool)
+        mean = np.concatenate([np.atleast_1d(m.values) for m in means])
+        std = np.concatenate([np.atleast_1d(s.values) for s in stds])
+        return cls(
+            version=cls.VERSION,
+            path=path,
+            variables=list(variables),
+            levels=[int(level) for level in levels],
+            date_range=[str(date) for date in date_range],
+            channels=channels,
+            mean=mean.tolist(),
+            std=std.tolist(),
+        )
+
+    def matches(self, path: str, variables: list[str], levels: list[int], date_range: list[str]) -> bool:
+        """
+        Whether the statistics were computed for this selection, with this version.
+        """
+        return self.version == self.VERSION and self.path == path and self.variables == list(variables) \
+            and self.levels == [int(level) for level in levels] and self.date_range == [str(date) for date in date_range]
+
+    def channel_stats(self) -> dict:
+        """
+        (mean, std) of each (variable, level) channel, for `BaseDataset(normalization=...)`. Constant channels have a std of 1.
+        """
+        return {channel: (mean, std if std > 0 else 1.) for channel, mean, std in zip(self.channels, self.mean, self.std)}
+
+    def save(self, path: str):
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(self.__dict__, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "NormalizationStats":
+        with open(path, "r") as f:
+            state = json.load(f)
+        state["channels"] = [(var, level) for var, level in state["channels"]]
+        return cls(**state)
+
+    @classmethod
+    def load_or_compute(cls, stats_path: str, ds: xr.Dataset|xr.DataArray, path: str, variables: list[str], levels: list[int], date_range: list[str]) -> "NormalizationStats":
+        """
+        Load the statistics at `stats_path`, or compute and save them if they are missing or were computed for another selection.
+        """
+        t0 = time.time()
+        if os.path.exists(stats_path):
+            stats = cls.load(stats_path)
+            if stats.matches(path, variables, levels, date_range):
+                logger.info(f"Loaded normalization statistics {stats_path}")
+                return stats
+            logger.info(f"Normalization statistics {stats_path} were computed for another selection, recomputing them")
+        stats = cls.compute(ds, path, variables, levels, date_range)
+        stats.save(stats_path)
+        logger.info(f"Computed normalization statistics of {len(stats.channels)} channels in {time.time()-t0:.2f}s, saved to {stats_path}")
+        return stats
@@ -0,0 +1,70 @@
+import torch
+import threading
+import logging
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import default_collate
+
+logger = logging.getLogger(__name__)
+
+class PrefetchLoader(object):
+    """
+    Single-process alternative to a multi-worker `DataLoader`.
+    
+    Batches are fetched (`__getitems__`) and collated by a pool of `io_threads` threads, 
+    up to `prefetch_depth` batches ahead of the consumer. Each thread works on its own 
+    copy of the dataset (`BaseDataset.clone`), so buffers, caches and readers are not 
+    shared between threads. Reading and decoding release the GIL, so the threads overlap 
+    I/O and decompression with each other and with the consumer.
+    """
+    def __init__(
+        self, 
+        dataset, 
+        batch_sampler, 
+        prefetch_depth: int=2, 
+        io_threads: int=1, 
+        collate_fn=default_collate, 
+        pin_memory: bool=False,
+    ):
+        assert isinstance(prefetch_depth, int) and prefetch_depth > 0, "prefetch_depth must be a positive integer"
+        assert isinstance(io_threads, int) and io_threads > 0, "io_threads must be a positive integer"
+        self.dataset = dataset
+        self.batch_sampler = batch_sampler
+        self.prefetch_depth = prefetch_depth
+        self.io_threads = io_threads
+        self.collate_fn = collate_fn
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self._local = threading.local()
+        
+    def __len__(self):
+        return len(self.batch_sampler)
+    
+    def _load(self, indices):
+        dataset = getattr(self._local, "dataset", None)
+        if dataset is None:
+            dataset = self._local.dataset = self.dataset.clone()
+        batch = self.collate_fn(dataset.__getitems__(indices))
+        if self.pin_memory:
+            batch = [tensor.pin_memory() for tensor in batch]
+        return batch
+        
+    def __iter__(self):
+        # a fresh pool (and fresh dataset copies) per epoch
+        self._local = threading.local()
+        executor = ThreadPoolExecutor(max_workers=self.io_threads, thread_name_prefix="prefetch")
+        batches = iter(self.batch_sampler)
+        queue = deque()
+        try:
+            for indices in batches:
+                queue.append(executor.submit(self._load, indices))
+                if len(queue) == self.prefetch_depth:
+                    break
+            while len(queue) > 0:
+                batch = queue.popleft().result()
+                indices = next(batches, None)
+                if indices is not None:
+                    queue.append(executor.submit(self._load, indices))
+                yield batch
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
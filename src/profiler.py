@@ -0,0 +1,162 @@
+import numpy as np
+import threading
+import logging
+import json
+import time
+import glob
+import os
+
+from contextlib import contextmanager, nullcontext
+from torch.utils.data import get_worker_info, default_collate
+
+from utils import WorkerCounters
+
+logger = logging.getLogger(__name__)
+
+class StageProfiler(object):
+    """
+    Timings of the stages of the sample path, aggregated over the main process and the dataloader workers.
+
+    Every span (`perf_counter_ns`) adds to a per-stage count, total and log-spaced latency
+    histogram kept in `WorkerCounters`, so percentiles are known up to the bucket width
+    (10 buckets per decade, from 1us to 100s). With `trace_dir`, each process also appends
+    its spans to `trace_dir/trace-<pid>.jsonl`, merged by `write_trace` into a Chrome trace
+    (chrome://tracing, Perfetto). `perf_counter_ns` is CLOCK_MONOTONIC on Linux, so spans
+    of different processes share the same time axis.
+
+    Stages:
+        sample: a whole __getitem__ (or coalesced __getitems__) call
+        index: building the lazy xarray/dask selection
+        read: fetching and decoding (dask compute, zarr selection, waiting for async reads)
+        fs_read: store reads of chunk objects (zarr datasets only), part of read
+        concat: torch.cat / np.stack / copies into the sample buffer
+        normalize: normalizing and casting a sample to the output dtype
+        collate: collating a batch (in the worker)
+        wait: time the consumer waits for the next batch (in the main process)
+    """
+    STAGES = ["sample", "index", "read", "fs_read", "concat", "normalize", "collate", "wait"]
+    BUCKETS_NS = [int(10**(3 + k/10)) for k in range(81)] # 1us to 100s
+    EXTRA_COUNTERS = ["bytes_read", "chunks_read"]
+
+    def __init__(self, num_workers: int=0, trace_dir: str=None):
+        names = []
+        for stage in self.STAGES:
+            names += [f"{stage}_count", f"{stage}_ns"] + [f"{stage}_le_{k}" for k in range(len(self.BUCKETS_NS)+1)]
+        self.counters = WorkerCounters(names + self.EXTRA_COUNTERS, num_workers=num_workers)
+        self.trace_dir = trace_dir
+        if trace_dir is not None:
+            os.makedirs(trace_dir, exist_ok=True)
+        self._trace = None
+        self._trace_pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_trace"], state["_trace_pid"] = None, None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _trace_file(self):
+        # line buffered: dataloader workers exit without flushing their files
+        if self._trace is None or self._trace_pid != os.getpid():
+            pid = os.getpid()
+            info = get_worker_info()
+            name = "main" if info is None else f"worker {info.id}"
+            self._trace = open(os.path.join(self.trace_dir, f"trace-{pid}.jsonl"), "a", buffering=1)
+            self._trace_pid = pid
+            self._trace.write(json.dumps({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}) + "\n")
+        return self._trace
+
+    def record(self, stage: str, t0: int, t1: int):
+        """
+        Record a span of `stage` from `t0` to `t1` (perf_counter_ns).
+        """
+        duration = t1 - t0
+        bucket = int(np.searchsorted(self.BUCKETS_NS, duration))
+        self.counters.add(f"{stage}_count")
+        self.counters.add(f"{stage}_ns", duration)
+        self.counters.add(f"{stage}_le_{bucket}")
+        if self.trace_dir is not None:
+            event = {"name": stage, "ph": "X", "ts": t0 / 1e3, "dur": duration / 1e3, "pid": os.getpid(), "tid": threading.get_ident()}
+            with self._lock:
+                self._trace_file().write(json.dumps(event) + "\n")
+
+    @contextmanager
+    def span(self, stage: str):
+        t0 = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(stage, t0, time.perf_counter_ns())
+
+    def add(self, name: str, value: int=1):
+        self.counters.add(name, value)
+
+    def reset(self):
+        self.counters.reset()
+
+    def summary(self, num_samples: int=0) -> dict:
+        """
+        Per-stage count, total and mean time and p50/p90/p99 (upper bounds of the histogram buckets),
+        and bytes and chunks read per sample.
+        """
+        totals = self.counters.totals()
+        bounds = [b / 1e6 for b in self.BUCKETS_NS] + [float("inf")]
+        summary = {"stages": {}}
+        for stage in self.STAGES:
+            count = totals[f"{stage}_count"]
+            if count == 0: continue
+            cumulative = np.cumsum([totals[f"{stage}_le_{k}"] for k in range(len(bounds))])
+            stage_summary = {
+                "count": count,
+                "total_s": totals[f"{stage}_ns"] / 1e9,
+                "mean_ms": totals[f"{stage}_ns"] / count / 1e6,
+            }
+            for q in [50, 90, 99]:
+                stage_summary[f"p{q}_ms"] = float(bounds[int(np.searchsorted(cumulative, count * q / 100))])
+            summary["stages"][stage] = stage_summary
+        for name in self.EXTRA_COUNTERS:
+            summary[name] = totals[name]
+            if num_samples > 0:
+                summary[f"{name}_per_sample"] = totals[name] / num_samples
+        return summary
+
+    def write_trace(self, path: str) -> int:
+        """
+        Merge the span files of all processes into a Chrome trace at `path`, returns the number of events.
+        """
+        assert self.trace_dir is not None, "tracing is disabled"
+        if self._trace is not None:
+            self._trace.flush()
+        events = []
+        for file in sorted(glob.glob(os.path.join(self.trace_dir, "trace-*.jsonl"))):
+            with open(file, "r") as f:
+                # the last line of a killed worker may be truncated
+                for line in f:
+                    try: events.append(json.loads(line))
+                    except json.JSONDecodeError: pass
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(events)
+
+def maybe_span(profiler, stage: str):
+    """
+    Span of `stage` in `profiler`, or a no-op without profiler.
+    """
+    return profiler.span(stage) if profiler is not None else nullcontext()
+
+class ProfiledCollate(object):
+    """
+    Collate function recording the `collate` stage (picklable, for dataloader workers).
+    """
+    def __init__(self, profiler: StageProfiler, collate_fn=default_collate):
+        self.profiler = profiler
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch):
+        with self.profiler.span("collate"):
+            return self.collate_fn(batch)
@@ -0,0 +1,282 @@
+import pandas as pd
+import numpy as np
+import argparse
+import logging
+import yaml
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from args import Arguments
+from utils import to_markdown
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# the libyaml parser, when available, is much faster on the long lists of times
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# options of args.yaml that differ between runs without being compared
+IGNORED_OPTIONS = ["experiment_dir", "run_name", "master_port", "log_frequency", "zarr_version"]
+# batches averaged together by the warmup detection (MSER-5)
+MSER_BATCH = 5
+
+def get_args():
+    logger.info("Parsing arguments")
+    parser = argparse.ArgumentParser(description="Report the steady-state latency and throughput of benchmark runs, compared to a baseline run")
+
+    parser.add_argument("runs", nargs="+", help="Experiment directories, searched for runs (directories with a times_summary.yaml or distributed_summary.yaml)")
+    parser.add_argument(Arguments.BASELINE.flag, **Arguments.BASELINE.kwargs)
+    parser.add_argument(Arguments.REPORT_OUTPUT.flag, **Arguments.REPORT_OUTPUT.kwargs)
+    parser.add_argument(Arguments.BOOTSTRAP_SAMPLES.flag, **Arguments.BOOTSTRAP_SAMPLES.kwargs)
+    parser.add_argument(Arguments.CONFIDENCE.flag, **Arguments.CONFIDENCE.kwargs)
+    parser.add_argument(Arguments.REGRESSION_THRESHOLD.flag, **Arguments.REGRESSION_THRESHOLD.kwargs)
+    parser.add_argument(Arguments.REPORT_WORKERS.flag, **Arguments.REPORT_WORKERS.kwargs)
+
+    # parse arguments
+    args = parser.parse_args()
+
+    assert args.bootstrap_samples > 0, "--bootstrap_samples must be positive"
+    assert 0 < args.confidence < 1, "--confidence must be in (0, 1)"
+    if os.path.splitext(args.report_output)[1] not in [".md", ".html"]:
+        raise ValueError(f"Unknown report format {args.report_output}, use a .md or .html file")
+
+    return args
+
+def find_runs(paths: list[str]) -> list[str]:
+    """
+    Run directories under the given directories (or the directories themselves).
+    """
+    runs = set()
+    for path in paths:
+        assert os.path.isdir(path), f"{path} is not a directory"
+        for root, _, files in os.walk(path):
+            if "times_summary.yaml" in files or "distributed_summary.yaml" in files:
+                runs.add(os.path.normpath(root))
+    return sorted(runs)
+
+def load_run(run_dir: str) -> dict:
+    """
+    Options of a run and its batch times: one series per rank for distributed runs.
+    The samples per batch are measured by recent runs, or the batch size of the run.
+    """
+    options = {}
+    if os.path.exists(os.path.join(run_dir, "args.yaml")):
+        with open(os.path.join(run_dir, "args.yaml"), "r") as f:
+            options = yaml.load(f, Loader=YamlLoader) or {}
+
+    if os.path.exists(os.path.join(run_dir, "times_summary.yaml")):
+        with open(os.path.join(run_dir, "times_summary.yaml"), "r") as f:
+            summaries = [yaml.load(f, Loader=YamlLoader)]
+    else:
+        with open(os.path.join(run_dir, "distributed_summary.yaml"), "r") as f:
+            summaries = yaml.load(f, Loader=YamlLoader)["ranks"]
+
+    series = []
+    for summary in summaries:
+        times = np.asarray(summary["times"], dtype=np.float64)
+        samples_per_batch = summary["num_samples"] / len(times) if "num_samples" in summary else options.get("batch_size", 1)
+        series.append({"times": times, "samples_per_batch": samples_per_batch, "sample_bytes": summary.get("batch_bytes_per_sample")})
+    return {"run_dir": run_dir, "options": options, "series": series}
+
+def mser_truncation(times: np.ndarray, batch: int=MSER_BATCH) -> int:
+    """
+    Number of warmup times by the MSER-5 rule: the times are averaged by `batch`, and the number of
+    leading averages d minimizes the squared standard error of the mean of the others,
+    sum((Y_i - mean(Y_d:))^2 for i >= d) / (n - d)^2, with d searched in the first half of the series.
+    """
+    n = len(times) // batch
+    if n < 2: return 0
+    means = times[:n*batch].reshape(n, batch).mean(axis=1)
+    # sums of the averages and of their squares from each truncation to the end
+    tail = np.cumsum(means[::-1])[::-1]
+    tail_squares = np.cumsum(means[::-1] ** 2)[::-1]
+    count = n - np.arange(n)
+    mser = (tail_squares - tail ** 2 / count) / count ** 2
+    return int(np.argmin(mser[:max(n // 2, 1)])) * batch
+
+def block_length(num_times: int, num_workers: int=0) -> int:
+    """
+    Length of the blocks of the bootstrap: n^(1/3), and at least a batch per dataloader worker,
+    as the workers deliver their batches in bursts.
+    """
+    return max(1, min(num_times, max(round(num_times ** (1 / 3)), num_workers)))
+
+def moving_blocks(num_times: int, length: int, num_resamples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Indices of `num_resamples` moving-block resamples of a series: consecutive blocks of `length` times
+    starting at random positions, concatenated and cut to the length of the series.
+    """
+    num_blocks = -(-num_times // length)
+    starts = rng.integers(num_times - length + 1, size=(num_resamples, num_blocks))
+    return (starts[:, :, None] + np.arange(length)).reshape(num_resamples, -1)[:, :num_times]
+
+def bootstrap(series: list[tuple[np.ndarray, float]], num_samples: int, seed: int, num_workers: int=0) -> dict:
+    """
+    Mean and 99th percentile of the batch times, and mean time per sample, of `num_samples` resamples
+    of the (times, samples per batch) series. Batch times are autocorrelated, so each series is resampled
+    by moving blocks (see `block_length`) rather than time by time.
+    """
+    rng = np.random.default_rng(seed)
+    num_times = sum(len(times) for times, _ in series)
+    statistics = {"mean": [], "p99": [], "sample_mean": []}
+    # resamples drawn by blocks of at most ~4M times
+    rows = max(1, 2**22 // num_times)
+    for start in range(0, num_samples, rows):
+        num_resamples = min(rows, num_samples - start)
+        parts = [(times[moving_blocks(len(times), block_length(len(times), num_workers), num_resamples, rng)], samples_per_batch) for times, samples_per_batch in series]
+        resamples = np.concatenate([part for part, _ in parts], axis=1)
+        statistics["mean"].append(resamples.mean(axis=1))
+        statistics["p99"].append(np.percentile(resamples, 99, axis=1))
+        statistics["sample_mean"].append(sum(part.sum(axis=1) / samples_per_batch for part, samples_per_batch in parts) / num_times)
+    return {name: np.concatenate(values) for name, values in statistics.items()}
+
+def steady_series(run: dict) -> tuple[list[tuple[np.ndarray, float]], int]:
+    """
+    (times, samples per batch) of each series without its warmup, and the total number of warmup times.
+    """
+    warmups = [mser_truncation(series["times"]) for series in run["series"]]
+    steady = [(series["times"][warmup:], series["samples_per_batch"]) for series, warmup in zip(run["series"], warmups)]
+    return steady, sum(warmups)
+
+def sample_time(series: list[tuple[np.ndarray, float]]) -> float:
+    """
+    Mean time per sample: batch times divided by their number of samples, so runs of different batch sizes compare.
+    """
+    return float(sum(np.sum(times) / samples_per_batch for times, samples_per_batch in series) / sum(len(times) for times, _ in series))
+
+def analyze_run(run_dir: str, args, baseline: dict=None) -> dict:
+    """
+    Steady-state statistics of a run, and its change of mean time per sample relative to the baseline.
+    """
+    run = load_run(run_dir)
+    series, num_warmup = steady_series(run)
+    times = np.concatenate([times for times, _ in series])
+    assert len(times) > 0, f"{run_dir} has no batch times"
+    alpha = (1 - args.confidence) / 2
+    resamples = bootstrap(series, args.bootstrap_samples, seed=0, num_workers=run["options"].get("pt_workers") or 0)
+    sample_mean = sample_time(series)
+
+    # ranks read concurrently: the throughput of a run is the sum of the steady throughput of its series
+    samples_per_s = sum(samples_per_batch * len(times) / np.sum(times) for times, samples_per_batch in series)
+    sample_bytes = run["series"][0]["sample_bytes"]
+
+    result = {
+        "run": os.path.basename(run_dir),
+        "run_dir": run_dir,
+        "options": run["options"],
+        "warmup": num_warmup,
+        "batches": len(times),
+        "mean_s": float(np.mean(times)),
+        "mean_ci": np.quantile(resamples["mean"], [alpha, 1 - alpha]),
+        "p50_s": float(np.percentile(times, 50)),
+        "p90_s": float(np.percentile(times, 90)),
+        "p99_s": float(np.percentile(times, 99)),
+        "p99_ci": np.quantile(resamples["p99"], [alpha, 1 - alpha]),
+        "sample_s": sample_mean,
+        "samples_per_s": samples_per_s,
+        # the throughput scales with the inverse of the mean time per sample
+        "samples_per_s_ci": np.sort(samples_per_s * sample_mean / np.quantile(resamples["sample_mean"], [alpha, 1 - alpha])),
+        "mb_per_s": samples_per_s * sample_bytes / 1024**2 if sample_bytes is not None else None,
+    }
+    if baseline is not None:
+        # independent resamples of the run and of the baseline
+        ratios = resamples["sample_mean"] / baseline["sample_means"]
+        change = sample_mean / baseline["sample_mean"] - 1
+        change_ci = np.quantile(ratios, [alpha, 1 - alpha]) - 1
+        significant = change_ci[0] > 0 or change_ci[1] < 0
+        result["change"] = change
+        result["change_ci"] = change_ci
+        result["flag"] = "" if not significant or abs(change) < args.regression_threshold else "regression" if change > 0 else "improvement"
+    return result
+
+def resolve_baseline(runs: list[str], baseline: str) -> str:
+    """
+    Run directory of the baseline: a path, a directory name, or the codename of a run (`<codename>-<date>`).
+    """
+    matches = [run for run in runs if os.path.normpath(baseline) == run or os.path.basename(run) == baseline]
+    if len(matches) == 0:
+        matches = [run for run in runs if os.path.basename(run).split("-")[0] == baseline]
+    assert len(matches) > 0, f"No run matches the baseline {baseline}"
+    assert len(matches) == 1, f"Several runs match the baseline {baseline}: {matches}"
+    return matches[0]
+
+def varying_options(results: list[dict]) -> list[str]:
+    """
+    Options of args.yaml whose values differ between the runs.
+    """
+    keys = sorted(set(key for result in results for key in result["options"]) - set(IGNORED_OPTIONS))
+    return [key for key in keys if len(set(str(result["options"].get(key)) for result in results)) > 1]
+
+def report_table(results: list[dict], args) -> pd.DataFrame:
+    options = varying_options(results)
+    format_ci = lambda ci: f"[{ci[0]:.4g}, {ci[1]:.4g}]"
+    rows = []
+    for result in results:
+        row = {"run": result["run"]}
+        for option in options:
+            value = result["options"].get(option)
+            row[option] = str(value) if isinstance(value, (list, dict)) else value
+        row.update({key: result[key] for key in ["warmup", "batches", "mean_s"]})
+        row["mean_ci"] = format_ci(result["mean_ci"])
+        row.update({key: result[key] for key in ["p50_s", "p90_s", "p99_s"]})
+        row["p99_ci"] = format_ci(result["p99_ci"])
+        row["sample_s"] = result["sample_s"]
+        row["samples_per_s"] = result["samples_per_s"]
+        row["samples_per_s_ci"] = format_ci(result["samples_per_s_ci"])
+        row["mb_per_s"] = result["mb_per_s"]
+        if "change" in result:
+            row["change"] = f"{100*result['change']:+.1f}%"
+            row["change_ci"] = f"[{100*result['change_ci'][0]:+.1f}%, {100*result['change_ci'][1]:+.1f}%]"
+            row["flag"] = result["flag"]
+        rows.append(row)
+    table = pd.DataFrame(rows).set_index("run")
+    return table.astype(object).where(table.notna(), "")
+
+def to_html(table: pd.DataFrame, title: str) -> str:
+    body = table.reset_index().to_html(index=False, float_format=lambda value: f"{value:.4g}", border=0)
+    return f"<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{title}</title>\n</head>\n<body>\n<p>{title}</p>\n{body}\n</body>\n</html>\n"
+
+def main():
+    args = get_args()
+
+    runs = find_runs(args.runs)
+    assert len(runs) > 0, f"No runs found in {args.runs}"
+    logger.info(f"Found {len(runs)} runs")
+
+    baseline = None
+    if args.baseline is not None:
+        baseline_dir = resolve_baseline(runs, args.baseline)
+        run = load_run(baseline_dir)
+        series, _ = steady_series(run)
+        resamples = bootstrap(series, args.bootstrap_samples, seed=1, num_workers=run["options"].get("pt_workers") or 0)
+        baseline = {"run_dir": baseline_dir, "sample_mean": sample_time(series), "sample_means": resamples["sample_mean"]}
+        logger.info(f"Baseline: {baseline_dir} ({sum(len(times) for times, _ in series)} steady batches, {baseline['sample_mean']:.4f}s per sample)")
+
+    with ProcessPoolExecutor(args.report_workers) as pool:
+        results = list(pool.map(partial(analyze_run, args=args, baseline=baseline), runs, chunksize=max(1, len(runs) // (4 * (os.cpu_count() or 1)))))
+
+    title = f"{len(results)} runs, steady-state batch times (MSER-5 warmup removed), {100*args.confidence:.0f}% moving-block bootstrap confidence intervals ({args.bootstrap_samples} resamples)"
+    if baseline is not None:
+        title += f", change of the mean time per sample relative to {os.path.basename(baseline['run_dir'])} (flagged beyond {100*args.regression_threshold:.0f}%)"
+        flagged = [result for result in results if result["flag"] == "regression"]
+        for result in flagged:
+            logger.warning(f"Regression: {result['run']} mean time per sample {100*result['change']:+.1f}% ({result['sample_s']:.4f}s vs {baseline['sample_mean']:.4f}s)")
+        logger.info(f"{len(flagged)} regressions, {sum(result['flag'] == 'improvement' for result in results)} improvements")
+
+    table = report_table(results, args)
+    markdown = to_markdown(table)
+    logger.info(f"{title}:\n{markdown}")
+    with open(args.report_output, "w") as f:
+        if args.report_output.endswith(".html"): f.write(to_html(table, title))
+        else: f.write(f"{title}.\n\n{markdown}\n")
+    logger.info(f"Wrote {args.report_output}")
+
+if __name__ == "__main__":
+    main()
+    logger.info("Finished report")
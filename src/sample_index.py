@@ -0,0 +1,124 @@
+import logging
+import base64
+import json
+import time
+import zarr
+import os
+
+from utils import zarr_dims
+from store import open_store, resolve_selection, object_keys, metadata_keys, read_keys
+
+logger = logging.getLogger(__name__)
+
+zarr_format = int(zarr.__version__[0])
+
+class SampleIndex(object):
+    """
+    Everything the datasets resolve from the store at startup, persisted to a json file.
+
+    For a selection of variables, levels and dates of a store: the layout (dataset, or
+    dataarray with a 'variable' dimension), the integer offsets of the selected timesteps,
+    levels and variables in the store and of each (variable, level) channel, the dimensions
+    and chunk/object grids of the arrays holding the variables, and a snapshot of the metadata documents and coordinate arrays.
+    Opening the store through `SnapshotStore(store, index.metadata)` then reads no metadata
+    from the source, in the main process and in every dataloader worker.
+    The index is not invalidated when the store is rewritten, delete the file to rebuild it.
+    """
+    VERSION = 1
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    @classmethod
+    def build(cls, path: str, variables: list[str], levels: list[int], date_range: list[str], store=None) -> "SampleIndex":
+        """
+        Resolve the selection against the store at `path` (or `store`).
+        """
+        store = store if store is not None else open_store(path)
+        group = zarr.open_group(store=store, mode="r")
+        selection, names = resolve_selection(group, variables, levels, date_range)
+        time_index = list(selection["time"])
+        assert len(time_index) > 0, f"no timesteps of {path} in {date_range}"
+
+        arrays = {}
+        for name in names:
+            arr = group[name]
+            arrays[name] = {
+                "dims": list(zarr_dims(arr)),
+                "shape": list(arr.shape),
+                "chunks": list(arr.chunks),
+                "objects": list(arr.chunks if zarr_format == 2 else arr.metadata.chunk_grid.chunk_shape),
+                "packed": "scale_factor" in arr.attrs or "add_offset" in arr.attrs,
+            }
+
+        # (variable, level) channels, level is None for surface variables of a dataset
+        channels = []
+        for k, var in enumerate(variables):
+            name = names[0] if "variable" in selection else var
+            variable_index = int(selection["variable"][k]) if "variable" in selection else None
+            if "level" in arrays[name]["dims"]:
+                for level, level_index in zip(levels, selection["level"]):
+                    channels.append({"variable": var, "level": int(level), "array": name, "variable_index": variable_index, "level_index": int(level_index)})
+            else:
+                channels.append({"variable": var, "level": None, "array": name, "variable_index": variable_index, "level_index": None})
+        coordinate_keys = []
+        for name, arr in group.arrays():
+            if not name in names and len(arr.shape) <= 1: coordinate_keys += object_keys(arr, {})
+
+        return cls(
+            version=cls.VERSION,
+            path=path,
+            zarr_format=zarr_format,
+            variables=list(variables),
+            levels=[int(level) for level in levels],
+            date_range=[str(date) for date in date_range],
+            layout="dataarray" if "variable" in selection else "dataset",
+            time_offset=time_index[0],
+            num_timesteps=len(time_index),
+            num_levels=int(group["level"].shape[0]),
+            level_index=[int(index) for index in selection["level"]],
+            variable_index=[int(index) for index in selection["variable"]] if "variable" in selection else None,
+            arrays=arrays,
+            channels=channels,
+            metadata=read_keys(store, metadata_keys(group) + coordinate_keys),
+        )
+
+    def matches(self, path: str, variables: list[str], levels: list[int], date_range: list[str]) -> bool:
+        """
+        Whether the index was built for this selection, with this index version and zarr version.
+        """
+        return self.version == self.VERSION and self.zarr_format == zarr_format and self.path == path \
+            and self.variables == list(variables) and self.levels == [int(level) for level in levels] \
+            and self.date_range == [str(date) for date in date_range]
+
+    def save(self, path: str):
+        state = self.__dict__.copy()
+        state["metadata"] = {key: base64.b64encode(value).decode() for key, value in self.metadata.items()}
+        tmp = f"{path}.tmp-{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SampleIndex":
+        with open(path, "r") as f:
+            state = json.load(f)
+        state["metadata"] = {key: base64.b64decode(value) for key, value in state["metadata"].items()}
+        return cls(**state)
+
+    @classmethod
+    def load_or_build(cls, index_path: str, path: str, variables: list[str], levels: list[int], date_range: list[str], store=None) -> "SampleIndex":
+        """
+        Load the index at `index_path`, or build and save it if it is missing or was built for another selection.
+        """
+        t0 = time.time()
+        if os.path.exists(index_path):
+            index = cls.load(index_path)
+            if index.matches(path, variables, levels, date_range):
+                logger.info(f"Loaded sample index {index_path} in {1e3*(time.time()-t0):.1f}ms")
+                return index
+            logger.info(f"Sample index {index_path} was built for another selection, rebuilding it")
+        index = cls.build(path, variables, levels, date_range, store=store)
+        index.save(index_path)
+        logger.info(f"Built sample index {index_path} in {time.time()-t0:.2f}s ({len(index.metadata)} metadata objects)")
+        return index
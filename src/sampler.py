@@ -0,0 +1,120 @@
+import torch
+import logging
+import math
+
+from torch.utils.data import Sampler
+
+logger = logging.getLogger(__name__)
+
+class BlockBatchSampler(Sampler[list[int]]):
+    """
+    Batch sampler yielding blocks of `batch_size` contiguous sample indices, in shuffled order.
+    
+    Consecutive windows overlap, so a contiguous block can be read with a single read by 
+    `BaseDataset.__getitems__`, while shuffling the blocks keeps the batch order random. 
+    The block boundaries are shifted by a random offset at every epoch so that the same 
+    windows are not always batched together.
+    """
+    def __init__(self, num_samples: int, batch_size: int, shuffle: bool=True, drop_last: bool=False, seed: int=0):
+        assert isinstance(num_samples, int) and num_samples > 0, "num_samples must be a positive integer"
+        assert isinstance(batch_size, int) and batch_size > 0, "batch_size must be a positive integer"
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        
+    def _blocks(self, generator) -> list[list[int]]:
+        offset = int(torch.randint(self.batch_size, (1,), generator=generator)) if self.shuffle else 0
+        starts = list(range(0, offset, self.batch_size)) + list(range(offset, self.num_samples, self.batch_size))
+        blocks = []
+        for k, start in enumerate(starts):
+            stop = starts[k+1] if k+1 < len(starts) else self.num_samples
+            blocks.append(list(range(start, stop)))
+        if self.drop_last:
+            blocks = [block for block in blocks if len(block) == self.batch_size]
+        return blocks
+        
+    def _generator(self) -> torch.Generator:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        return generator
+        
+    def __iter__(self):
+        generator = self._generator()
+        self.epoch += 1
+        
+        blocks = self._blocks(generator)
+        if self.shuffle:
+            blocks = [blocks[k] for k in torch.randperm(len(blocks), generator=generator).tolist()]
+        yield from blocks
+        
+    def __len__(self):
+        # number of blocks of the next epoch (depends on its offset)
+        return len(self._blocks(self._generator()))
+
+class ShardedSampler(Sampler[int]):
+    """
+    Sampler yielding the shard of sample indices of one rank, with `DistributedSampler` semantics.
+    
+    Indices are padded (by repeating the first ones) to a multiple of `num_replicas`, or 
+    truncated with `drop_last`, so all ranks get the same number of samples. Shards are 
+    disjoint up to the padding:
+        contiguous: rank r gets the r-th contiguous range of indices, shuffled within 
+            the range, so each rank reads its own time span
+        interleaved: rank r gets every `num_replicas`-th index starting at r (of the 
+            shuffled indices), as `DistributedSampler`
+    """
+    MODES = ["contiguous", "interleaved"]
+    
+    def __init__(self, num_samples: int, num_replicas: int, rank: int, mode: str="contiguous", shuffle: bool=False, drop_last: bool=False, seed: int=0):
+        assert isinstance(num_samples, int) and num_samples > 0, "num_samples must be a positive integer"
+        assert isinstance(num_replicas, int) and num_replicas > 0, "num_replicas must be a positive integer"
+        assert isinstance(rank, int) and 0 <= rank < num_replicas, "rank must be in [0, num_replicas)"
+        assert mode in self.MODES, f"mode must be one of {self.MODES}"
+        self.num_samples = num_samples
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.mode = mode
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        
+        if drop_last:
+            self.shard_size = num_samples // num_replicas
+        else:
+            self.shard_size = -(-num_samples // num_replicas)
+        assert self.shard_size > 0, "fewer samples than replicas"
+        self.total_size = self.shard_size * num_replicas
+        
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        
+    def _indices(self, generator) -> list[int]:
+        indices = list(range(self.num_samples))
+        if self.shuffle and self.mode == "interleaved":
+            indices = torch.randperm(self.num_samples, generator=generator).tolist()
+        # pad or truncate to the same number of samples per rank
+        if self.total_size > len(indices):
+            indices += (indices * math.ceil(self.total_size / len(indices)))[:self.total_size - len(indices)]
+        indices = indices[:self.total_size]
+        
+        if self.mode == "interleaved":
+            return indices[self.rank:self.total_size:self.num_replicas]
+        shard = indices[self.rank*self.shard_size:(self.rank+1)*self.shard_size]
+        if self.shuffle:
+            shard = [shard[k] for k in torch.randperm(len(shard), generator=generator).tolist()]
+        return shard
+        
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        return iter(self._indices(generator))
+        
+    def __len__(self):
+        return self.shard_size
@@ -0,0 +1,251 @@
+import numpy as np
+import threading
+import tempfile
+import logging
+import weakref
+import fcntl
+import mmap
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+class SharedFrameCache(object):
+    """
+    Fixed-size LRU cache of decoded frames shared by all dataloader workers of a dataset, in a
+    memory-mapped file under /dev/shm (or the temporary directory if there is none).
+
+    A frame is a single timestep of a single variable, keyed by (timestep, variable). The file
+    holds a table of `max_bytes // slot_bytes` slots, each large enough for the largest frame,
+    followed by the slots. A slot is empty, filling or ready: the first worker missing a frame
+    claims a slot for it (an empty slot, or the least recently used ready slot that is not
+    pinned), decodes the frame into it and publishes it, and workers asking for the frame in
+    the meantime wait for it instead of decoding it again. Frames are returned as views of their
+    slot, pinned until they are released, so a slot is not reused while a sample is assembled
+    from it. The table is only updated under an exclusive lock of the file (and a thread lock).
+
+    The file is created by the constructing process and mapped lazily in each worker, it is removed
+    by `close` or when the constructing process exits. Pins of a worker killed while assembling a
+    sample are never released, and frames it was filling are decoded by the waiting workers.
+    """
+    COUNTERS = [
+        "shared_cache_hits", "shared_cache_cross_hits", "shared_cache_misses", "shared_cache_waits",
+        "shared_cache_evictions", "shared_cache_bypasses", "shared_cache_hit_bytes", "shared_cache_miss_bytes",
+    ]
+    EMPTY, FILLING, READY = 0, 1, 2
+    # columns of the slot table (int64), row 0 of the table holds the LRU clock
+    STATE, TIMESTEP, KEY, LAST_USED, PINS, OWNER = range(6)
+    NUM_COLUMNS = 8
+    POLL_S = 0.001
+
+    def __init__(self, max_bytes: int, frame_shapes: dict, dtype, counters=None, directory: str=None):
+        assert isinstance(max_bytes, int) and max_bytes > 0, "max_bytes must be a positive integer"
+        assert len(frame_shapes) > 0, "frame_shapes must not be empty"
+        self.frame_shapes = {key: tuple(int(n) for n in shape) for key, shape in frame_shapes.items()}
+        self.keys = list(self.frame_shapes)
+        self.dtype = np.dtype(dtype)
+        self.counters = counters
+
+        # slots aligned to 64 bytes, after a table padded to a page
+        frame_bytes = max(int(np.prod(shape)) for shape in self.frame_shapes.values()) * self.dtype.itemsize
+        self.slot_bytes = -(-frame_bytes // 64) * 64
+        self.num_slots = max_bytes // self.slot_bytes
+        assert self.num_slots > 0, f"max_bytes must hold at least one frame ({self.slot_bytes} bytes)"
+        table_bytes = (self.num_slots + 1) * self.NUM_COLUMNS * 8
+        self.data_offset = -(-table_bytes // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.nbytes = self.data_offset + self.num_slots * self.slot_bytes
+
+        if directory is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        fd, self.path = tempfile.mkstemp(prefix="frame-cache-", dir=directory)
+        try: os.ftruncate(fd, self.nbytes) # zero-filled: all slots are empty
+        finally: os.close(fd)
+        self._finalizer = weakref.finalize(self, SharedFrameCache._remove, self.path, os.getpid())
+        logger.info(f"Created shared frame cache {self.path} with {self.num_slots} slots of {self.slot_bytes/1024**2:.2f}MB")
+
+        # the file is opened and mapped lazily in each process
+        self._pid = None
+
+    @staticmethod
+    def _remove(path: str, pid: int):
+        # only the constructing process removes the file (workers inherit the finalizer when forked)
+        if os.getpid() != pid: return
+        try: os.remove(path)
+        except FileNotFoundError: pass
+
+    def close(self):
+        """
+        Remove the file, the workers must not use the cache anymore.
+        """
+        self._finalizer()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ["_file", "_lock", "_mmap", "_table", "_clock", "_data"]: state.pop(name, None)
+        state["_pid"] = None
+        return state
+
+    def _attach(self):
+        # a separate open file per process: flock does not exclude processes sharing an inherited one
+        if self._pid == os.getpid(): return
+        self._file = open(self.path, "r+b")
+        self._lock = threading.Lock()
+        self._mmap = mmap.mmap(self._file.fileno(), self.nbytes)
+        header = np.frombuffer(self._mmap, dtype=np.int64, count=(self.num_slots + 1) * self.NUM_COLUMNS).reshape(-1, self.NUM_COLUMNS)
+        self._clock, self._table = header[0], header[1:]
+        self._data = np.frombuffer(self._mmap, dtype=np.uint8, offset=self.data_offset)
+        self._pid = os.getpid()
+
+    def _locked(self):
+        self._attach()
+        return _FileLock(self._file, self._lock)
+
+    def _count(self, name, value=1):
+        if self.counters is not None:
+            self.counters.add(name, value)
+
+    def _frame_bytes(self, key) -> int:
+        return int(np.prod(self.frame_shapes[key[1]])) * self.dtype.itemsize
+
+    def frame(self, slot: int, key) -> np.ndarray:
+        """
+        View of the frame of `key` in `slot`.
+        """
+        self._attach()
+        start = slot * self.slot_bytes
+        return self._data[start:start+self._frame_bytes(key)].view(self.dtype).reshape(self.frame_shapes[key[1]])
+
+    def _find(self, key) -> int|None:
+        match = np.flatnonzero((self._table[:, self.STATE] != self.EMPTY) & (self._table[:, self.TIMESTEP] == key[0]) & (self._table[:, self.KEY] == self.keys.index(key[1])))
+        return int(match[0]) if len(match) > 0 else None
+
+    def _touch(self, slot: int):
+        self._clock[0] += 1
+        self._table[slot, self.LAST_USED] = self._clock[0]
+
+    def _hit(self, slot: int, key):
+        self._table[slot, self.PINS] += 1
+        self._touch(slot)
+        self._count("shared_cache_hits")
+        self._count("shared_cache_hit_bytes", self._frame_bytes(key))
+        if self._table[slot, self.OWNER] != os.getpid(): self._count("shared_cache_cross_hits")
+
+    def acquire(self, keys: list) -> list[tuple[str, int]]:
+        """
+        Look up frames, claiming a slot for each missing frame. Returns a (status, slot) per key:
+        "hit" (ready, pinned), "claimed" (pinned, to be filled by the caller and published),
+        "wait" (being filled by another process, see `wait`) or "bypass" (no slot is free,
+        the frame is read without caching).
+        """
+        results = []
+        with self._locked():
+            for key in keys:
+                slot = self._find(key)
+                if slot is not None and self._table[slot, self.STATE] == self.READY:
+                    self._hit(slot, key)
+                    results.append(("hit", slot))
+                    continue
+                if slot is not None:
+                    results.append(("wait", slot))
+                    continue
+
+                empty = np.flatnonzero(self._table[:, self.STATE] == self.EMPTY)
+                if len(empty) > 0:
+                    slot = int(empty[0])
+                else:
+                    evictable = np.flatnonzero((self._table[:, self.STATE] == self.READY) & (self._table[:, self.PINS] == 0))
+                    if len(evictable) == 0:
+                        self._count("shared_cache_bypasses")
+                        self._count("shared_cache_misses")
+                        self._count("shared_cache_miss_bytes", self._frame_bytes(key))
+                        results.append(("bypass", None))
+                        continue
+                    slot = int(evictable[np.argmin(self._table[evictable, self.LAST_USED])])
+                    self._count("shared_cache_evictions")
+                self._table[slot, [self.STATE, self.TIMESTEP, self.KEY, self.PINS, self.OWNER]] = [self.FILLING, key[0], self.keys.index(key[1]), 1, os.getpid()]
+                self._touch(slot)
+                self._count("shared_cache_misses")
+                self._count("shared_cache_miss_bytes", self._frame_bytes(key))
+                results.append(("claimed", slot))
+        return results
+
+    def publish(self, slots: list[int]):
+        """
+        Mark claimed slots as ready once their frames are written, they stay pinned.
+        """
+        if len(slots) == 0: return
+        with self._locked():
+            self._table[slots, self.STATE] = self.READY
+
+    def abandon(self, slots: list[int]):
+        """
+        Free claimed slots that could not be filled, the waiting processes read the frames themselves.
+        """
+        if len(slots) == 0: return
+        with self._locked():
+            self._table[slots, self.STATE] = self.EMPTY
+            self._table[slots, self.PINS] = 0
+
+    def release(self, slots: list[int]):
+        """
+        Unpin frames, once they are copied into the sample.
+        """
+        if len(slots) == 0: return
+        with self._locked():
+            np.subtract.at(self._table[:, self.PINS], slots, 1)
+
+    def wait(self, key, slot: int) -> np.ndarray|None:
+        """
+        Wait until another process has filled the frame of `key` in `slot`, returns the pinned frame,
+        or None if the process gave up the slot or died (the caller reads the frame itself).
+        """
+        self._count("shared_cache_waits")
+        while True:
+            with self._locked():
+                filling = self._table[slot, self.STATE] == self.FILLING
+                if self._find(key) != slot:
+                    return None
+                if not filling:
+                    self._hit(slot, key)
+                    return self.frame(slot, key)
+                owner = int(self._table[slot, self.OWNER])
+                if not _alive(owner):
+                    logger.warning(f"Process {owner} died while filling frame {key}, freeing its slot")
+                    self._table[slot, [self.STATE, self.PINS]] = [self.EMPTY, 0]
+                    return None
+            time.sleep(self.POLL_S)
+
+    def summary(self) -> dict:
+        """
+        Occupancy of the slots.
+        """
+        with self._locked():
+            state, pins = self._table[:, self.STATE].copy(), self._table[:, self.PINS].copy()
+        return {
+            "num_slots": self.num_slots,
+            "slot_mb": self.slot_bytes / 1024**2,
+            "ready_slots": int(np.sum(state == self.READY)),
+            "pinned_slots": int(np.sum(pins > 0)),
+        }
+
+class _FileLock(object):
+    """
+    Exclusive lock of an open file, also held against the other threads of the process.
+    """
+    def __init__(self, file, lock: threading.Lock):
+        self.file = file
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.lock.release()
+
+def _alive(pid: int) -> bool:
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: pass
+    return True
@@ -0,0 +1,331 @@
+import xarray as xr
+import pandas as pd
+import itertools
+import logging
+import asyncio
+import time
+import zarr
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import zarr_dims
+
+logger = logging.getLogger(__name__)
+
+zarr_format = int(zarr.__version__[0])
+if zarr_format == 3:
+    from zarr.abc.store import RangeByteRequest, OffsetByteRequest, SuffixByteRequest
+    from zarr.core.buffer import default_buffer_prototype
+    from zarr.core.sync import sync
+
+METADATA_KEYS = ["zarr.json", ".zarray", ".zattrs", ".zgroup", ".zmetadata"]
+
+def is_chunk_key(key: str) -> bool:
+    return key.rsplit("/", 1)[-1] not in METADATA_KEYS
+
+def open_store(path: str):
+    """
+    Read-only zarr store of a local path or an fsspec url, for the installed zarr version.
+    """
+    if zarr_format == 2:
+        if "://" in path: return zarr.storage.FSStore(path, mode="r")
+        return zarr.storage.DirectoryStore(path)
+    if "://" in path: return zarr.storage.FsspecStore.from_url(path, read_only=True)
+    return zarr.storage.LocalStore(path, read_only=True)
+
+def object_keys(arr, selection: dict) -> list[str]:
+    """
+    Keys of the stored objects (chunks, or shards) of a zarr array touched by `selection`
+    (dimension name -> integer indices, all indices of the dimensions not in `selection`).
+    """
+    grid = arr.chunks if zarr_format == 2 else arr.metadata.chunk_grid.chunk_shape
+    ranges = []
+    for dim, size, block in zip(zarr_dims(arr), arr.shape, grid):
+        if dim in selection: ranges.append(sorted({int(index) // block for index in selection[dim]}))
+        else: ranges.append(range(-(-size // block)))
+    if zarr_format == 2: return [arr._chunk_key(coords) for coords in itertools.product(*ranges)]
+    return [f"{arr.path}/{arr.metadata.encode_chunk_key(coords)}" for coords in itertools.product(*ranges)]
+
+def resolve_selection(group, variables: list[str], levels: list[int], date_range: list[str]) -> tuple[dict, list[str]]:
+    """
+    Integer indices (dimension name -> indices) of `variables`, `levels` and the dates in `date_range`
+    (inclusive) in a zarr group written as a dataset or as a dataarray with a 'variable' dimension,
+    and the names of the arrays holding the variables.
+    """
+    time = xr.decode_cf(xr.Dataset(coords={"time": ("time", group["time"][:], dict(group["time"].attrs))}))["time"]
+    time_index = pd.Index(time.values)
+    selection = {
+        "time": range(len(time_index))[time_index.slice_indexer(date_range[0], date_range[1])],
+        "level": pd.Index(group["level"][:]).get_indexer(levels),
+    }
+    assert all(selection["level"] >= 0), "all levels must be in the store"
+    if "__xarray_dataarray_variable__" in group:
+        selection["variable"] = pd.Index([str(var) for var in group["variable"][:]]).get_indexer(variables)
+        assert all(selection["variable"] >= 0), "all variables must be in the store"
+        names = ["__xarray_dataarray_variable__"]
+    else:
+        assert all(var in group for var in variables), "all variables must be in the store"
+        names = variables
+    return selection, names
+
+def selection_keys(store, variables: list[str], levels: list[int], date_range: list[str]) -> list[str]:
+    """
+    Keys of the coordinate arrays and of the objects of `variables` at `levels` and dates in
+    `date_range` (inclusive), in a store written as a dataset or as a dataarray with a 'variable' dimension.
+    """
+    group = zarr.open_group(store=store, mode="r")
+    selection, names = resolve_selection(group, variables, levels, date_range)
+    keys = []
+    for name, arr in group.arrays():
+        if name in names: keys += object_keys(arr, selection)
+        elif len(arr.shape) <= 1: keys += object_keys(arr, {})
+    return keys
+
+def metadata_keys(group) -> list[str]:
+    """
+    Keys of the metadata documents of a zarr group and of its arrays.
+    """
+    if zarr_format == 2:
+        keys = [".zgroup", ".zattrs", ".zmetadata"]
+        for name in group.array_keys(): keys += [f"{name}/.zarray", f"{name}/.zattrs"]
+        return keys
+    return ["zarr.json"] + [f"{name}/zarr.json" for name in group.array_keys()]
+
+def read_keys(store, keys: list[str]) -> dict:
+    """
+    Values (bytes) of the `keys` present in `store`.
+    """
+    if zarr_format == 2:
+        return {key: bytes(store[key]) for key in keys if key in store}
+    async def read():
+        return await asyncio.gather(*[store.get(key, default_buffer_prototype()) for key in keys])
+    return {key: value.to_bytes() for key, value in zip(keys, sync(read())) if value is not None}
+
+if zarr_format == 2:
+    class ReadOnlyWrapperStore(zarr.storage.Store):
+        """
+        Read-only store forwarding to `store`, base of the store wrappers below.
+        """
+        def __init__(self, store):
+            self._store = store
+
+        def __getitem__(self, key):
+            return self._store[key]
+
+        def getitems(self, keys, *, contexts):
+            if hasattr(self._store, "getitems"): return self._store.getitems(keys, contexts=contexts)
+            return {key: self._store[key] for key in keys if key in self._store}
+
+        def __contains__(self, key):
+            return key in self._store
+
+        def __setitem__(self, key, value):
+            raise PermissionError(f"{type(self).__name__} is read-only")
+
+        def __delitem__(self, key):
+            raise PermissionError(f"{type(self).__name__} is read-only")
+
+        def __iter__(self):
+            return iter(self._store)
+
+        def __len__(self):
+            return len(self._store)
+
+        def listdir(self, path: str=""):
+            return self._store.listdir(path)
+
+        def is_writeable(self):
+            return False
+
+    class ProfiledStore(ReadOnlyWrapperStore):
+        """
+        Read-only store recording the time (`fs_read` stage), bytes and number of the
+        chunk objects read through it in a `StageProfiler`.
+        """
+        def __init__(self, store, profiler):
+            super().__init__(store)
+            self.profiler = profiler
+
+        def _record(self, t0, values: list):
+            values = [value for key, value in values if is_chunk_key(key)]
+            if len(values) == 0: return
+            self.profiler.record("fs_read", t0, time.perf_counter_ns())
+            self.profiler.add("chunks_read", len(values))
+            self.profiler.add("bytes_read", sum(len(value) for value in values))
+
+        def __getitem__(self, key):
+            t0 = time.perf_counter_ns()
+            value = self._store[key]
+            self._record(t0, [(key, value)])
+            return value
+
+        def getitems(self, keys, *, contexts):
+            t0 = time.perf_counter_ns()
+            values = super().getitems(keys, contexts=contexts)
+            self._record(t0, list(values.items()))
+            return values
+
+    class CachingStore(ReadOnlyWrapperStore):
+        """
+        Read-only store reading through a `ChunkCache`: objects are served from the local cache
+        directory when present, otherwise fetched from `store` and cached.
+        """
+        def __init__(self, store, cache):
+            super().__init__(store)
+            self.cache = cache
+
+        def __getitem__(self, key):
+            value = self.cache.get(key)
+            if value is None:
+                value = self._store[key]
+                self.cache.put(key, value)
+            return value
+
+        def getitems(self, keys, *, contexts):
+            values = {}
+            for key in keys:
+                value = self.cache.get(key)
+                if value is not None: values[key] = value
+            missing = [key for key in keys if key not in values]
+            if len(missing) > 0:
+                fetched = super().getitems(missing, contexts=contexts)
+                for key, value in fetched.items():
+                    self.cache.put(key, value)
+                values.update(fetched)
+            return values
+
+        def __contains__(self, key):
+            return key in self.cache or key in self._store
+
+        def stage(self, keys: list[str], num_threads: int=16) -> int:
+            """
+            Copy the objects of `keys` that are not cached yet, returns the number of bytes fetched.
+            """
+            def stage_key(key):
+                try: value = self._store[key]
+                except KeyError: return 0 # chunks that were never written
+                self.cache.put(key, value)
+                return len(value)
+            missing = [key for key in keys if not key in self.cache]
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                return sum(executor.map(stage_key, missing))
+
+    class SnapshotStore(ReadOnlyWrapperStore):
+        """
+        Read-only store serving the objects of `snapshot` (key -> bytes, e.g. the metadata of
+        a `SampleIndex`) from memory and all other objects from `store`.
+        """
+        def __init__(self, store, snapshot: dict):
+            super().__init__(store)
+            self.snapshot = snapshot
+
+        def __getitem__(self, key):
+            if key in self.snapshot: return self.snapshot[key]
+            return self._store[key]
+
+        def getitems(self, keys, *, contexts):
+            values = {key: self.snapshot[key] for key in keys if key in self.snapshot}
+            missing = [key for key in keys if key not in values]
+            if len(missing) > 0: values.update(super().getitems(missing, contexts=contexts))
+            return values
+
+        def __contains__(self, key):
+            return key in self.snapshot or key in self._store
+
+else:
+    def _byte_range(value: bytes, byte_range) -> bytes:
+        if byte_range is None: return value
+        if isinstance(byte_range, RangeByteRequest): return value[byte_range.start:byte_range.end]
+        if isinstance(byte_range, OffsetByteRequest): return value[byte_range.offset:]
+        if isinstance(byte_range, SuffixByteRequest): return value[-byte_range.suffix:]
+        raise ValueError(f"Unknown byte range: {byte_range}")
+
+    class ProfiledStore(zarr.storage.WrapperStore):
+        """
+        Read-only store recording the time (`fs_read` stage), bytes and number of the
+        chunk objects read through it in a `StageProfiler`.
+        """
+        def __init__(self, store, profiler):
+            super().__init__(store)
+            self.profiler = profiler
+
+        def _record(self, t0, keys: list, values: list):
+            values = [value for key, value in zip(keys, values) if is_chunk_key(key) and value is not None]
+            if len(values) == 0: return
+            self.profiler.record("fs_read", t0, time.perf_counter_ns())
+            self.profiler.add("chunks_read", len(values))
+            self.profiler.add("bytes_read", sum(len(value) for value in values))
+
+        async def get(self, key, prototype, byte_range=None):
+            t0 = time.perf_counter_ns()
+            value = await self._store.get(key, prototype, byte_range)
+            self._record(t0, [key], [value])
+            return value
+
+        async def get_partial_values(self, prototype, key_ranges):
+            key_ranges = list(key_ranges)
+            t0 = time.perf_counter_ns()
+            values = await self._store.get_partial_values(prototype, key_ranges)
+            self._record(t0, [key for key, _ in key_ranges], values)
+            return values
+
+    class CachingStore(zarr.storage.WrapperStore):
+        """
+        Read-only store reading through a `ChunkCache`: objects are served from the local cache
+        directory when present, otherwise fetched from `store` and cached. Objects are always
+        fetched whole, so the first partial read of a shard caches the full shard. The file I/O
+        of the cache runs in threads, so it does not block the concurrent fetches of the event loop.
+        """
+        def __init__(self, store, cache):
+            super().__init__(store)
+            self.cache = cache
+
+        async def get(self, key, prototype, byte_range=None):
+            value = await asyncio.to_thread(self.cache.get, key)
+            if value is None:
+                buffer = await self._store.get(key, prototype)
+                if buffer is None: return None
+                value = buffer.to_bytes()
+                await asyncio.to_thread(self.cache.put, key, value)
+            return prototype.buffer.from_bytes(_byte_range(value, byte_range))
+
+        async def get_partial_values(self, prototype, key_ranges):
+            return await asyncio.gather(*[self.get(key, prototype, byte_range) for key, byte_range in key_ranges])
+
+        async def exists(self, key):
+            return await asyncio.to_thread(self.cache.__contains__, key) or await self._store.exists(key)
+
+        async def _stage(self, keys: list[str], num_threads: int) -> int:
+            semaphore = asyncio.Semaphore(num_threads)
+            async def stage_key(key):
+                async with semaphore:
+                    buffer = await self._store.get(key, default_buffer_prototype())
+                if buffer is None: return 0 # chunks that were never written
+                await asyncio.to_thread(self.cache.put, key, buffer.to_bytes())
+                return len(buffer)
+            return sum(await asyncio.gather(*[stage_key(key) for key in keys]))
+
+        def stage(self, keys: list[str], num_threads: int=16) -> int:
+            """
+            Copy the objects of `keys` that are not cached yet, returns the number of bytes fetched.
+            """
+            return sync(self._stage([key for key in keys if not key in self.cache], num_threads))
+
+    class SnapshotStore(zarr.storage.WrapperStore):
+        """
+        Read-only store serving the objects of `snapshot` (key -> bytes, e.g. the metadata of
+        a `SampleIndex`) from memory and all other objects from `store`.
+        """
+        def __init__(self, store, snapshot: dict):
+            super().__init__(store)
+            self.snapshot = snapshot
+
+        async def get(self, key, prototype, byte_range=None):
+            if key in self.snapshot: return prototype.buffer.from_bytes(_byte_range(self.snapshot[key], byte_range))
+            return await self._store.get(key, prototype, byte_range)
+
+        async def get_partial_values(self, prototype, key_ranges):
+            return await asyncio.gather(*[self.get(key, prototype, byte_range) for key, byte_range in key_ranges])
+
+        async def exists(self, key):
+            return key in self.snapshot or await self._store.exists(key)
@@ -0,0 +1,113 @@
+import logging
+import torch
+
+from torch.utils.data import IterableDataset, get_worker_info
+
+from dataset import BaseDataset
+
+logger = logging.getLogger(__name__)
+
+class StreamingDataset(IterableDataset):
+    """
+    Samples of a `BaseDataset` (or subclass) streamed in storage order instead of read at random.
+
+    The windows are split into blocks of `block_timesteps` consecutive start times. The span of
+    a block (its windows and the `sample_timesteps - 1` following timesteps) is read with a single
+    contiguous read, and its windows are views of the span. Blocks are dealt to the ranks in turn,
+    and the blocks of a rank to its dataloader workers in turn, so each worker reads its blocks
+    in time order and the workers together sweep the store.
+    Windows go through a shuffle buffer of `shuffle_buffer` samples (0 or 1: time order): once
+    the buffer is full, each new window replaces a random one, which is yielded.
+
+    Block boundaries are shifted by an offset drawn from `seed + epoch` (the same on all ranks,
+    see `set_epoch`), the shuffle buffer draws from the torch RNG (seeded per dataloader worker).
+    Ranks get the windows of their blocks, not necessarily the same number of samples.
+    A buffered window keeps the span of its block alive, so the buffer holds about
+    `shuffle_buffer / block_timesteps + 1` spans per worker.
+    """
+    COUNTERS = ["stream_blocks", "stream_buffer_peak_bytes"]
+
+    def __init__(self, dataset: BaseDataset, block_timesteps: int=16, shuffle_buffer: int=0, rank: int=0, world_size: int=1, seed: int=0):
+        assert isinstance(dataset, BaseDataset), "dataset must be a BaseDataset"
+        assert isinstance(block_timesteps, int) and block_timesteps > 0, "block_timesteps must be a positive integer"
+        assert isinstance(shuffle_buffer, int) and shuffle_buffer >= 0, "shuffle_buffer must be a non-negative integer"
+        assert isinstance(world_size, int) and world_size > 0, "world_size must be a positive integer"
+        assert isinstance(rank, int) and 0 <= rank < world_size, "rank must be in [0, world_size)"
+        assert dataset.patch_size is None, "patches are drawn per sample, streaming requires full-field samples"
+        self.dataset = dataset
+        self.block_timesteps = block_timesteps
+        self.shuffle_buffer = shuffle_buffer
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _blocks(self) -> list[tuple[int, int]]:
+        """
+        [start, stop) window ranges of the blocks of the current epoch.
+        """
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        num_windows = len(self.dataset)
+        offset = int(torch.randint(self.block_timesteps, (1,), generator=generator)) if self.shuffle_buffer > 1 else 0
+        starts = ([0] if offset > 0 else []) + list(range(offset, num_windows, self.block_timesteps))
+        return [(start, min(stop, num_windows)) for start, stop in zip(starts, starts[1:] + [num_windows])]
+
+    def _worker_blocks(self) -> list[tuple[int, int]]:
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        return self._blocks()[self.rank::self.world_size][worker_id::num_workers]
+
+    def __len__(self):
+        # windows of this rank (all of its workers) in the current epoch
+        return sum(stop - start for start, stop in self._blocks()[self.rank::self.world_size])
+
+    def _read_block(self, start, stop) -> torch.Tensor:
+        """
+        Read the span of the windows [start, stop) as a (T, C, H, W) tensor, converted to the output dtype.
+        """
+        dataset = self.dataset
+        num_timesteps = stop - start + dataset.sample_timesteps - 1
+        with dataset._span("sample"):
+            if dataset.preallocate:
+                # a new span per block: buffered windows are views of the previous spans
+                span = torch.empty((num_timesteps, dataset.num_channels, *dataset.spatial_shape), dtype=dataset.read_dtype)
+                dataset._fill_span(span.numpy(), start)
+            else:
+                span = dataset._read_span(start, start + num_timesteps)
+            span = dataset._convert(span)
+        dataset._count("stream_blocks")
+        return span
+
+    def __iter__(self):
+        dataset = self.dataset
+        buffer, spans, peak_bytes = [], {}, 0
+        for start, stop in self._worker_blocks():
+            span = self._read_block(start, stop)
+            spans[start] = span
+            for i in range(start, stop):
+                sample = (start, dataset._split(span[i-start:i-start+dataset.sample_timesteps]))
+                dataset._count("samples")
+                if self.shuffle_buffer <= 1:
+                    yield sample[1]
+                    continue
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                k = int(torch.randint(len(buffer), ()))
+                sample, buffer[k] = buffer[k], sample
+                yield sample[1]
+
+            # spans still referenced by the buffer (and the current one)
+            spans = {key: spans[key] for key in set(block for block, _ in buffer) | {start}}
+            nbytes = sum(span.nbytes for span in spans.values())
+            if nbytes > peak_bytes:
+                dataset._count("stream_buffer_peak_bytes", nbytes - peak_bytes)
+                peak_bytes = nbytes
+
+        # drain the buffer in random order
+        for k in torch.randperm(len(buffer)).tolist():
+            yield buffer[k][1]
@@ -0,0 +1,303 @@
+import pandas as pd
+import argparse
+import itertools
+import subprocess
+import hashlib
+import logging
+import sqlite3
+import shlex
+import json
+import yaml
+import time
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from args import Arguments
+from utils import to_markdown
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# metrics of a run: key in the summary yaml -> column
+METRICS = {
+    "mean": "mean",
+    "std": "std",
+    "num_samples": "num_samples",
+    "samples_per_s": "samples_per_s",
+    "bytes_copied_per_sample": "bytes_copied_per_sample",
+    "peak_rss_mb": "peak_rss_mb",
+    "peak_rss_children_mb": "peak_rss_children_mb",
+    "peak_tree_rss_mb": "peak_tree_rss_mb",
+    "steady.mean": "steady_mean",
+    "cache.cache_hit_rate": "cache_hit_rate",
+    "shared_cache.shared_cache_hit_rate": "shared_cache_hit_rate",
+    "shared_cache.read_bytes_reduction": "shared_cache_read_bytes_reduction",
+    "consumer.stall_fraction": "stall_fraction",
+    "consumer.effective_samples_per_s": "effective_samples_per_s",
+    "aggregate_samples_per_s": "aggregate_samples_per_s",
+    "world_size": "world_size",
+}
+
+def get_args():
+    logger.info("Parsing arguments")
+    parser = argparse.ArgumentParser(description="Run a grid of benchmark configs and compare their results")
+
+    parser.add_argument("command", choices=["run", "slurm", "ingest", "report"], help="run: benchmark the missing configs locally, slurm: write an array job of the missing configs, ingest: add finished runs to the results database, report: compare the results")
+    parser.add_argument(Arguments.GRID.flag, **Arguments.GRID.kwargs)
+    parser.add_argument(Arguments.EXPERIMENT_DIR.flag, **Arguments.EXPERIMENT_DIR.kwargs)
+    parser.add_argument(Arguments.SWEEP_WORKERS.flag, **Arguments.SWEEP_WORKERS.kwargs)
+    parser.add_argument(Arguments.RESULTS_DB.flag, **Arguments.RESULTS_DB.kwargs)
+    parser.add_argument(Arguments.PYTHON.flag, **Arguments.PYTHON.kwargs)
+    parser.add_argument(Arguments.SLURM_OPTIONS.flag, **Arguments.SLURM_OPTIONS.kwargs)
+    parser.add_argument(Arguments.GROUP_BY.flag, **Arguments.GROUP_BY.kwargs)
+    parser.add_argument(Arguments.COMPARE.flag, **Arguments.COMPARE.kwargs)
+    parser.add_argument(Arguments.METRIC.flag, **Arguments.METRIC.kwargs)
+
+    # parse arguments
+    args = parser.parse_args()
+
+    if args.command != "report" and args.grid is None:
+        raise ValueError(f"{args.command} requires --grid")
+    if args.grid is not None:
+        with open(args.grid, "r") as f:
+            args.sweep = yaml.safe_load(f)
+        args.sweep_name = args.sweep.get("name", os.path.splitext(os.path.basename(args.grid))[0])
+        args.experiment_dir = os.path.join(args.experiment_dir, f"sweep-{args.sweep_name}")
+    os.makedirs(args.experiment_dir, exist_ok=True)
+    if args.results_db is None:
+        args.results_db = os.path.join(args.experiment_dir, "results.sqlite")
+
+    return args
+
+def format_option(value, config: dict):
+    """
+    Replace `{name}` in a string option by the value of option `name` (other braces are kept).
+    """
+    if not isinstance(value, str): return value
+    for key, other in config.items():
+        value = value.replace("{" + key + "}", str(other))
+    return value
+
+def grid_configs(sweep: dict, formatted: bool=True) -> list[dict]:
+    """
+    Configs of a sweep: the fixed `benchmark` options combined with every point of the `grid`.
+    String options may refer to other options, e.g. `dataset: data/era5.zarr-v{zarr_format}`,
+    they are replaced unless `formatted` is False (in the same order of configs).
+    """
+    fixed = sweep.get("benchmark", {}) or {}
+    grid = sweep.get("grid", {}) or {}
+    configs = []
+    for values in itertools.product(*grid.values()):
+        config = {**fixed, **dict(zip(grid.keys(), values))}
+        config.setdefault("zarr_format", 3)
+        if formatted: config = {key: format_option(value, config) for key, value in config.items()}
+        configs.append(config)
+    return configs
+
+def config_id(config: dict) -> str:
+    """
+    Stable id of a config, used as its run name.
+    """
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+def benchmark_command(args, config: dict) -> list[str]:
+    """
+    Command line of `benchmark.py` for a config. Options are passed as flags,
+    True as a bare flag, False and None are left out, lists as several values and dicts as python literals.
+    """
+    command = [format_option(args.python, config), os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.py")]
+    for key, value in config.items():
+        if key == "zarr_format" or value is None or value is False: continue
+        command.append(f"--{key}")
+        if value is True: continue
+        if isinstance(value, list): command.extend(str(v) for v in value)
+        # dicts as python literals, the benchmark evaluates them (e.g. --dataloader_kwargs)
+        elif isinstance(value, dict): command.append(repr(value))
+        else: command.append(str(value))
+    command += ["--experiment_dir", args.experiment_dir, "--run_name", config_id(config)]
+    return command
+
+class ResultsDB(object):
+    """
+    SQLite table of the runs of all sweeps: one row per config, with its options (as
+    `opt_<name>` columns and as json) and its metrics as columns. The `opt_<name>` columns hold
+    the options as written in the grid (`options`, e.g. unformatted dataset paths), so an option
+    derived from another one does not split the rows of the report.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs (config_id TEXT PRIMARY KEY, sweep TEXT, status TEXT, run_dir TEXT, created TEXT, config TEXT, summary TEXT)"
+        )
+        for column in METRICS.values():
+            self._add_column(column, "REAL")
+
+    def _columns(self) -> list[str]:
+        return [row[1] for row in self.connection.execute("PRAGMA table_info(runs)")]
+
+    def _add_column(self, column: str, kind: str):
+        if not column in self._columns():
+            self.connection.execute(f'ALTER TABLE runs ADD COLUMN "{column}" {kind}')
+
+    def has(self, config_id: str) -> bool:
+        row = self.connection.execute("SELECT status FROM runs WHERE config_id = ?", (config_id,)).fetchone()
+        return row is not None and row[0] == "ok"
+
+    def insert(self, sweep: str, config: dict, run_dir: str, status: str, summary: dict=None, options: dict=None):
+        row = {
+            "config_id": config_id(config),
+            "sweep": sweep,
+            "status": status,
+            "run_dir": run_dir,
+            "created": datetime.now().isoformat(),
+            "config": json.dumps(config, default=str),
+            "summary": json.dumps(summary, default=str) if summary is not None else None,
+        }
+        for key, value in (options if options is not None else config).items():
+            self._add_column(f"opt_{key}", "TEXT")
+            row[f"opt_{key}"] = json.dumps(value) if isinstance(value, (list, dict)) else value
+        for key, column in METRICS.items():
+            value = summary
+            for part in key.split("."):
+                value = value.get(part) if isinstance(value, dict) else None
+            row[column] = value
+        columns = ", ".join(f'"{column}"' for column in row)
+        self.connection.execute(f"INSERT OR REPLACE INTO runs ({columns}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
+        self.connection.commit()
+
+    def dataframe(self) -> pd.DataFrame:
+        return pd.read_sql("SELECT * FROM runs", self.connection)
+
+def read_summary(run_dir: str) -> dict:
+    """
+    Summary of a finished run (without the per-batch times), None if it did not finish.
+    """
+    summary = None
+    for name in ["times_summary.yaml", "distributed_summary.yaml"]:
+        path = os.path.join(run_dir, name)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                summary = {**(summary or {}), **yaml.safe_load(f)}
+    if summary is None: return None
+    return {key: value for key, value in summary.items() if not key in ["times", "ranks", "comparison"]}
+
+def run_config(args, config: dict) -> tuple:
+    run_dir = os.path.join(args.experiment_dir, config_id(config))
+    os.makedirs(run_dir, exist_ok=True)
+    command = benchmark_command(args, config)
+    t0 = time.time()
+    with open(os.path.join(run_dir, "run.log"), "w") as log:
+        log.write(shlex.join(command) + "\n")
+        log.flush()
+        process = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+    return config, run_dir, process.returncode, time.time() - t0
+
+def run_local(args, configs: list[dict], db: ResultsDB):
+    logger.info(f"Running {len(configs)} configs with {args.sweep_workers} concurrent runs")
+    with ThreadPoolExecutor(args.sweep_workers) as pool:
+        futures = [pool.submit(run_config, args, config) for config in configs]
+        for n, future in enumerate(as_completed(futures)):
+            config, run_dir, returncode, elapsed = future.result()
+            summary = read_summary(run_dir) if returncode == 0 else None
+            status = "ok" if summary is not None else "failed"
+            db.insert(args.sweep_name, config, run_dir, status, summary, options=args.options[config_id(config)])
+            logger.info(f"[{n+1}/{len(configs)}] {config_id(config)} {status} in {elapsed:.1f}s" + (f", see {run_dir}/run.log" if status == "failed" else ""))
+
+def write_slurm(args, configs: list[dict]) -> str:
+    """
+    Write an array job running one config per task, returns the path of the job script.
+    """
+    commands_path = os.path.join(args.experiment_dir, "commands.txt")
+    with open(commands_path, "w") as f:
+        for config in configs:
+            f.write(shlex.join(benchmark_command(args, config)) + "\n")
+    logs_dir = os.path.join(args.experiment_dir, "logs")
+    os.makedirs(logs_dir, exist_ok=True)
+    script_path = os.path.join(args.experiment_dir, "sweep.sbatch")
+    with open(script_path, "w") as f:
+        f.write("#!/bin/bash\n")
+        f.write(f"#SBATCH --job-name=sweep-{args.sweep_name}\n")
+        f.write(f"#SBATCH --array=0-{len(configs)-1}\n")
+        f.write(f"#SBATCH --output={logs_dir}/%A_%a.out\n")
+        f.write(f"#SBATCH --error={logs_dir}/%A_%a.out\n")
+        for option in shlex.split(args.slurm_options):
+            f.write(f"#SBATCH {option}\n")
+        f.write(f'\nsed -n "$((SLURM_ARRAY_TASK_ID+1))p" {commands_path} | bash\n')
+    return script_path
+
+def ingest(args, configs: list[dict], db: ResultsDB) -> int:
+    """
+    Add the finished runs of the configs to the results database, returns their number.
+    """
+    num_ingested = 0
+    for config in configs:
+        run_dir = os.path.join(args.experiment_dir, config_id(config))
+        summary = read_summary(run_dir)
+        if summary is not None and not db.has(config_id(config)):
+            db.insert(args.sweep_name, config, run_dir, "ok", summary, options=args.options[config_id(config)])
+            num_ingested += 1
+    return num_ingested
+
+def report(args, db: ResultsDB) -> str:
+    """
+    Markdown table of the metric of the successful runs, grouped by the given (or varying) options.
+    """
+    df = db.dataframe()
+    if args.grid is not None:
+        df = df[df["sweep"] == args.sweep_name]
+    df = df[df["status"] == "ok"]
+    assert len(df) > 0, f"No results in {args.results_db}"
+    assert args.metric in df.columns, f"Unknown metric {args.metric}, one of {list(METRICS.values())}"
+    options = [column for column in df.columns if column.startswith("opt_")]
+    if args.group_by is not None:
+        group_by = [f"opt_{option}" for option in args.group_by]
+    else:
+        group_by = [column for column in options if df[column].astype(str).nunique() > 1 and column != f"opt_{args.compare}"]
+    df[options] = df[options].astype(str)
+
+    if args.compare is not None:
+        table = df.pivot_table(index=group_by or None, columns=f"opt_{args.compare}", values=args.metric, aggfunc="mean")
+    else:
+        table = df.groupby(group_by)[args.metric].agg(["mean", "count"]) if len(group_by) > 0 else df[[args.metric]]
+        table = table.sort_values(table.columns[0], ascending=False)
+        table["relative"] = table[table.columns[0]] / table[table.columns[0]].max()
+    table = table.rename_axis(index=[name.removeprefix("opt_") for name in table.index.names])
+    return to_markdown(table)
+
+def main():
+    args = get_args()
+    db = ResultsDB(args.results_db)
+
+    if args.command == "report":
+        table = report(args, db)
+        logger.info(f"{args.metric}:\n{table}")
+        with open(os.path.join(args.experiment_dir, f"report-{args.metric}.md"), "w") as f:
+            f.write(table + "\n")
+        return
+
+    configs = grid_configs(args.sweep)
+    args.options = {config_id(config): options for config, options in zip(configs, grid_configs(args.sweep, formatted=False))}
+    with open(os.path.join(args.experiment_dir, "grid.yaml"), "w") as f:
+        yaml.dump(args.sweep, f)
+    num_ingested = ingest(args, configs, db)
+    missing = [config for config in configs if not db.has(config_id(config))]
+    logger.info(f"Sweep {args.sweep_name}: {len(configs)} configs, {len(configs)-len(missing)} already measured ({num_ingested} newly ingested), {len(missing)} to run")
+
+    if args.command == "run" and len(missing) > 0:
+        run_local(args, missing, db)
+    elif args.command == "slurm" and len(missing) > 0:
+        script_path = write_slurm(args, missing)
+        logger.info(f"Wrote an array job of {len(missing)} configs, submit it with: sbatch {script_path}")
+        logger.info(f"Then add the results to the database with: python src/sweep.py ingest --grid {args.grid}")
+
+if __name__ == "__main__":
+    main()
+    logger.info("Finished sweep")
@@ -0,0 +1,160 @@
+import xarray as xr
+import pandas as pd
+import numpy as np
+import dask.array
+import argparse
+import logging
+import zarr
+
+from write import write_zarr, parse_codec
+from args import Arguments
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(formatter)
+logger.addHandler(console_handler)
+
+# Fields of the ERA5 variables: surface or on pressure levels, mean, term proportional to sin(latitude)**2, amplitude
+# of a wave travelling eastwards and standard deviation of the noise, all scaled by a vertical profile of the level (hPa)
+FIELDS = {
+    "2m_temperature": dict(surface=True, mean=288., lat=-40., wave=5., noise=1.),
+    "mean_sea_level_pressure": dict(surface=True, mean=101325., lat=-1500., wave=800., noise=100.),
+    "10m_u_component_of_wind": dict(surface=True, mean=0., lat=5., wave=4., noise=2.),
+    "10m_v_component_of_wind": dict(surface=True, mean=0., lat=0., wave=4., noise=2.),
+    "temperature": dict(surface=False, mean=288., profile=lambda p: (p / 1000) ** 0.19, lat=-40., wave=3., noise=1.),
+    "specific_humidity": dict(surface=False, mean=0.012, profile=lambda p: (p / 1000) ** 3, lat=-0.008, wave=0.001, noise=0.0003),
+    "u_component_of_wind": dict(surface=False, mean=10., lat=10., wave=8., noise=3.),
+    "v_component_of_wind": dict(surface=False, mean=0., lat=0., wave=8., noise=3.),
+    "geopotential": dict(surface=False, mean=9.81 * 7300, profile=lambda p: np.log(1013 / p), lat=-2000., wave=500., noise=50.),
+}
+# variables that are not ERA5 variables are generated as standard normal fields on pressure levels
+DEFAULT_FIELD = dict(surface=False, mean=0., lat=0., wave=1., noise=1.)
+
+def synthetic_dataset(
+    num_timesteps: int=32,
+    grid: tuple=(240, 121),
+    date_start: str="2020-01-01",
+    time_step: str="6h",
+    variables: list[str]=list(FIELDS),
+    levels: list[int]=Arguments.LEVELS.kwargs["default"],
+    seed: int=0,
+) -> xr.Dataset:
+    """
+    Lazy ERA5-like dataset with the dimensions and coordinates of the WeatherBench2 stores.
+
+    `grid` is (longitude, latitude), with latitudes from pole to pole (equiangular with poles,
+    e.g. 240x121 or 1440x721). Variables are float32 dask arrays of (time, [level], latitude, longitude)
+    chunked by timestep: a latitude-dependent mean, a travelling wave and gaussian noise, so the
+    values are smooth and compress like weather fields rather than like noise. The noise only depends
+    on `seed` and the shape, not on the chunking of the output.
+    """
+    assert num_timesteps > 0, "num_timesteps must be positive"
+    num_lon, num_lat = grid
+    time = pd.date_range(date_start, periods=num_timesteps, freq=time_step)
+    latitude = np.linspace(-90., 90., num_lat)
+    longitude = np.arange(num_lon) * 360. / num_lon
+    level = np.array(levels, dtype=np.int64)
+
+    # eastward wave of wavenumber 3, one revolution every 10 days
+    days = (time - time[0]) / pd.Timedelta(days=1)
+    wave = xr.DataArray(np.cos(3 * np.deg2rad(longitude)[None, :] - 2 * np.pi * np.asarray(days)[:, None] / 10), dims=["time", "longitude"])
+    sin2 = xr.DataArray(np.sin(np.deg2rad(latitude)) ** 2, dims=["latitude"])
+
+    rng = dask.array.random.default_rng(seed)
+    data_vars = {}
+    for var in variables:
+        field = FIELDS.get(var, DEFAULT_FIELD)
+        if field["surface"]:
+            dims, shape, chunks = ["time", "latitude", "longitude"], (num_timesteps, num_lat, num_lon), (1, num_lat, num_lon)
+            profile = 1.
+        else:
+            dims, shape, chunks = ["time", "level", "latitude", "longitude"], (num_timesteps, len(level), num_lat, num_lon), (1, len(level), num_lat, num_lon)
+            profile = xr.DataArray(field.get("profile", lambda p: np.ones_like(p, dtype=np.float64))(level.astype(np.float64)), dims=["level"])
+        noise = xr.DataArray(rng.standard_normal(shape, chunks=chunks, dtype=np.float32), dims=dims)
+        values = profile * (field["mean"] + field["lat"] * sin2 + field["wave"] * wave + field["noise"] * noise)
+        data_vars[var] = values.transpose(*dims).astype(np.float32)
+
+    return xr.Dataset(data_vars, coords={"time": time, "level": level, "latitude": latitude, "longitude": longitude})
+
+def get_args():
+    logger.info("Parsing arguments")
+    parser = argparse.ArgumentParser(description="Write a synthetic ERA5-like zarr dataset")
+
+    parser.add_argument(Arguments.OUTPUT.flag, **Arguments.OUTPUT.kwargs)
+    parser.add_argument(Arguments.RESOLUTION.flag, **Arguments.RESOLUTION.kwargs)
+    parser.add_argument(Arguments.NUM_TIMESTEPS.flag, **Arguments.NUM_TIMESTEPS.kwargs)
+    parser.add_argument(Arguments.DATE_START_BENCHMARK.flag, **Arguments.DATE_START_BENCHMARK.kwargs)
+    parser.add_argument(Arguments.TIME_STEP.flag, **Arguments.TIME_STEP.kwargs)
+    parser.add_argument(Arguments.SEED.flag, **Arguments.SEED.kwargs)
+    parser.add_argument(Arguments.VARIABLES.flag, **Arguments.VARIABLES.kwargs)
+    parser.add_argument(Arguments.LEVELS.flag, **Arguments.LEVELS.kwargs)
+    parser.add_argument(Arguments.CHUNKS_WRITE_STRATEGY.flag, **Arguments.CHUNKS_WRITE_STRATEGY.kwargs)
+    parser.add_argument(Arguments.SHARD_SHAPE.flag, **Arguments.SHARD_SHAPE.kwargs)
+    parser.add_argument(Arguments.COMPRESS_VARS.flag, **Arguments.COMPRESS_VARS.kwargs)
+    parser.add_argument(Arguments.COMPRESS_COORDS.flag, **Arguments.COMPRESS_COORDS.kwargs)
+    parser.add_argument(Arguments.CODEC.flag, **Arguments.CODEC.kwargs)
+    parser.add_argument(Arguments.VAR_CODECS.flag, **Arguments.VAR_CODECS.kwargs)
+
+    # parse arguments
+    args = parser.parse_args()
+
+    try: args.chunks_write_strategy = eval(args.chunks_write_strategy)
+    except Exception as e: pass
+    logger.info(f"Parsed chunks write strategy: {args.chunks_write_strategy}")
+
+    args.resolution = tuple(int(n) for n in args.resolution.split("x"))
+    args.var_codecs = dict(args.var_codecs)
+    for codec in [args.codec, *args.var_codecs.values()]:
+        if codec is not None: parse_codec(codec)
+
+    args.zarr_version = zarr.__version__
+    if args.zarr_version.startswith("2."):
+        logger.info("Zarr version 2.x detected")
+        args.zarr_format = 2
+    elif args.zarr_version.startswith("3."):
+        logger.info("Zarr version 3.x detected")
+        args.zarr_format = 3
+    else:
+        raise ValueError(f"Unknown Zarr version: {args.zarr_version}")
+
+    if args.shard_shape is not None and args.zarr_format != 3:
+        raise ValueError("--shard_shape requires zarr v3")
+
+    if args.output.endswith("/"):
+        args.output = args.output[:-1]
+    args.output = f"{args.output}-v{args.zarr_format}"
+
+    return args
+
+def main():
+    args = get_args()
+
+    ds = synthetic_dataset(
+        num_timesteps=args.num_timesteps,
+        grid=args.resolution,
+        date_start=args.date_start,
+        time_step=args.time_step,
+        variables=args.variables,
+        levels=args.levels,
+        seed=args.seed,
+    )
+    logger.info(f"Generated synthetic dataset with sizes {dict(ds.sizes)} ({ds.nbytes/1024**2:.1f}MB)")
+    write_zarr(
+        ds,
+        path=args.output,
+        exist_ok=True,
+        new_chunks=args.chunks_write_strategy,
+        compress_vars=args.compress_vars,
+        compress_coords=args.compress_coords,
+        shards=args.shard_shape,
+        codec=args.codec,
+        var_codecs=args.var_codecs,
+    )
+
+if __name__ == "__main__":
+    main()
+    logger.info("Finished writing synthetic dataset")
@@ -1,21 +1,181 @@
 import xarray as xr
+import pandas as pd
+import numpy as np
+import torch
+import zarr
+import threading
 import logging
+import os
+
+from torch.utils.data import get_worker_info
 
 logger = logging.getLogger(__name__)
 
-def load_dataset(args, force_zarr_format):
-    if force_zarr_format: ds = xr.open_zarr(args.dataset, chunks=args.chunks_open_strategy, zarr_format=args.zarr_format)
-    else: ds = xr.open_zarr(args.dataset, chunks=args.chunks_open_strategy)
+def load_dataset(args, force_zarr_format, store=None, dataarray=None, as_dataarray=False):
+    # `store` (e.g. a CachingStore) replaces the path of the dataset
+    # `dataarray` (e.g. from a SampleIndex) skips opening the store as a dataset to detect the layout
+    # `as_dataarray` returns the stacked array of a dataarray layout (time selected only, for BaseDataset)
+    source = store if store is not None else args.dataset
+    if not dataarray:
+        if force_zarr_format: ds = xr.open_zarr(source, chunks=args.chunks_open_strategy, zarr_format=args.zarr_format)
+        else: ds = xr.open_zarr(source, chunks=args.chunks_open_strategy)
         
     # deal with the case where ds is actally a dataarray with a 'variable' dimension
-    if 'variable' in ds.coords:
+    if dataarray or (dataarray is None and 'variable' in ds.coords):
         logger.info(f"{args.dataset} is a dataarray. Reading as such...")
-        if force_zarr_format: da = xr.open_dataarray(args.dataset, engine='zarr', chunks=args.chunks_open_strategy, zarr_format=args.zarr_format)
-        else: da = xr.open_dataarray(args.dataset, engine='zarr', chunks=args.chunks_open_strategy)
+        if force_zarr_format: da = xr.open_dataarray(source, engine='zarr', chunks=args.chunks_open_strategy, zarr_format=args.zarr_format)
+        else: da = xr.open_dataarray(source, engine='zarr', chunks=args.chunks_open_strategy)
+        if as_dataarray:
+            da = da.sel(time=slice(args.date_range[0], args.date_range[1]))
+            logger.info(f"Loaded stacked dataarray with sizes: {da.sizes}")
+            return da
         ds = da.to_dataset(dim='variable')
         
     ds = ds.sel(time=slice(args.date_range[0], args.date_range[1]))
     ds = ds[args.variables].sel(level=args.levels)
     logger.info(f"Loaded dataset with sizes: {ds.sizes}")
     
-    return ds
\ No newline at end of file
+    return ds
+
+class WorkerCounters(object):
+    """
+    Named integer counters shared between the main process and the dataloader workers.
+    
+    Counters live in a shared memory tensor with one row per process (row 0 is the main 
+    process, row k+1 is worker k), so workers never write to the same slot and no lock
+    is needed between processes. A thread lock protects a row from concurrent threads of
+    the same process. Totals are read from the main process.
+    """
+    def __init__(self, names: list[str], num_workers: int=0):
+        assert isinstance(num_workers, int) and num_workers >= 0, "num_workers must be a non-negative integer"
+        self.names = list(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._values = torch.zeros(num_workers + 1, len(self.names), dtype=torch.int64).share_memory_()
+        self._lock = threading.Lock()
+        
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        
+    def _row(self):
+        info = get_worker_info()
+        row = 0 if info is None else info.id + 1
+        assert row < self._values.shape[0], f"WorkerCounters was created for {self._values.shape[0]-1} workers"
+        return row
+        
+    def add(self, name: str, value: int=1):
+        row, column = self._row(), self._index[name]
+        with self._lock:
+            self._values[row, column] += value
+            
+    def reset(self):
+        self._values.zero_()
+        
+    def totals(self) -> dict:
+        return {name: int(value) for name, value in zip(self.names, self._values.sum(dim=0).tolist())}
+
+
+def process_tree_rss(pid: int=None) -> int:
+    """
+    Resident bytes of a process (this one by default) and of all its descendants, e.g. the dataloader workers.
+    Pages shared between the processes are counted once per process (Linux only, 0 elsewhere).
+    """
+    pid = pid if pid is not None else os.getpid()
+    nbytes, pids = 0, [pid]
+    while len(pids) > 0:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                nbytes += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children", "r") as f:
+                    pids += [int(child) for child in f.read().split()]
+        except (FileNotFoundError, ProcessLookupError):
+            # the process exited, or no /proc
+            continue
+    return nbytes
+
+def zarr_dims(arr) -> tuple[str]:
+    """
+    Dimension names of a zarr array written by xarray.
+    """
+    dims = arr.attrs.get("_ARRAY_DIMENSIONS") # zarr v2
+    if dims is None: dims = arr.metadata.dimension_names # zarr v3
+    return tuple(dims)
+
+def chunk_files(path: str, name: str=None) -> list[str]:
+    """
+    Object files (chunks or shards) of array `name`, or of all arrays, in a local zarr store.
+    """
+    paths = []
+    for root, _, files in os.walk(os.path.join(path, name) if name is not None else path):
+        for file in files:
+            if file in ["zarr.json", ".zarray", ".zattrs", ".zgroup", ".zmetadata"]: continue
+            paths.append(os.path.join(root, file))
+    return paths
+
+def stored_chunk_bytes(path: str, name: str) -> float:
+    """
+    Average stored (compressed) size of the objects (chunks or shards) of array `name` in a local zarr store.
+    """
+    files = chunk_files(path, name)
+    return sum(os.path.getsize(file) for file in files) / len(files) if len(files) > 0 else 0.
+
+def chunk_footprint(path: str, variables: list[str], levels: list[int], sample_timesteps: int) -> dict:
+    """
+    Average number of chunks, of stored objects (shards, or chunks without sharding) and of 
+    stored bytes read for one sample of `sample_timesteps` timesteps from a local zarr store, 
+    written as a dataset or as a dataarray with a 'variable' dimension. The time dimension is 
+    averaged over the alignment of the sample with the time chunks.
+    """
+    group = zarr.open_group(path, mode="r")
+    store_levels = [int(level) for level in group["level"][:]]
+    selected = {"level": [store_levels.index(level) for level in levels]}
+    
+    if "__xarray_dataarray_variable__" in group:
+        store_variables = [str(var) for var in group["variable"][:]]
+        selected["variable"] = [store_variables.index(var) for var in variables]
+        names = ["__xarray_dataarray_variable__"]
+    else:
+        names = variables
+    
+    def num_touched(arr, block_shape):
+        num = 1.
+        for dim, size, block in zip(zarr_dims(arr), arr.shape, block_shape):
+            if dim == "time":
+                num *= np.mean([(s+sample_timesteps-1)//block - s//block + 1 for s in range(block)])
+            elif dim in selected:
+                num *= len({index // block for index in selected[dim]})
+            else:
+                num *= -(-size // block)
+        return num
+    
+    chunks_per_sample, objects_per_sample, bytes_per_sample = 0., 0., 0.
+    for name in names:
+        arr = group[name]
+        shards = getattr(arr, "shards", None) # zarr v3 only
+        num_chunks = num_touched(arr, arr.chunks)
+        chunks_per_sample += num_chunks
+        objects_per_sample += num_touched(arr, shards) if shards is not None else num_chunks
+        chunks_per_object = np.prod([shard // chunk for shard, chunk in zip(shards, arr.chunks)]) if shards is not None else 1
+        bytes_per_sample += num_chunks * stored_chunk_bytes(path, name) / chunks_per_object
+    
+    return {
+        "chunks_per_sample": float(chunks_per_sample), 
+        "objects_per_sample": float(objects_per_sample), 
+        "bytes_per_sample": float(bytes_per_sample),
+    }
+
+def to_markdown(table: pd.DataFrame) -> str:
+    table = table.reset_index()
+    format_value = lambda value: f"{value:.4g}" if isinstance(value, float) else str(value)
+    lines = ["| " + " | ".join(str(column) for column in table.columns) + " |"]
+    lines.append("|" + "|".join("---" for _ in table.columns) + "|")
+    for row in table.itertuples(index=False):
+        lines.append("| " + " | ".join(format_value(value) for value in row) + " |")
+    return "\n".join(lines)
@@ -1,50 +1,132 @@
 import xarray as xr
+import numpy as np
+import numcodecs
 import os, shutil
+import math
+import time
+import resource
+import yaml
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import zarr
 import logging
 
+from dataset import BaseDataset, MemmapDataset
+
 # see https://github.com/pydata/xarray/issues/10032
 zarr_version = zarr.__version__
 zarr_format = int(zarr_version[0])
 if zarr_format == 2:
     from numcodecs import Blosc as BloscCompressor
+    from numcodecs import Zstd as ZstdCompressor
+    from numcodecs import BitRound, FixedScaleOffset
 elif zarr_format == 3:
     from zarr.codecs import BloscCodec as BloscCompressor
+    from zarr.codecs import ZstdCodec as ZstdCompressor
+    from numcodecs.zarr3 import BitRound, FixedScaleOffset
 else:
     raise ValueError(f"Unknown Zarr version: {zarr_version}")
 
 logger = logging.getLogger()
 
-def get_compressor():
-    if zarr_format == 2:
-        compressor_key = "compressor"
-        compressor = BloscCompressor(cname="zstd", clevel=3, shuffle=2)
-    elif zarr_format == 3:
-        compressor_key = "compressors"
-        compressor = BloscCompressor(cname="zstd", clevel=3, shuffle="bitshuffle")
+DEFAULT_CODEC = "blosc-zstd-3-bitshuffle"
+BLOSC_SHUFFLES = {"noshuffle": 0, "shuffle": 1, "bitshuffle": 2}
+
+def parse_codec(spec: str) -> dict:
+    """
+    Parse a codec spec of the form '<compressor>[+<filter>...]'.
+
+    Compressors:
+        none: no compression
+        zstd-<level>: plain zstd
+        blosc-<cname>-<clevel>[-<shuffle>]: blosc with cname in lz4, lz4hc, zstd, blosclz, zlib
+            and shuffle in noshuffle, shuffle, bitshuffle (default: bitshuffle)
+    Filters (lossy):
+        bitround-<keepbits>: keep `keepbits` mantissa bits
+        fso-<scale>[-<astype>]: FixedScaleOffset with offset 0, stores round(x*scale) as astype (default: i4)
+
+    Returns:
+        {"compressor": (name, kwargs) or None, "filters": [(name, kwargs), ...]}
+    """
+    compressor, *filters = spec.split("+")
+    name, *params = compressor.split("-")
+    if name == "none" and len(params) == 0:
+        parsed = {"compressor": None}
+    elif name == "zstd" and len(params) == 1:
+        parsed = {"compressor": ("zstd", {"level": int(params[0])})}
+    elif name == "blosc" and len(params) in [2, 3]:
+        shuffle = params[2] if len(params) == 3 else "bitshuffle"
+        if not shuffle in BLOSC_SHUFFLES:
+            raise ValueError(f"Invalid blosc shuffle {shuffle} in codec {spec}")
+        parsed = {"compressor": ("blosc", {"cname": params[0], "clevel": int(params[1]), "shuffle": shuffle})}
     else:
-        raise ValueError(f"Unknown Zarr version: {zarr_version}")
-    return compressor_key, compressor
+        raise ValueError(f"Invalid compressor {compressor} in codec {spec}")
 
-def write_zarr(
-    ds: xr.Dataset|xr.DataArray, 
-    path: str, 
-    exist_ok: bool=False, 
-    new_chunks: dict=None, 
-    compress_vars: bool=False,
-    compress_coords: bool=False
-):
+    parsed["filters"] = []
+    for f in filters:
+        name, *params = f.split("-")
+        if name == "bitround" and len(params) == 1:
+            parsed["filters"].append(("bitround", {"keepbits": int(params[0])}))
+        elif name == "fso" and len(params) in [1, 2]:
+            astype = params[1] if len(params) == 2 else "i4"
+            parsed["filters"].append(("fso", {"scale": float(params[0]), "astype": astype}))
+        else:
+            raise ValueError(f"Invalid filter {f} in codec {spec}")
+    return parsed
+
+def get_numcodecs(spec: str, dtype="f4") -> tuple:
     """
-    Write a dataset to a zarr file.
-    
-    Args:
-        ds: xarray.Dataset
-            The dataset to write.
-        path: str
-            The path to write the dataset to.
-        exist_ok: bool
-            Whether to overwrite the file if it already exists
+    numcodecs (compressor or None, filters) of a codec spec, independent of the zarr version.
     """
+    parsed = parse_codec(spec)
+    compressor = None
+    if parsed["compressor"] is not None:
+        name, kwargs = parsed["compressor"]
+        if name == "zstd":
+            compressor = numcodecs.Zstd(level=kwargs["level"])
+        else:
+            compressor = numcodecs.Blosc(cname=kwargs["cname"], clevel=kwargs["clevel"], shuffle=BLOSC_SHUFFLES[kwargs["shuffle"]])
+    filters = []
+    for name, kwargs in parsed["filters"]:
+        if name == "bitround":
+            filters.append(numcodecs.BitRound(keepbits=kwargs["keepbits"]))
+        else:
+            filters.append(numcodecs.FixedScaleOffset(offset=0, scale=kwargs["scale"], dtype=np.dtype(dtype).str, astype=np.dtype(kwargs["astype"]).str))
+    return compressor, filters
+
+def get_codec_encoding(spec: str, dtype="f4") -> dict:
+    """
+    Zarr encoding (compressor and filters) of a codec spec for the installed zarr version.
+    """
+    parsed = parse_codec(spec)
+    compressor = None
+    if parsed["compressor"] is not None:
+        name, kwargs = parsed["compressor"]
+        if name == "zstd":
+            compressor = ZstdCompressor(level=kwargs["level"])
+        elif zarr_format == 2:
+            compressor = BloscCompressor(cname=kwargs["cname"], clevel=kwargs["clevel"], shuffle=BLOSC_SHUFFLES[kwargs["shuffle"]])
+        else:
+            compressor = BloscCompressor(cname=kwargs["cname"], clevel=kwargs["clevel"], shuffle=kwargs["shuffle"])
+    filters = []
+    for name, kwargs in parsed["filters"]:
+        if name == "bitround":
+            filters.append(BitRound(keepbits=kwargs["keepbits"]))
+        else:
+            filters.append(FixedScaleOffset(offset=0, scale=kwargs["scale"], dtype=np.dtype(dtype).str, astype=np.dtype(kwargs["astype"]).str))
+    filters = filters if len(filters) > 0 else None
+
+    if zarr_format == 2:
+        return {"compressor": compressor, "filters": filters}
+    return {"compressors": compressor, "filters": filters}
+
+def get_compressor():
+    compressor_key = "compressor" if zarr_format == 2 else "compressors"
+    compressor = get_codec_encoding(DEFAULT_CODEC)[compressor_key]
+    return compressor_key, compressor
+
+def _prepare_path(path: str, exist_ok: bool) -> str:
     path = os.path.abspath(path)
     
     if os.path.exists(path):
@@ -55,18 +137,36 @@ def write_zarr(
         
     if not os.path.exists(os.path.dirname(path)):
         os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def _prepare_write(
+    ds: xr.Dataset|xr.DataArray, 
+    new_chunks: dict=None, 
+    compress_vars: bool=False,
+    compress_coords: bool=False,
+    shards: dict=None,
+    codec: str=None,
+    var_codecs: dict=None,
+) -> tuple:
+    """
+    Rechunk `ds` and build its zarr encoding, returns (ds, encoding, new_chunks, shards).
+    """
+    new_chunks = dict(new_chunks) if new_chunks is not None else None
     
     # get default compressor
     if compress_vars or compress_coords:
         compressor_key, compressor = get_compressor()
         
     # convert to dataarray if new_chunks has 1 more dimension
-    if len(new_chunks) == len(ds.sizes)+1:
+    if new_chunks is not None and len(new_chunks) == len(ds.sizes)+1:
         logger.info(f"Converting dataset to dataarray with new dimension {list(new_chunks.keys())[0]}")
         dims = list(ds.sizes.keys())
+        # surface variables are broadcast over the levels, record them for the readers
+        surface_variables = [var for var in ds.data_vars if "level" in ds.dims and not "level" in ds[var].dims]
         ds = ds.to_array(dim="variable", name="variable").transpose(*dims, "variable")
+        ds.attrs["surface_variables"] = surface_variables
         # rename the chunk to 'variable'
-        for d in new_chunks:
+        for d in list(new_chunks):
             if not d in dims:
                 value = new_chunks.pop(d)
                 new_chunks["variable"] = value
@@ -74,8 +174,21 @@ def write_zarr(
     # reformat chunks if needed
     if new_chunks is not None:
         for d, chunk in new_chunks.items():
-            if chunk == -1:
+            if chunk == -1 or chunk > ds.sizes[d]:
                 new_chunks[d] = ds.sizes[d]
+        
+    # dask chunks must not overlap several shards, so rechunk to the shard shape
+    if shards is not None:
+        if zarr_format != 3:
+            raise ValueError("Sharding requires zarr v3")
+        assert new_chunks is not None, "Sharding requires new_chunks"
+        shards = {d: ds.sizes[d] if shards.get(d) == -1 else shards.get(d, chunk) for d, chunk in new_chunks.items()}
+        for d, shard in shards.items():
+            if shard % new_chunks[d] != 0 and shard != ds.sizes[d]:
+                raise ValueError(f"Shard size {shard} of {d} is not a multiple of its chunk size {new_chunks[d]}")
+        logger.info(f"Rechunking to shards: {shards} (chunks: {new_chunks})")
+        ds = ds.chunk(shards)
+    elif new_chunks is not None:
         logger.info(f"Rechunking to: {new_chunks}")
         ds = ds.chunk(new_chunks)
 
@@ -88,9 +201,24 @@ def write_zarr(
             var_encoding = {}
             if new_chunks is not None:
                 var_encoding["chunks"] = tuple(new_chunks[dim] for dim in ds[var].sizes)
+            if shards is not None:
+                var_encoding["shards"] = tuple(shards[dim] for dim in ds[var].sizes)
             if compress_vars:
                 var_encoding[compressor_key] = compressor
+            var_codec = (var_codecs or {}).get(var, codec)
+            if var_codec is not None:
+                var_encoding.update(get_codec_encoding(var_codec, ds[var].dtype))
             encoding[var] = var_encoding
+    elif shards is not None or codec is not None:
+        # xarray writes a dataarray named like one of its coordinates as DATAARRAY_VARIABLE
+        var = "__xarray_dataarray_variable__" if ds.name in ds.coords else ds.name
+        encoding[var] = {}
+        if new_chunks is not None:
+            encoding[var]["chunks"] = tuple(new_chunks[dim] for dim in ds.dims)
+        if shards is not None:
+            encoding[var]["shards"] = tuple(shards[dim] for dim in ds.dims)
+        if codec is not None:
+            encoding[var].update(get_codec_encoding(codec, ds.dtype))
         
     # set encoding for each coordinate
     for coord in ds.coords:
@@ -98,6 +226,41 @@ def write_zarr(
         if compress_coords:
             coord_encoding[compressor_key] = compressor
         encoding[coord] = coord_encoding
+    
+    return ds, encoding, new_chunks, shards
+
+def write_zarr(
+    ds: xr.Dataset|xr.DataArray, 
+    path: str, 
+    exist_ok: bool=False, 
+    new_chunks: dict=None, 
+    compress_vars: bool=False,
+    compress_coords: bool=False,
+    shards: dict=None,
+    codec: str=None,
+    var_codecs: dict=None,
+):
+    """
+    Write a dataset to a zarr file.
+    
+    Args:
+        ds: xarray.Dataset
+            The dataset to write.
+        path: str
+            The path to write the dataset to.
+        exist_ok: bool
+            Whether to overwrite the file if it already exists
+        shards: dict
+            Shard shape per dimension (zarr v3 only), dimensions not given default to 
+            the chunk size and -1 to the full dimension. Each shard packs several 
+            chunks in a single object.
+        codec: str
+            Codec spec (see `parse_codec`) of all variables, overrides compress_vars.
+        var_codecs: dict
+            Codec spec per variable, overrides codec.
+    """
+    path = _prepare_path(path, exist_ok)
+    ds, encoding, _, _ = _prepare_write(ds, new_chunks, compress_vars, compress_coords, shards, codec, var_codecs)
         
     # set encoding for each attribute
     logger.info(f"Writing dataset to {path}")
@@ -106,4 +269,284 @@ def write_zarr(
         mode="w", 
         encoding=encoding,
         zarr_format=zarr_format,
-    )
\ No newline at end of file
+    )
+
+def _write_region(ds: xr.Dataset|xr.DataArray, path: str, start: int, stop: int) -> int:
+    """
+    Write timesteps [start, stop) of `ds` into the initialized store at `path`, returns the bytes written.
+    """
+    region = ds.isel(time=slice(start, stop))
+    # variables without a time dimension were written when the store was initialized
+    region = region.drop_vars([name for name in region.coords if not "time" in region[name].dims])
+    if isinstance(region, xr.Dataset):
+        region = region.drop_vars([name for name in region.data_vars if not "time" in region[name].dims])
+    # the pool provides the parallelism, so each region is computed by its own worker
+    region.to_zarr(path, region={"time": slice(start, stop)}, zarr_format=zarr_format, compute=False).compute(scheduler="synchronous")
+    return region.nbytes
+
+def _write_manifest(manifest_path: str, manifest: dict):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        yaml.dump(manifest, f, sort_keys=False)
+    os.replace(tmp_path, manifest_path)
+
+def _coords_digest(ds: xr.Dataset|xr.DataArray) -> dict:
+    """
+    Digest of the values of each dimension coordinate, so a resumed write checks the levels, grid and variables it writes.
+    """
+    digest = {}
+    for name in sorted(ds.indexes):
+        values = np.asarray(ds.indexes[name])
+        data = values.tobytes() if values.dtype.kind in "biufcmM" else "\0".join(str(value) for value in values).encode()
+        digest[name] = hashlib.sha1(data).hexdigest()
+    return digest
+
+def write_zarr_regions(
+    ds: xr.Dataset|xr.DataArray, 
+    path: str, 
+    region_timesteps: int,
+    new_chunks: dict=None, 
+    compress_vars: bool=False,
+    compress_coords: bool=False,
+    shards: dict=None,
+    codec: str=None,
+    var_codecs: dict=None,
+    num_workers: int=1,
+    executor: str="thread",
+    restart: bool=False,
+) -> dict:
+    """
+    Write a dataset to a zarr file as disjoint time regions written in parallel.
+    
+    The store metadata and the coordinates are written once, then regions of `region_timesteps` 
+    timesteps are written by a pool of `num_workers` threads or processes. Completed regions are 
+    recorded in `<path>.manifest.yaml`, so a rerun on the same data only writes the missing regions.
+    
+    Args:
+        region_timesteps: int
+            Number of timesteps per region, must be a multiple of the time chunk (or shard) size.
+        num_workers: int
+            Number of regions written concurrently.
+        executor: str
+            Pool of the region writers, "thread" or "process".
+        restart: bool
+            Ignore the manifest and rewrite the store from scratch.
+    
+    Other arguments are as in `write_zarr`. Returns a summary of the write.
+    """
+    assert executor in ["thread", "process"], f"Unknown executor: {executor}"
+    ds, encoding, new_chunks, shards = _prepare_write(ds, new_chunks, compress_vars, compress_coords, shards, codec, var_codecs)
+    time_block = (shards or new_chunks or {}).get("time", 1)
+    if region_timesteps % time_block != 0:
+        raise ValueError(f"Region size {region_timesteps} is not a multiple of the time chunk/shard size {time_block}")
+    
+    path = os.path.abspath(path)
+    manifest_path = path + ".manifest.yaml"
+    num_regions = -(-ds.sizes["time"] // region_timesteps)
+    fingerprint = {
+        "sizes": {d: int(n) for d, n in ds.sizes.items()},
+        "time_start": str(ds.time.values[0]),
+        "time_end": str(ds.time.values[-1]),
+        "variables": list(ds.data_vars) if isinstance(ds, xr.Dataset) else [ds.name],
+        "coords": _coords_digest(ds),
+        "chunks": new_chunks,
+        "shards": shards,
+        "compress_vars": compress_vars,
+        "compress_coords": compress_coords,
+        "codec": codec,
+        "var_codecs": var_codecs,
+        "region_timesteps": region_timesteps,
+        "zarr_format": zarr_format,
+    }
+    
+    # resume from the manifest if it describes the same write
+    manifest = None
+    if not restart and os.path.exists(manifest_path) and os.path.exists(path):
+        with open(manifest_path, "r") as f:
+            manifest = yaml.safe_load(f)
+        if manifest.get("fingerprint") != fingerprint:
+            logger.warning(f"Manifest {manifest_path} does not match this write, restarting from scratch")
+            manifest = None
+    
+    if manifest is None:
+        path = _prepare_path(path, exist_ok=True)
+        logger.info(f"Initializing {path} ({num_regions} regions of {region_timesteps} timesteps)")
+        ds.to_zarr(path, mode="w", encoding=encoding, zarr_format=zarr_format, compute=False)
+        manifest = {"fingerprint": fingerprint, "num_regions": num_regions, "completed": []}
+        _write_manifest(manifest_path, manifest)
+    
+    completed = set(manifest["completed"])
+    missing = [i for i in range(num_regions) if not i in completed]
+    logger.info(f"Writing {len(missing)}/{num_regions} regions to {path} with {num_workers} {executor} workers")
+    
+    pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    t0 = time.time()
+    nbytes = 0
+    with pool_class(num_workers) as pool:
+        futures = {
+            pool.submit(_write_region, ds, path, i * region_timesteps, min((i+1) * region_timesteps, ds.sizes["time"])): i 
+            for i in missing
+        }
+        for n, future in enumerate(as_completed(futures)):
+            nbytes += future.result()
+            completed.add(futures[future])
+            manifest["completed"] = sorted(completed)
+            _write_manifest(manifest_path, manifest)
+            elapsed = time.time() - t0
+            logger.info(f"Region {futures[future]} done ({n+1}/{len(missing)}): {nbytes/1024**2/elapsed:.2f}MB/s, {(n+1)/elapsed:.3f} regions/s")
+    
+    elapsed = time.time() - t0
+    return {
+        "num_regions": num_regions,
+        "written_regions": len(missing),
+        "time": elapsed,
+        "mb_per_s": nbytes / 1024**2 / elapsed if elapsed > 0 else 0.,
+        "regions_per_s": len(missing) / elapsed if elapsed > 0 else 0.,
+    }
+
+def _block_bytes(ds: xr.Dataset, chunks: dict, stacked: bool=False) -> int:
+    """
+    Bytes of a block of `chunks` of the largest variable, or of all variables if they are stacked in one array.
+    """
+    sizes = [ds[var].dtype.itemsize * int(np.prod([min(chunks.get(d, n), n) for d, n in ds[var].sizes.items()])) for var in ds.data_vars]
+    return sum(sizes) if stacked else max(sizes)
+
+def plan_rechunk(ds: xr.Dataset, target_chunks: dict, max_mem: int, stacked: bool=False) -> list[dict]:
+    """
+    Plan the rechunk of `ds` (opened with its stored chunks) to `target_chunks` (full sizes, no -1) 
+    in blocks of at most `max_mem` bytes.
+    
+    Each stage reads blocks of the least common multiple of its input and output chunks (capped at 
+    the dimension size), so every output chunk is computed from a single block and the dask graph has 
+    no all-to-all rechunk. If these blocks exceed `max_mem`, the rechunk goes through an intermediate 
+    store chunked like min(source, target) on each dimension: the first stage reads single source 
+    chunks, the second stage single target chunks. `stacked`: the target stacks all variables in one array.
+    
+    Returns a list of stages {"read": block shape, "write": output chunks, "block_bytes": ...}.
+    """
+    source = {}
+    for var in ds.data_vars:
+        for d, c in ds[var].chunksizes.items():
+            source[d] = max(source.get(d, 1), max(c))
+    for d, n in ds.sizes.items():
+        source.setdefault(d, n)
+    
+    def stage(input_chunks, output_chunks, stacked):
+        read = {d: min(math.lcm(input_chunks[d], output_chunks[d]), n) for d, n in ds.sizes.items()}
+        return {"read": read, "write": dict(output_chunks), "block_bytes": _block_bytes(ds, read, stacked)}
+    
+    direct = stage(source, target_chunks, stacked)
+    if direct["block_bytes"] <= max_mem:
+        return [direct]
+    intermediate = {d: min(source[d], target_chunks[d]) for d in ds.sizes}
+    stages = [stage(source, intermediate, False), stage(intermediate, target_chunks, stacked)]
+    for s in stages:
+        if s["block_bytes"] > max_mem:
+            raise ValueError(f"Cannot rechunk in blocks of {max_mem/1024**2:.2f}MB: blocks of {s['read']} take {s['block_bytes']/1024**2:.2f}MB, increase the memory budget")
+    return stages
+
+def rechunk_zarr(
+    ds: xr.Dataset, 
+    path: str, 
+    new_chunks: dict, 
+    max_mem: int, 
+    temp_path: str=None,
+    compress_vars: bool=False,
+    compress_coords: bool=False,
+    shards: dict=None,
+    codec: str=None,
+    var_codecs: dict=None,
+    num_workers: int=1,
+    executor: str="thread",
+    restart: bool=False,
+) -> dict:
+    """
+    Rechunk a dataset to a zarr file with bounded memory.
+    
+    `ds` must be opened with its stored chunks (`chunks={}`). The stages planned by `plan_rechunk` 
+    (the target chunks are the shards with sharding) are written with `write_zarr_regions`, in 
+    regions of one block of timesteps by `num_workers` workers, so the memory of the write is 
+    about `num_workers * max_mem`. A two-stage rechunk goes through `temp_path` (default: 
+    `<path>.tmp`), removed once the output is complete. Other arguments are as in `write_zarr_regions`.
+    Returns a summary of the rechunk, with the peak RSS of the process (and of the process workers).
+    """
+    stacked = new_chunks is not None and len(new_chunks) == len(ds.sizes)+1
+    target = {d: ds.sizes[d] if new_chunks.get(d, -1) == -1 else min(new_chunks[d], ds.sizes[d]) for d in ds.sizes}
+    if shards is not None:
+        target = {d: ds.sizes[d] if shards.get(d) == -1 else min(shards.get(d, chunk), ds.sizes[d]) for d, chunk in target.items()}
+    stages = plan_rechunk(ds, target, max_mem, stacked=stacked)
+    temp_path = temp_path or os.path.abspath(path) + ".tmp"
+    logger.info(f"Rechunking in {len(stages)} stage(s) with blocks of at most {max_mem/1024**2:.2f}MB: " + ", ".join(f"{s['read']} ({s['block_bytes']/1024**2:.2f}MB)" for s in stages))
+    
+    t0 = time.time()
+    summaries = []
+    for k, stage in enumerate(stages):
+        last = k == len(stages)-1
+        # blocks are multiples of the input chunks, and split into the output chunks by the writer
+        source = ds.chunk({d: stage["read"][d] for d in ds.sizes})
+        if last:
+            summary = write_zarr_regions(
+                source, path, region_timesteps=stage["read"]["time"], new_chunks=new_chunks, compress_vars=compress_vars, 
+                compress_coords=compress_coords, shards=shards, codec=codec, var_codecs=var_codecs, 
+                num_workers=num_workers, executor=executor, restart=restart,
+            )
+        else:
+            summary = write_zarr_regions(source, temp_path, region_timesteps=stage["read"]["time"], new_chunks=stage["write"], num_workers=num_workers, executor=executor, restart=restart)
+            ds = xr.open_zarr(temp_path, chunks={}, zarr_format=zarr_format)
+        logger.info(f"Stage {k+1}/{len(stages)} done in {summary['time']:.1f}s ({summary['mb_per_s']:.2f}MB/s)")
+        summaries.append({"read": stage["read"], "write": stage["write"], "block_mb": stage["block_bytes"] / 1024**2, **summary})
+    
+    if len(stages) > 1:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if os.path.exists(temp_path + ".manifest.yaml"): os.remove(temp_path + ".manifest.yaml")
+    elapsed = time.time() - t0
+    return {
+        "stages": summaries,
+        "time": elapsed,
+        "mb_per_s": ds.nbytes / 1024**2 / elapsed if elapsed > 0 else 0.,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+def write_memmap(ds: xr.Dataset|xr.DataArray, path: str, variables: list[str], levels: list[int], block_timesteps: int=16, exist_ok: bool=True) -> dict:
+    """
+    Write a dataset to a directory holding one flat, uncompressed (time, channel, lat, lon) array
+    (`MemmapDataset.DATA_FILE`, C order, native endianness) and a json sidecar with the shape, dtype,
+    channels, times and coordinates (`MemmapDataset.METADATA_FILE`, written last, so an interrupted
+    export has no sidecar). Channels are laid out as in `BaseDataset`: one channel per surface
+    variable and one per level of the other variables. Blocks of `block_timesteps` timesteps are
+    decoded straight into the mapped file. Returns a summary of the write.
+    """
+    path = _prepare_path(path, exist_ok=exist_ok)
+    os.makedirs(path)
+    
+    # BaseDataset resolves the channel layout and reads timesteps into (T, C, H, W) buffers
+    dataset = BaseDataset(ds, num_input_timesteps=1, num_output_timesteps=1, variables=variables, levels=levels)
+    shape = (dataset.total_timesteps, dataset.num_channels, *dataset.spatial_shape)
+    data = np.memmap(os.path.join(path, MemmapDataset.DATA_FILE), dtype=dataset.dtype, mode="w+", shape=shape)
+    
+    t0 = time.time()
+    for start in range(0, shape[0], block_timesteps):
+        stop = min(start + block_timesteps, shape[0])
+        dataset._fill_span(data[start:stop], start)
+        elapsed = time.time() - t0
+        logger.info(f"Timesteps {start}-{stop} of {shape[0]} written: {data[:stop].nbytes/1024**2/elapsed:.2f}MB/s")
+    data.flush()
+    del data
+    
+    metadata = {
+        "shape": list(shape),
+        "dtype": np.dtype(dataset.dtype).str,
+        "channels": [[var, None if level is None else int(level)] for var, level in dataset.layout],
+        "times": [str(t) for t in dataset.ds["time"].values],
+        "latitude": dataset.ds["latitude"].values.tolist(),
+        "longitude": dataset.ds["longitude"].values.tolist(),
+    }
+    tmp_path = os.path.join(path, MemmapDataset.METADATA_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, os.path.join(path, MemmapDataset.METADATA_FILE))
+    
+    elapsed = time.time() - t0
+    nbytes = int(np.prod(shape)) * np.dtype(dataset.dtype).itemsize
+    return {"shape": list(shape), "nbytes": nbytes, "time": elapsed, "mb_per_s": nbytes / 1024**2 / elapsed if elapsed > 0 else 0.}